@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="avatar_version",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
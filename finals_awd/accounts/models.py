@@ -1,3 +1,5 @@
+import time
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 # Create your models here.
@@ -8,10 +10,23 @@ class CustomUser(AbstractUser):
     profile_picture = models.ImageField(upload_to='profiles/',
                                         null=True, blank=True)
     bio = models.TextField(blank = True)
+    #Upload time of the current picture; part of its URL so it can be cached for good
+    avatar_version = models.PositiveBigIntegerField(default=0, editable=False)
 
     @property
-    def notifications(self):
-        return self.chat_notifications.all()
+    def avatar_url(self):
+        """Profile picture URL that changes whenever the picture does, or None."""
+        if not self.profile_picture:
+            return None
+        return f"{self.profile_picture.url}?v={self.avatar_version}"
+
+    def save(self, *args, **kwargs):
+        #A newly assigned upload isn't committed to storage until the field saves it
+        if self.profile_picture and not self.profile_picture._committed:
+            self.avatar_version = int(time.time())
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'avatar_version'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.username
@@ -1,3 +1,71 @@
-from django.test import TestCase
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import RequestFactory, TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from accounts.models import CustomUser
+from elearning_platform.media import IMMUTABLE_CACHE_CONTROL, serve_media
 
 # Create your tests here.
+
+#1x1 transparent PNG
+PNG = (
+    b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
+    b'\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82'
+)
+
+
+#Uploads go to a scratch directory, not the project's media folder
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class AvatarUrlTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='student', password='testpass')
+
+    def test_version_changes_only_when_the_picture_does(self):
+        self.assertIsNone(self.user.avatar_url)
+
+        self.user.profile_picture = SimpleUploadedFile('me.png', PNG, content_type='image/png')
+        self.user.save()
+        first = self.user.avatar_url
+        self.assertTrue(first.endswith(f'?v={self.user.avatar_version}'))
+        self.assertGreater(self.user.avatar_version, 0)
+
+        self.user.bio = 'Hello'
+        self.user.save()
+        self.assertEqual(self.user.avatar_url, first)
+
+        self.user.avatar_version = 0  # pretend the first upload was long ago
+        self.user.profile_picture = SimpleUploadedFile('me.png', PNG, content_type='image/png')
+        self.user.save(update_fields=['profile_picture'])
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.user.avatar_url, first)
+        self.assertGreater(self.user.avatar_version, 0)
+
+    def test_only_versioned_avatars_are_cached_for_good(self):
+        self.user.profile_picture = SimpleUploadedFile('me.png', PNG, content_type='image/png')
+        self.user.save()
+        path = self.user.profile_picture.name
+        factory = RequestFactory()
+
+        def cache_control(url):
+            response = serve_media(factory.get(url), path, document_root=settings.MEDIA_ROOT)
+            self.assertEqual(response.status_code, 200)
+            return response.get('Cache-Control')
+
+        self.assertEqual(cache_control(self.user.avatar_url), IMMUTABLE_CACHE_CONTROL)
+        self.assertIsNone(cache_control(self.user.profile_picture.url))
+
+    def test_uploads_are_not_served_without_debug(self):
+        self.user.profile_picture = SimpleUploadedFile('me.png', PNG, content_type='image/png')
+        self.user.save()
+        self.assertEqual(self.client.get(self.user.avatar_url).status_code, 404)
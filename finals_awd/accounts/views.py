@@ -1,9 +1,9 @@
-from django.http import Http404
 from django.shortcuts import render, redirect, get_object_or_404
 from .forms import RegistrationForm, ProfilePictureForm
 
 from django.contrib.auth.decorators import login_required
-from courses.models import Course, Enrollment
+from courses import membership
+from courses.models import Course
 from django.contrib import messages
 # Create your views here.
 
@@ -61,18 +61,9 @@ def public_profile(request, user_id, course_id):
     user_profile = get_object_or_404(CustomUser,id=user_id )
     course = get_object_or_404(Course, id =course_id)
 
-    #Only fetch and check course access if course_id is provided
+    #Only check course access if course_id is provided
     if course_id and course_id != 0:
-        try:
-            course=Course.objects.get(id=course_id)
-        except Course.DoesNotExist:
-            raise Http404("Course does not exist")
-        
-
-        is_participant = (
-            request.user == course.teacher or
-            request.user.enrollments.filter(course=course).exists()
-        )
+        is_participant = membership.is_member(request.user, course.id)
 
         if not is_participant:
             messages.warning(request, "You must be enrolled in this course to view this profile.")
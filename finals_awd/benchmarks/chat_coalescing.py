@@ -0,0 +1,138 @@
+"""Course chat delivery with and without outbound frame coalescing.
+
+    python -m benchmarks.chat_coalescing [--sizes 10 100] [--messages 200] [--window 5]
+
+"end to end": a room of that many sockets through the in-memory channel
+layer; one of them sends `--messages` messages back to back and every socket
+reads all of them. Reports messages delivered per second and WebSocket
+frames each socket was sent per message.
+
+"handler": only the recipients' chat_message calls, with a send that counts
+frames instead of writing them, as in chat_fanout. CPU per delivered message
+is what each recipient spends encoding frames and calling into the server,
+which is where one frame per message costs a write (and a syscall) each.
+
+"per message" is COALESCE_MS 0; "coalesced" uses `--window` milliseconds.
+Only messages closer together than the window are batched, and the test
+client is slow enough that in large rooms here they arrive further apart
+than 5 ms; try a wider --window there.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import setup, test_database
+
+setup()
+
+from channels.layers import channel_layers  # noqa: E402
+from channels.routing import URLRouter  # noqa: E402
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.test import override_settings  # noqa: E402
+
+from accounts.models import CustomUser  # noqa: E402
+from chat import outbound  # noqa: E402
+from chat.consumers import ChatConsumer  # noqa: E402
+from chat.routing import websocket_urlpatterns  # noqa: E402
+from courses.models import Course  # noqa: E402
+
+
+async def connect(user, course):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{course.id}/')
+    communicator.scope['user'] = user
+    await communicator.connect()
+    await communicator.receive_json_from()  # users frame
+    await communicator.receive_json_from()  # history frame
+    return communicator
+
+
+async def read(communicator, messages):
+    """Frames it took to get `messages` chat messages."""
+    seen = frames = 0
+    while seen < messages:
+        frame = await communicator.receive_json_from(timeout=30)
+        frames += 1
+        if frame['type'] == 'batch':
+            seen += sum(1 for inner in frame['frames'] if inner['type'] == 'message')
+        elif frame['type'] == 'message':
+            seen += 1
+    return frames
+
+
+async def end_to_end(user, course, size, messages):
+    sockets = [await connect(user, course) for _ in range(size)]
+    start = time.perf_counter()
+    reading = [asyncio.ensure_future(read(communicator, messages)) for communicator in sockets]
+    for i in range(messages):
+        await sockets[0].send_to(text_data=json.dumps({'message': f'coalesce {i}'}))
+    frames = await asyncio.gather(*reading)
+    elapsed = time.perf_counter() - start
+    for communicator in sockets:
+        await communicator.disconnect()
+    return size * messages / elapsed, sum(frames) / (size * messages)
+
+
+async def handler(size, messages):
+    sent = []
+
+    async def count(message):
+        sent.append(message)
+
+    sockets = []
+    for _ in range(size):
+        instance = ChatConsumer()
+        instance.room_group_name = 'chat_bench'
+        instance.base_send = count
+        instance.outbound = outbound.Outbound(instance, coalesce=True)
+        sockets.append(instance)
+
+    entry = {'id': 'b0f7c7a2-4c1e-4a53-9d4c-2f7e5b1d2a11', 'seq': 0, 'user_id': 1,
+             'message': 'x' * 120, 'timestamp': '10:30'}
+    start = time.process_time()
+    for i in range(messages):
+        text = json.dumps({'type': 'message', **entry, 'seq': i})
+        for instance in sockets:
+            await instance.chat_message({'type': 'chat_message', 'text': text})
+    for instance in sockets:
+        await instance.outbound.flush()
+    cpu = time.process_time() - start
+    return cpu / (size * messages) * 1_000_000, len(sent) / (size * messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--window', type=float, default=5)
+    args = parser.parse_args()
+
+    in_memory = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 100_000}}}
+    with test_database(), override_settings(CHANNEL_LAYERS=in_memory, CHAT_RATE_LIMITS={'ENABLED': False},
+                                            CHAT_RECENT_MESSAGES={'BACKEND': 'local'}):
+        channel_layers.backends.clear()
+        user = CustomUser.objects.create(username='teacher', is_teacher=True)
+        course = Course.objects.create(title='Lecture', description='', teacher=user)
+
+        windows = (0, args.window)
+        print(f"{args.messages} messages, coalescing window {args.window} ms")
+        print(f"{'':36}{'per message':>14}{'coalesced':>14}")
+        for size in args.sizes:
+            rates, frames = [], []
+            for window in windows:
+                with override_settings(CHAT_OUTBOUND={'COALESCE_MS': window}):
+                    rate, per_message = asyncio.run(end_to_end(user, course, size, args.messages))
+                rates.append(rate)
+                frames.append(per_message)
+            print(f"  room of {size:>4}, end to end, msgs/s    {rates[0]:14.0f}{rates[1]:14.0f}")
+            print(f"  room of {size:>4}, frames per message    {frames[0]:14.2f}{frames[1]:14.2f}")
+        for size in args.sizes:
+            cpu = []
+            for window in windows:
+                with override_settings(CHAT_OUTBOUND={'COALESCE_MS': window}):
+                    cpu.append(asyncio.run(handler(size, args.messages))[0])
+            print(f"  room of {size:>4}, handler CPU us/msg    {cpu[0]:14.2f}{cpu[1]:14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Course chat connects per second, with and without the recent-message buffer.
+
+    python -m benchmarks.chat_connects [--connects 300] [--history 20000]
+
+A room with `--history` messages gets one long-lived socket (the class that
+is already in it), then `--connects` sockets each connect, read the history
+frame and disconnect. "database" turns chat.recent off so every replay reads
+the Message table; "buffer" serves it from the in-process buffer.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import setup, test_database
+
+setup()
+
+from channels.layers import channel_layers  # noqa: E402
+from channels.routing import URLRouter  # noqa: E402
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.test import override_settings  # noqa: E402
+
+from accounts.models import CustomUser  # noqa: E402
+from chat.models import Message, RoomSequence, course_room  # noqa: E402
+from chat.routing import websocket_urlpatterns  # noqa: E402
+from courses.models import Course  # noqa: E402
+
+
+def seed(history):
+    teacher = CustomUser.objects.create(username='teacher', is_teacher=True)
+    course = Course.objects.create(title='Lecture', description='', teacher=teacher)
+    Message.objects.bulk_create((
+        Message(course=course, sender=teacher, content=f'old {i}', seq=i + 1)
+        for i in range(history)
+    ), batch_size=2000)
+    RoomSequence.objects.create(room=course_room(course.id), last_seq=history)
+    return teacher, course
+
+
+async def connect(user, course):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{course.id}/')
+    communicator.scope['user'] = user
+    await communicator.connect()
+    await communicator.receive_json_from()  # users frame
+    await communicator.receive_json_from()  # history frame
+    return communicator
+
+
+async def connects_per_second(user, course, count):
+    anchor = await connect(user, course)
+    start = time.perf_counter()
+    for _ in range(count):
+        communicator = await connect(user, course)
+        await communicator.disconnect()
+    elapsed = time.perf_counter() - start
+    await anchor.disconnect()
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connects', type=int, default=300)
+    parser.add_argument('--history', type=int, default=20_000)
+    args = parser.parse_args()
+
+    in_memory = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+    with test_database(), override_settings(CHANNEL_LAYERS=in_memory):
+        channel_layers.backends.clear()
+        user, course = seed(args.history)
+
+        rates = {}
+        for label, backend in (('database', ''), ('buffer', 'local')):
+            with override_settings(CHAT_RECENT_MESSAGES={'BACKEND': backend}):
+                rates[label] = asyncio.run(connects_per_second(user, course, args.connects))
+
+        print(f"connects/s per room: database {rates['database']:8.1f}   buffer {rates['buffer']:8.1f}"
+              f"   ({rates['buffer'] / rates['database']:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""CPU time per delivered course chat message, by room size.
+
+    python -m benchmarks.chat_fanout [--sizes 10 100 1000] [--messages 20]
+
+Each room has that many sockets connected through the in-memory channel
+layer; one of them sends `--messages` messages and every socket reads each
+one. "per recipient" is the old ChatConsumer.chat_message, which built and
+json-encoded the frame again in every socket; "encoded once" is the current
+one, which forwards the text the sender encoded.
+
+"end to end" includes the channel layer and the test client reading every
+frame; "handler" is only the recipients' chat_message calls, which is the
+part this change touches.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import setup, test_database
+
+setup()
+
+from channels.layers import channel_layers  # noqa: E402
+from channels.routing import URLRouter  # noqa: E402
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from django.urls import re_path  # noqa: E402
+
+from accounts.models import CustomUser  # noqa: E402
+from chat import outbound  # noqa: E402
+from chat.consumers import ChatConsumer  # noqa: E402
+from courses.models import Course  # noqa: E402
+
+
+class PerRecipientChatConsumer(ChatConsumer):
+    async def chat_message(self, event):
+        entry = event['entry']
+        await self.send(text_data=json.dumps({
+            'type': 'message',
+            'id': entry['id'],
+            'seq': entry['seq'],
+            'user_id': entry['user_id'],
+            'message': entry['message'],
+            'timestamp': entry['timestamp'],
+        }))
+
+
+def router(consumer):
+    return URLRouter([re_path(r'ws/chat/(?P<course_id>\d+)/$', consumer.as_asgi())])
+
+
+async def cpu_per_delivery(consumer, user, course, size, messages):
+    app = router(consumer)
+    sockets = []
+    for _ in range(size):
+        communicator = WebsocketCommunicator(app, f'/ws/chat/{course.id}/')
+        communicator.scope['user'] = user
+        await communicator.connect()
+        await communicator.receive_from()  # users frame
+        await communicator.receive_from()  # history frame
+        sockets.append(communicator)
+
+    start = time.process_time()
+    for i in range(messages):
+        await sockets[0].send_to(text_data=json.dumps({'message': f'fanout {i}'}))
+        for communicator in sockets:
+            await communicator.receive_from(timeout=10)
+    cpu = time.process_time() - start
+
+    for communicator in sockets:
+        await communicator.disconnect()
+    return cpu / (size * messages) * 1_000_000
+
+
+async def handler_cpu_per_delivery(consumer, size, messages):
+    sockets = []
+    for _ in range(size):
+        instance = consumer()
+        instance.room_group_name = 'chat_bench'
+        instance.base_send = _discard
+        instance.outbound = outbound.Outbound(instance)
+        sockets.append(instance)
+
+    entry = {'id': 'b0f7c7a2-4c1e-4a53-9d4c-2f7e5b1d2a11', 'seq': 0, 'user_id': 1,
+             'message': 'x' * 120, 'timestamp': '10:30'}
+    start = time.process_time()
+    for i in range(messages):
+        entry = {**entry, 'seq': i}
+        event = {'type': 'chat_message', 'text': json.dumps({'type': 'message', **entry}), 'entry': entry}
+        for instance in sockets:
+            await instance.chat_message(event)
+    cpu = time.process_time() - start
+    return cpu / (size * messages) * 1_000_000
+
+
+async def _discard(message):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--messages', type=int, default=20)
+    args = parser.parse_args()
+
+    in_memory = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 10_000}}}
+    with test_database(), override_settings(CHANNEL_LAYERS=in_memory,
+                                            CHAT_RECENT_MESSAGES={'BACKEND': 'local'},
+                                            CHAT_RATE_LIMITS={'ENABLED': False}):
+        channel_layers.backends.clear()
+        user = CustomUser.objects.create(username='teacher', is_teacher=True)
+        course = Course.objects.create(title='Lecture', description='', teacher=user)
+
+        print("CPU us per delivered message         per recipient   encoded once")
+        for size in args.sizes:
+            before = asyncio.run(cpu_per_delivery(PerRecipientChatConsumer, user, course, size, args.messages))
+            after = asyncio.run(cpu_per_delivery(ChatConsumer, user, course, size, args.messages))
+            print(f"  room of {size:>5}, end to end         {before:10.1f}     {after:10.1f}")
+        for size in args.sizes:
+            # More messages: the handler alone is too quick to time over 20
+            before = asyncio.run(handler_cpu_per_delivery(PerRecipientChatConsumer, size, args.messages * 50))
+            after = asyncio.run(handler_cpu_per_delivery(ChatConsumer, size, args.messages * 50))
+            print(f"  room of {size:>5}, handler            {before:10.2f}     {after:10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Messages per second through the course chat write path.
+
+    python -m benchmarks.chat_write_path [--messages 500] [--history 20000]
+
+"before" replays the old per-message queries (re-fetch the Course, INSERT,
+then look up the sender's latest message across every room); "after" is the
+single INSERT ChatConsumer.save_message does now. The last lines drive real
+ChatConsumer sockets through the in-memory channel layer, end to end, with
+and without the write-behind buffer (chat.writebehind). Write-behind runs
+once per way of numbering messages: "database" still does one UPDATE per
+message on the room's RoomSequence row, "local" takes no database round trip
+before the broadcast (Redis, in production, adds one Redis INCR instead).
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import setup, test_database
+
+setup()
+
+from channels.layers import channel_layers  # noqa: E402
+from channels.routing import URLRouter  # noqa: E402
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.test import override_settings  # noqa: E402
+
+from accounts.models import CustomUser  # noqa: E402
+from chat.models import Message, RoomSequence, course_room  # noqa: E402
+from chat.routing import websocket_urlpatterns  # noqa: E402
+from courses.models import Course  # noqa: E402
+
+
+def seed(history):
+    teacher = CustomUser.objects.create(username='teacher', is_teacher=True)
+    courses = Course.objects.bulk_create([
+        Course(title=f'Course {i}', description='', teacher=teacher) for i in range(10)
+    ])
+    # The sender's older messages in other rooms are what the old latest() lookup scanned
+    Message.objects.bulk_create((
+        Message(course=courses[i % len(courses)], sender=teacher, content=f'old {i}',
+                seq=i // len(courses) + 1)
+        for i in range(history)
+    ), batch_size=2000)
+    RoomSequence.objects.bulk_create(
+        RoomSequence(room=course_room(course.id), last_seq=Message.objects.filter(course=course).count())
+        for course in courses
+    )
+    return teacher, courses[0]
+
+
+def legacy_write(course_id, sender, text):
+    course = Course.objects.get(id=course_id)
+    Message.objects.create(course=course, sender=sender, content=text)
+    msg = Message.objects.filter(sender=sender).latest('timestamp')
+    return msg.timestamp.strftime('%H:%M')
+
+
+def lean_write(course, sender, text):
+    msg = Message.objects.create(course=course, sender=sender, content=text)
+    return msg.id, msg.timestamp.strftime('%H:%M')
+
+
+def rate(func, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return count / (time.perf_counter() - start)
+
+
+async def end_to_end(sender, course, count):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{course.id}/')
+    communicator.scope['user'] = sender
+    await communicator.connect()
+    await communicator.receive_json_from()  # users frame
+    await communicator.receive_json_from()  # history frame
+
+    start = time.perf_counter()
+    for i in range(count):
+        await communicator.send_json_to({'message': f'live {i}'})
+        await communicator.receive_json_from()
+    elapsed = time.perf_counter() - start
+    await communicator.disconnect()
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--history', type=int, default=20_000)
+    args = parser.parse_args()
+
+    with test_database():
+        sender, course = seed(args.history)
+
+        before = rate(lambda i: legacy_write(course.id, sender, f'before {i}'), args.messages)
+        after = rate(lambda i: lean_write(course, sender, f'after {i}'), args.messages)
+        print(f"write path, msgs/s per room: before {before:8.1f}   after {after:8.1f}"
+              f"   ({after / before:.1f}x)")
+
+        in_memory = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        #One socket sending flat out; the inbound limits would turn most of it away
+        with override_settings(CHANNEL_LAYERS=in_memory, CHAT_RATE_LIMITS={'ENABLED': False}):
+            channel_layers.backends.clear()
+            live = asyncio.run(end_to_end(sender, course, args.messages))
+            buffered = {}
+            for sequences in ('database', 'local'):
+                with override_settings(CHAT_WRITE_BEHIND={'ENABLED': True, 'SEQUENCES': sequences}):
+                    buffered[sequences] = asyncio.run(end_to_end(sender, course, args.messages))
+        print(f"ChatConsumer end to end, msgs/s per room: {live:8.1f}")
+        for sequences, result in buffered.items():
+            print(f"{f'  with write-behind, {sequences} seqs:':42}{result:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
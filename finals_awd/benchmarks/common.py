@@ -0,0 +1,46 @@
+"""Shared helpers for the scripts in this package.
+
+Every benchmark runs against a throwaway test database created from the
+configured DATABASES (``test_<name>``), so it never touches real data:
+
+    python -m benchmarks.query_plans
+"""
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+import django
+
+
+def setup():
+    # Same bootstrapping as elearning_platform/asgi.py
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "elearning_platform.settings")
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """Create, migrate and finally destroy a disposable test database."""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def timed(func, repeat=20):
+    """Median wall time of `func()` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
@@ -0,0 +1,125 @@
+"""Cost of a user's open DM threads: a socket each, or one socket for all.
+
+    python -m benchmarks.dm_sockets [--users 50] [--threads 5]
+
+Each of `--users` users keeps `--threads` private conversations open.
+"socket per thread" is how ws/private/<user_id>/ worked: one connection (with
+its own cookie-session handshake) and one channel-layer subscription per
+conversation. "one socket" is ws/dm/, which opens every conversation over a
+single connection subscribed to the user's own group.
+
+Sockets go through AuthMiddlewareStack with a real session cookie, so the
+handshake includes the session and user lookups. Memory is what tracemalloc
+sees still allocated while every socket is open.
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from benchmarks.common import setup, test_database
+
+setup()
+
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.layers import channel_layers, get_channel_layer  # noqa: E402
+from channels.routing import URLRouter  # noqa: E402
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+
+from accounts.models import CustomUser  # noqa: E402
+from chat.routing import websocket_urlpatterns  # noqa: E402
+
+
+def seed(users, threads):
+    """`users` users with a session each, and `threads` people each of them talks to."""
+    people = CustomUser.objects.bulk_create(
+        CustomUser(username=f'user{i}') for i in range(users + threads))
+    talkers, others = people[:users], people[users:]
+    cookies = []
+    for user in talkers:
+        client = Client()
+        client.force_login(user)
+        cookies.append(f"sessionid={client.cookies['sessionid'].value}".encode())
+    return cookies, [other.id for other in others]
+
+
+async def connect(app, cookie):
+    communicator = WebsocketCommunicator(app, '/ws/dm/', headers=[(b'host', b'localhost'), (b'cookie', cookie)])
+    connected, _ = await communicator.connect()
+    assert connected
+    return communicator
+
+
+async def open_thread(communicator, other_id):
+    await communicator.send_json_to({'action': 'open', 'user_id': other_id})
+    await communicator.receive_json_from()  # users frame
+    await communicator.receive_json_from()  # history frame
+
+
+async def socket_per_thread(app, cookie, others):
+    sockets = []
+    for other_id in others:
+        communicator = await connect(app, cookie)
+        await open_thread(communicator, other_id)
+        sockets.append(communicator)
+    return sockets
+
+
+async def one_socket(app, cookie, others):
+    communicator = await connect(app, cookie)
+    for other_id in others:
+        await open_thread(communicator, other_id)
+    return [communicator]
+
+
+def subscriptions():
+    return sum(len(channels) for channels in get_channel_layer().groups.values())
+
+
+async def measure(layout, cookies, others):
+    app = AuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    sockets = []
+    for cookie in cookies:
+        sockets += await layout(app, cookie, others)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    result = {
+        'sockets': len(sockets),
+        'subscriptions': subscriptions(),
+        'ms per user': elapsed / len(cookies) * 1000,
+        'KiB per user': memory / len(cookies) / 1024,
+    }
+    for communicator in sockets:
+        await communicator.disconnect()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=5)
+    args = parser.parse_args()
+
+    in_memory = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+    with test_database(), override_settings(CHANNEL_LAYERS=in_memory):
+        channel_layers.backends.clear()
+        cookies, others = seed(args.users, args.threads)
+
+        results = {}
+        for label, layout in (('socket per thread', socket_per_thread), ('one socket', one_socket)):
+            results[label] = asyncio.run(measure(layout, cookies, others))
+
+        print(f"{args.users} users with {args.threads} open threads each")
+        print(f"{'':20}{'sockets':>10}{'subscriptions':>15}{'ms per user':>14}{'KiB per user':>14}")
+        for label, result in results.items():
+            print(f"{label:20}{result['sockets']:>10}{result['subscriptions']:>15}"
+                  f"{result['ms per user']:>14.1f}{result['KiB per user']:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""EXPLAIN plans and timings for the hot queries, with and without the
+indexes added for them (notification inbox, unread counts, chat history,
+enrolment checks, DM threads, status feed).
+
+    python -m benchmarks.query_plans [--notifications 100000] [--messages 50000]
+
+The dataset is seeded once; the "before" run drops the indexes and the
+Enrollment unique constraint, the "after" run recreates them.
+"""
+import argparse
+from datetime import timedelta
+
+from benchmarks.common import setup, test_database, timed
+
+setup()
+
+from django.db import connection  # noqa: E402
+from django.db.models import Q  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from accounts.models import CustomUser  # noqa: E402
+from chat import history  # noqa: E402
+from chat.models import Conversation, Message, PrivateMessage  # noqa: E402
+from courses.models import Course, Enrollment  # noqa: E402
+from dashboard import inbox  # noqa: E402
+from dashboard.models import Notification, StatusUpdate  # noqa: E402
+
+HOT_INDEXES = [
+    (Notification, 'notif_recipient_created_idx'),
+    (Notification, 'notif_unread_idx'),
+    (Message, 'message_course_time_idx'),
+    (PrivateMessage, 'privmsg_conv_time_idx'),
+    (Conversation, 'conversation_low_recent_idx'),
+    (Conversation, 'conversation_high_recent_idx'),
+    (StatusUpdate, 'status_posted_on_idx'),
+]
+HOT_CONSTRAINTS = [
+    (Enrollment, 'unique_enrollment'),
+]
+
+
+def seed(notifications, messages):
+    users = CustomUser.objects.bulk_create([
+        CustomUser(username=f'user{i}', is_student=i > 0, is_teacher=i == 0)
+        for i in range(50)
+    ])
+    courses = Course.objects.bulk_create([
+        Course(title=f'Course {i}', description='', teacher=users[0]) for i in range(10)
+    ])
+    Enrollment.objects.bulk_create([
+        Enrollment(student=user, course=courses[(user.id + k) % len(courses)])
+        for user in users[1:] for k in range(3)
+    ])
+
+    # Half of everything goes to one power user, the rest is spread around
+    def recipient(i):
+        return users[1] if i % 2 else users[i % len(users)]
+
+    Notification.objects.bulk_create((
+        Notification(recipient=recipient(i), message=f'note {i}', is_read=i % 10 != 0)
+        for i in range(notifications)
+    ), batch_size=2000)
+    Message.objects.bulk_create((
+        Message(course=courses[i % len(courses)], sender=users[i % len(users)], content=f'msg {i}',
+                seq=i // len(courses) + 1)
+        for i in range(messages)
+    ), batch_size=2000)
+    # The power user has 20 threads; every other user talks to three neighbours
+    conversations = Conversation.objects.bulk_create(
+        [Conversation(user_low=users[1], user_high=users[k + 2]) for k in range(20)]
+        + [Conversation(user_low=users[i], user_high=users[(i + k) % 48 + 2])
+           for i in range(2, 50) for k in range(1, 4) if i < (i + k) % 48 + 2]
+    )
+    PrivateMessage.objects.bulk_create((
+        PrivateMessage(sender=users[1], receiver=users[i % 20 + 2], conversation=conversations[i % 20],
+                       content=f'dm {i}', room_name=conversations[i % 20].room_name, seq=i // 20 + 1)
+        for i in range(messages)
+    ), batch_size=2000)
+    # Threads of the power user end on a message from the other side, a few of them unread
+    now = timezone.now()
+    last = {}
+    for message in PrivateMessage.objects.order_by('id').only('id', 'conversation_id', 'seq'):
+        last[message.conversation_id] = message
+    for conversation in conversations:
+        conversation.last_activity = now - timedelta(minutes=conversation.pk)
+        if conversation.pk in last:
+            conversation.last_message = last[conversation.pk]
+            conversation.last_seq = last[conversation.pk].seq
+            conversation.last_read_low = conversation.last_seq
+            conversation.last_read_high = conversation.last_seq - conversation.pk % 3
+    Conversation.objects.bulk_update(
+        conversations, ['last_activity', 'last_message', 'last_seq', 'last_read_low', 'last_read_high'])
+    StatusUpdate.objects.bulk_create((
+        StatusUpdate(user=users[i % len(users)], content=f'status {i}') for i in range(5000)
+    ), batch_size=2000)
+    return users[1], users[2], courses[0], conversations[0]
+
+
+def hot_queries(power_user, sender, course, conversation):
+    """name -> (queryset to EXPLAIN, callable to time), mirroring the app code."""
+    # A cursor near the start of the room, i.e. after scrolling far back
+    deep_message = (
+        Message.objects.filter(course_id=course.id).order_by('timestamp', 'id')
+        .values_list('timestamp', 'id')[50]
+    )
+    return {
+        'inbox top 5 (notification branch)': (
+            Notification.objects.filter(recipient=power_user).order_by('-created_at', '-id')[:5],
+            lambda: inbox.latest(power_user, 5),
+        ),
+        'unread notification count': (
+            Notification.objects.filter(recipient=power_user, is_read=False),
+            lambda: Notification.objects.filter(recipient=power_user, is_read=False).count(),
+        ),
+        'unread DMs from watermarks': (
+            Conversation.objects.filter(Q(user_low=power_user) | Q(user_high=power_user)),
+            lambda: Conversation.unread_total(power_user.id),
+        ),
+        'course chat history': (
+            Message.objects.filter(course_id=course.id).order_by('-timestamp', '-id')[:21],
+            lambda: history.page(Message.objects.filter(course_id=course.id), 20),
+        ),
+        'course chat page deep in history': (
+            history.older_than(Message.objects.filter(course_id=course.id), *deep_message)
+            .order_by('-timestamp', '-id')[:21],
+            lambda: history.page(Message.objects.filter(course_id=course.id), 20, deep_message),
+        ),
+        'private thread history': (
+            PrivateMessage.objects.filter(conversation=conversation).order_by('-timestamp', '-id')[:51],
+            lambda: history.page(PrivateMessage.objects.filter(conversation=conversation), 50),
+        ),
+        'DM thread lookup': (
+            Conversation.objects.filter(user_low=power_user, user_high=sender),
+            lambda: Conversation.find(power_user.id, sender.id),
+        ),
+        'DM threads by message scan (old)': (
+            PrivateMessage.objects.filter(Q(sender=power_user) | Q(receiver=power_user))
+            .order_by('-timestamp')[:50],
+            lambda: list(PrivateMessage.objects.filter(Q(sender=power_user) | Q(receiver=power_user))
+                         .order_by('-timestamp')[:50]),
+        ),
+        'DM threads of a user': (
+            Conversation.for_user(power_user.id)[:20],
+            lambda: list(Conversation.for_user(power_user.id)[:20]),
+        ),
+        'enrolment check': (
+            Enrollment.objects.filter(student=power_user, course=course),
+            lambda: Enrollment.objects.filter(student=power_user, course=course).exists(),
+        ),
+        'status feed': (
+            StatusUpdate.objects.order_by('-posted_on')[:5],
+            lambda: list(StatusUpdate.objects.order_by('-posted_on')[:5]),
+        ),
+    }
+
+
+def _named(items, attr):
+    for model, name in items:
+        yield model, next(i for i in getattr(model._meta, attr) if i.name == name)
+
+
+def drop_indexes():
+    with connection.schema_editor() as editor:
+        for model, index in _named(HOT_INDEXES, 'indexes'):
+            editor.remove_index(model, index)
+        for model, constraint in _named(HOT_CONSTRAINTS, 'constraints'):
+            # SQLite drops constraints by rebuilding the table from model._meta,
+            # so hide the constraint from the model while it does that
+            declared = model._meta.constraints
+            model._meta.constraints = [c for c in declared if c is not constraint]
+            try:
+                editor.remove_constraint(model, constraint)
+            finally:
+                model._meta.constraints = declared
+
+
+def create_indexes():
+    with connection.schema_editor() as editor:
+        for model, index in _named(HOT_INDEXES, 'indexes'):
+            editor.add_index(model, index)
+        for model, constraint in _named(HOT_CONSTRAINTS, 'constraints'):
+            editor.add_constraint(model, constraint)
+
+
+def report(phase, queries):
+    print(f"\n=== {phase} ({connection.vendor}) ===")
+    results = {}
+    for name, (queryset, run) in queries.items():
+        results[name] = timed(run)
+        print(f"\n-- {name}: {results[name]:.3f} ms")
+        print(queryset.explain())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notifications', type=int, default=100_000)
+    parser.add_argument('--messages', type=int, default=50_000)
+    args = parser.parse_args()
+
+    with test_database():
+        power_user, sender, course, conversation = seed(args.notifications, args.messages)
+        queries = hot_queries(power_user, sender, course, conversation)
+
+        drop_indexes()
+        before = report('before: FK indexes only', queries)
+        create_indexes()
+        after = report('after: composite/partial indexes', queries)
+
+    print("\n=== summary (median ms) ===")
+    for name in queries:
+        print(f"{name:36} {before[name]:9.3f} -> {after[name]:9.3f}")
+
+
+if __name__ == '__main__':
+    main()
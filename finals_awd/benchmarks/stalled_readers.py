@@ -0,0 +1,117 @@
+"""Server memory held for clients that stop reading, with and without a high-water mark.
+
+    python -m benchmarks.stalled_readers [--readers 20] [--stalled 20] [--messages 2000]
+
+A course room has `--readers` sockets that read everything and answer the
+heartbeat, and `--stalled` sockets that never read again after connecting,
+like a laptop that went to sleep. One of the readers sends `--messages`
+messages. Frames a socket sends wait in its communicator's output queue
+until they are read, the way they wait in the ASGI server's write buffer for
+a real client, so what the stalled sockets hold is the size of those queues
+once every reader is done.
+
+"unbounded" sets the high-water mark out of reach, as before chat.outbound;
+"high-water" uses `--high-water` bytes. Drops are counted over every socket
+in the room (readers rarely fall that far behind) per stalled socket.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from benchmarks.common import setup, test_database
+
+setup()
+
+from channels.layers import channel_layers  # noqa: E402
+from channels.routing import URLRouter  # noqa: E402
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.test import override_settings  # noqa: E402
+
+from accounts.models import CustomUser  # noqa: E402
+from chat import outbound  # noqa: E402
+from chat.routing import websocket_urlpatterns  # noqa: E402
+from courses.models import Course  # noqa: E402
+
+
+async def connect(user, course):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{course.id}/')
+    communicator.scope['user'] = user
+    await communicator.connect()
+    await communicator.receive_json_from()  # users frame
+    await communicator.receive_json_from()  # history frame
+    return communicator
+
+
+async def read(communicator, messages):
+    """Read until `messages` chat messages arrived, answering pings on the way."""
+    seen = 0
+    while seen < messages:
+        frame = await communicator.receive_json_from(timeout=30)
+        if frame['type'] == 'ping':
+            await communicator.send_json_to({'action': 'pong', 'id': frame['id']})
+        elif frame['type'] == 'message':
+            seen += 1
+        elif frame['type'] == 'resync':
+            seen += frame['dropped']  # fell behind too
+
+
+def held(communicator):
+    """Bytes of the frames waiting to be read (the queued dicts and their text)."""
+    frames = list(communicator.output_queue._queue)
+    return sum(sys.getsizeof(frame) + sys.getsizeof(frame.get('text', '')) for frame in frames)
+
+
+async def run(user, course, readers, stalled, messages):
+    live = [await connect(user, course) for _ in range(readers)]
+    stuck = [await connect(user, course) for _ in range(stalled)]
+    dropped = outbound.stats['dropped_frames']
+
+    reading = [asyncio.ensure_future(read(communicator, messages)) for communicator in live]
+    payload = 'x' * 200
+    for i in range(messages):
+        await live[0].send_to(text_data=json.dumps({'message': f'{payload} {i}'}))
+        await asyncio.sleep(0)
+    await asyncio.gather(*reading)
+
+    memory = sum(held(communicator) for communicator in stuck)
+    queued = sum(communicator.output_queue.qsize() for communicator in stuck)
+    for communicator in live + stuck:
+        await communicator.disconnect()
+    return {
+        'KiB per stalled': memory / max(stalled, 1) / 1024,
+        'frames queued': queued / max(stalled, 1),
+        'frames dropped': (outbound.stats['dropped_frames'] - dropped) / max(stalled, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=20)
+    parser.add_argument('--stalled', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--high-water', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    in_memory = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 100_000}}}
+    with test_database(), override_settings(CHANNEL_LAYERS=in_memory, CHAT_RATE_LIMITS={'ENABLED': False}):
+        channel_layers.backends.clear()
+        user = CustomUser.objects.create(username='teacher', is_teacher=True)
+        course = Course.objects.create(title='Lecture', description='', teacher=user)
+
+        results = {}
+        for label, high_water in (('unbounded', 10 ** 12), ('high-water', args.high_water)):
+            limits = {'HIGH_WATER_BYTES': high_water, 'LOW_WATER_BYTES': high_water // 4,
+                      'HEARTBEAT_INTERVAL': 0.1, 'IDLE_TIMEOUT': 3600}
+            with override_settings(CHAT_OUTBOUND=limits):
+                results[label] = asyncio.run(run(user, course, args.readers, args.stalled, args.messages))
+
+        print(f"{args.messages} messages, {args.readers} readers, {args.stalled} stalled sockets")
+        print(f"{'':14}{'KiB per stalled':>17}{'frames queued':>15}{'frames dropped':>16}")
+        for label, result in results.items():
+            print(f"{label:14}{result['KiB per stalled']:>17.1f}{result['frames queued']:>15.0f}"
+                  f"{result['frames dropped']:>16.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,27 +5,73 @@ from rest_framework import status
 from drf_spectacular.utils import extend_schema
 
 from django.db.models import Q
-from .models import PrivateMessage, ChatNotification
-from .serializers import PrivateMessageSerializer, ChatNotificationSerializer, PrivateMessageCreateSerializer
+from . import direct, directory, presence, threads
+from courses import membership
+from .models import PrivateMessage, course_room
+from .serializers import (
+    ConversationSerializer, PrivateMessageSerializer, ChatNotificationSerializer, PrivateMessageCreateSerializer,
+)
+
+CONVERSATIONS_PAGE_SIZE = 20
+CONVERSATIONS_MAX_PAGE_SIZE = 50
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def private_chat_messages_api(request):
     messages = PrivateMessage.objects.filter(
         Q(sender=request.user) | Q(receiver=request.user)
-    ).order_by('-timestamp')[:50]
+    ).select_related('sender', 'receiver').order_by('-timestamp')[:50]
 
     serializer = PrivateMessageSerializer(messages, many=True)
     return Response(serializer.data)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def conversations_api(request):
+    #DM inbox: ?limit=20&before=<next from the previous page>
+    try:
+        limit = min(int(request.query_params.get('limit', CONVERSATIONS_PAGE_SIZE)), CONVERSATIONS_MAX_PAGE_SIZE)
+    except ValueError:
+        return Response({"detail": "limit must be a number"}, status=400)
+    page = threads.page(request.user, max(limit, 1), request.query_params.get('before'))
+    return Response({
+        'results': ConversationSerializer(page.items, many=True, context={'request': request}).data,
+        'next': page.next_cursor,
+    })
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def chat_notifications_api(request):
-    notes = ChatNotification.objects.filter(recipient=request.user).order_by('-timestamp')[:30]
+    notes = threads.received(request.user).select_related('user_low', 'user_high', 'last_message')[:30]
+    notes = [threads.as_notification(note, request.user.id) for note in notes]
     serializer = ChatNotificationSerializer(notes, many=True)
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def chat_users_api(request):
+    #Batch lookup for chat clients: ?ids=1,2,3 -> {users: [{id, username, profile_pic}]}
+    try:
+        ids = {int(i) for i in request.query_params.get('ids', '').split(',') if i.strip()}
+    except ValueError:
+        return Response({"detail": "ids must be comma separated user ids"}, status=400)
+    if len(ids) > directory.MAX_LOOKUP:
+        return Response({"detail": f"At most {directory.MAX_LOOKUP} ids per lookup"}, status=400)
+
+    prefix = request.build_absolute_uri('/')[:-1]
+    return Response({'users': directory.absolute(directory.users(ids), prefix)})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def course_presence_api(request, course_id):
+    #Who is in a course chat right now: {online: [user ids]}, from chat.presence, no queries
+    if not membership.is_member(request.user, course_id):
+        return Response({"detail": "Not a member of this course"}, status=403)
+    return Response({'online': sorted(presence.online(course_room(course_id)))})
+
+
 @extend_schema(
     request=PrivateMessageCreateSerializer,
     responses=PrivateMessageSerializer
@@ -36,5 +82,7 @@ def send_private_message(request):
     serializer = PrivateMessageCreateSerializer(data=request.data)
     if serializer.is_valid():
         message = serializer.save(sender=request.user)
+        #Also to both users' open sockets
+        direct.deliver(message)
         return Response(PrivateMessageSerializer(message).data, status=201)
     return Response(serializer.errors, status=400)
\ No newline at end of file
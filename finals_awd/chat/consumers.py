@@ -1,15 +1,22 @@
-import datetime
 import json
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 
-from accounts.models import CustomUser
-from .models import Message, PrivateMessage
+from .models import Conversation, Message, PrivateMessage
+from . import direct, directory, history, outbound, presence, ratelimit, recent, writebehind
+from courses import membership
 from courses.models import Course
 from channels.db import database_sync_to_async
+from django.core.exceptions import ValidationError
+
+from dashboard import counters
+from dashboard.realtime import notification_group
+from .models import PrivateMessage
 
-from .models import PrivateMessage, ChatNotification
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    HISTORY_PAGE_SIZE = 20
+
     async def connect(self):
         print("WebSocket connect attempt started")
         self.course_id = self.scope['url_route']['kwargs']['course_id']
@@ -23,203 +30,390 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
+        #Kept for the lifetime of the socket so writes don't re-fetch it
+        self.course = course
+        self.media_prefix = directory.media_prefix(self.scope)
+        self.write_behind = writebehind.enabled_for(course.id)
+        self.limiter = ratelimit.Limiter(user.id, course.id)
+        #Busy rooms can batch broadcasts (CHAT_OUTBOUND['COALESCE_MS'])
+        self.outbound = outbound.Outbound(self, coalesce=True, on_beat=self.renew_presence)
+        #Set once the client asks for the roster; other sockets skip presence frames
+        self.wants_presence = False
+
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        #After group_add, so the recent-message buffer can't miss a broadcast
+        recent.attach(self.room_group_name)
 
         await self.accept()
+        self.outbound.start()
+        await sync_to_async(presence.join)(self.room_group_name, user.id, self.channel_name)
+        presence.changed(self.room_group_name, online=[user.id])
 
-        messages = await self.get_last_messages(course.id)
-        for msg in messages:
-            username = await self.get_username(msg)
-            timestamp = await self.get_timestamp(msg)
-            profile_pic = await self.get_profile_pic(msg)
-            await self.send(text_data = json.dumps({
-                'username': username,
-                'message' : msg.content,
-                'timestamp': timestamp,
-                'profile_pic': profile_pic
-            }))
+        #Who's who first: messages only carry the sender's user_id
+        await self.send_users(await self.get_course_users())
+        #Replay recent history (or only what a reconnecting client missed) as one frame
+        await self.send_history(since=history.since(self.scope))
 
     async def disconnect(self,close_code):
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if hasattr(self, 'outbound'):
+            self.outbound.stop()
+            gone = await sync_to_async(presence.leave)(self.room_group_name, self.scope['user'].id, self.channel_name)
+            if gone:
+                presence.changed(self.room_group_name, offline=gone)
+        if hasattr(self, 'course'):
+            recent.detach(self.room_group_name)
+        if getattr(self, 'write_behind', False):
+            await writebehind.get_buffer().flush()
 
     async def receive(self,text_data):
-        data = json.loads(text_data)
-        message = data['message']
-        sender = self.scope['user']
+        #Oversized or malformed frames and floods are turned away before any work is done
+        data, error = self.limiter.read_frame(text_data)
+        if error:
+            await self.outbound.send(json.dumps(error))
+            return
+        if await self.outbound.received(data):
+            return
+        if data.get('action') in ('history_before', 'presence', 'typing'):
+            error = self.limiter.check_action()
+            if error:
+                await self.outbound.send(json.dumps(error))
+                return
+        #Scrolling up: the page before the oldest message the client has
+        if data.get('action') == 'history_before':
+            await self.send_history(before=data.get('before'))
+            return
+        if data.get('action') == 'presence':
+            self.wants_presence = True
+            online = await sync_to_async(presence.online)(self.room_group_name)
+            await self.outbound.send(json.dumps({'type': 'presence', 'roster': sorted(online)}))
+            return
+        if data.get('action') == 'typing':
+            presence.typing(self.room_group_name, self.scope['user'].id)
+            return
 
-        await self.save_message(self.course_id, sender,message)
-        timestamp = await self.get_latest_timestamp(sender)
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'username': sender.username,
-                'message': message,
-                'timestamp': timestamp,
-                'profile_pic': self.get_full_profile_pic_url(sender)
+        message = data.get('message')
+        error = self.limiter.check_message(message)
+        if error:
+            await self.outbound.send(json.dumps(error))
+            return
+        sender = self.scope['user']
 
-            }
-        )
+        msg, entry = await self.store_message(sender, message)
+        if self.write_behind:
+            #Broadcast now, the buffer writes the row shortly after
+            await writebehind.get_buffer().add(msg)
+        #Encode the frame once here; every socket in the room forwards the same text
+        event = {'type': 'chat_message', 'text': json.dumps({'type': 'message', **entry})}
+        if recent.wants_broadcasts():
+            event['entry'] = entry
+        await self.channel_layer.group_send(self.room_group_name, event)
 
     async def chat_message(self,event):
-        await self.send(text_data = json.dumps({
-            'username': event['username'],
-            'message':event['message'],
-            'timestamp': event['timestamp'],
-            'profile_pic': event['profile_pic'],
+        if 'entry' in event:
+            recent.received(self.room_group_name, event['entry'])
+        await self.outbound.broadcast(event['text'])
+
+    async def chat_presence(self, event):
+        #A debounced diff of who came, left and is typing (see chat.presence)
+        if self.wants_presence:
+            await self.outbound.broadcast(event['text'])
+
+    async def renew_presence(self):
+        expired = await sync_to_async(presence.refresh)(
+            self.room_group_name, self.scope['user'].id, self.channel_name)
+        if expired:
+            presence.changed(self.room_group_name, offline=expired)
+
+    async def chat_users(self, event):
+        #Someone joined the course (see chat.signals)
+        await self.send_users(event['users'])
+
+    async def send_users(self, users):
+        await self.outbound.send(json.dumps({
+            'type': 'users',
+            'users': directory.absolute(users, self.media_prefix),
+        }))
+
+    @database_sync_to_async
+    def get_course_users(self):
+        return directory.course_users(self.course.id)
+
+    async def recent_invalidate(self, event):
+        #A message of this room was deleted (see chat.signals)
+        recent.invalidate(self.room_group_name)
+
+    async def send_history(self, before=None, since=None):
+        if before is not None and self.write_behind:
+            #The cursor message may still be in the buffer
+            await writebehind.get_buffer().flush()
+        messages, has_more, since = await self.get_history(self.course.id, before, since)
+        await self.outbound.send(json.dumps({
+            'type': 'history',
+            'before': before,
+            #Set when this frame only holds the messages after the client's last seq
+            'since': since,
+            'messages': messages,
+            'has_more': has_more,
         }))
 
     @database_sync_to_async
-    def get_last_messages(self,course_id):
-        return Message.objects.filter(course_id=course_id).order_by('-timestamp')[:20][::-1]
+    def get_history(self, course_id, before=None, since=None):
+        #Serialized in the same thread hop; frames only need sender_id, so no join
+        queryset = Message.objects.filter(course_id=course_id)
+        if since is not None:
+            entries = recent.since(self.room_group_name, since)
+            if entries is not None:
+                return entries, False, since
+            messages = history.missed(queryset, since)
+            if messages is not None:
+                messages = self.with_pending(messages, course_id, since)
+                return [self.serialize_message(msg) for msg in messages], False, since
+            #Missed too much: start over from the newest page
+            since = None
+
+        if before is None:
+            cached = recent.latest(self.room_group_name, self.HISTORY_PAGE_SIZE)
+            if cached is not None:
+                return (*cached, None)
+            messages, has_more = history.page(queryset, self.HISTORY_PAGE_SIZE)
+            messages = self.with_pending(messages, course_id)
+            if len(messages) > self.HISTORY_PAGE_SIZE:
+                messages, has_more = messages[-self.HISTORY_PAGE_SIZE:], True
+            entries = [self.serialize_message(msg) for msg in messages]
+            recent.fill(self.room_group_name, entries)
+            return entries, has_more, None
+        else:
+            cursor = self.find_cursor(course_id, before)
+            if cursor is None:
+                return [], False, None
+            messages, has_more = history.page(queryset, self.HISTORY_PAGE_SIZE, cursor)
+        return [self.serialize_message(msg) for msg in messages], has_more, since
+
+    def with_pending(self, messages, course_id, since=0):
+        """Add messages still waiting in this process's write-behind buffer."""
+        if not self.write_behind:
+            return messages
+        saved = {msg.public_id for msg in messages}
+        messages = messages + [
+            msg for msg in writebehind.get_buffer().pending_for(course_id)
+            if msg.public_id not in saved and msg.seq > since
+        ]
+        return sorted(messages, key=lambda msg: msg.seq)
+
+    def find_cursor(self, course_id, public_id):
+        """(timestamp, id) of a message in this room, or None if there is no such message."""
+        try:
+            return (
+                Message.objects.filter(course_id=course_id, public_id=public_id)
+                .values_list('timestamp', 'id').first()
+            )
+        except ValidationError:
+            return None
+
+    def serialize_message(self, msg):
+        return {
+            'id': str(msg.public_id),
+            'seq': msg.seq,
+            'user_id': msg.sender_id,
+            'message': msg.content,
+            'timestamp': msg.timestamp.strftime('%H:%M'),
+        }
     
     @database_sync_to_async
-    def save_message(self, course_id, sender, message):
+    def store_message(self, sender, message):
+        """Save (or with write-behind, only number) a new message; returns it and its frame entry."""
+        if self.write_behind:
+            seq = writebehind.next_seq(self.course.id)
+            msg = Message(course=self.course, sender=sender, content=message, seq=seq)
+        else:
+            #Single INSERT; id and timestamp come back from the created row
+            msg = self.save_message(sender, message)
+        entry = self.serialize_message(msg)
+        recent.sent(self.room_group_name, entry)
+        return msg, entry
+
+    def save_message(self, sender, message):
         try:
-            course = Course.objects.get(id=course_id)
-            return Message.objects.create(course=course, sender=sender, content=message)
+            return Message.objects.create(course=self.course, sender=sender, content=message)
         except Exception as e:
             print("save_message error:", e)
             raise
 
     @database_sync_to_async
     def is_user_in_course(self, user, course):
-        return user == course.teacher or course.enrollments.filter(student=user).exists()
-    
-    @database_sync_to_async
-    def get_username(self, msg):
-        return msg.sender.username
-    
-    @database_sync_to_async
-    def get_timestamp(self, msg):
-        return msg.timestamp.strftime('%H:%M')
+        return membership.is_member(user, course.id)
 
-    @database_sync_to_async
-    def get_latest_timestamp(self, sender):
-        msg = Message.objects.filter(sender=sender).latest('timestamp')
-        return msg.timestamp.strftime('%H:%M')
-
-    @database_sync_to_async
-    def get_profile_pic(self, msg):
-        return self.get_full_profile_pic_url(msg.sender)
 
     
 
-    #Fetch a fresh version of the image instead of a stale/cache image for WebSocket
-    def get_full_profile_pic_url(self, user):
-        if user.profile_picture:
-            scheme = self.scope.get("scheme", "http")
-            host_header = dict(self.scope["headers"]).get(b"host", b"localhost:8000").decode()
-            return f"{scheme}://{host_header}{user.profile_picture.url}?v={int(datetime.datetime.utcnow().timestamp())}"
-        return "/static/default-avatar.png"
-
+class DirectMessageConsumer(AsyncWebsocketConsumer):
+    """All of a user's private conversations over one socket (see chat.direct).
 
-    
+    Client actions, each about one conversation:
+        {action: 'open', user_id, since?}         -> users + history frames
+        {action: 'history_before', conversation, before}
+        {action: 'send', conversation, message}
+    Every frame the server sends carries the conversation id.
+    """
+    HISTORY_PAGE_SIZE = 50
 
-class PrivateChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.other_user_id = self.scope['url_route']['kwargs']['user_id']
         self.user = self.scope['user']
-
-        #Ensure only two users
         if not self.user.is_authenticated:
             await self.close()
             return
-        
-        ids = sorted([str(self.user.id), str(self.other_user_id)])
-        self.room_group_name = f'private_chat_{ids[0]}_{ids[1]}'
 
-        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        self.group_name = direct.dm_group(self.user.id)
+        self.media_prefix = directory.media_prefix(self.scope)
+        self.limiter = ratelimit.Limiter(self.user.id)
+        self.outbound = outbound.Outbound(self)
+        #Conversations this socket opened, by id; only these can be read or written
+        self.conversations = {}
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
+        self.outbound.start()
 
-        messages = await self.get_previous_messages(self.user.id, self.other_user_id)
+    async def disconnect(self,close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            self.outbound.stop()
 
-        for msg in messages:
+    async def receive(self, text_data):
+        data, error = self.limiter.read_frame(text_data)
+        if error:
+            await self.outbound.send(json.dumps(error))
+            return
+        if await self.outbound.received(data):
+            return
+        action = data.get('action')
+        if action in ('open', 'history_before'):
+            error = self.limiter.check_action()
+            if error:
+                await self.outbound.send(json.dumps({**error, 'conversation': data.get('conversation')}))
+                return
+        if action == 'open':
+            await self.open(data.get('user_id'), data.get('since'))
+            return
 
-            profile_pic = self.get_full_profile_pic_url(msg.sender)
+        conversation = self.conversations.get(data.get('conversation'))
+        if conversation is None:
+            await self.send_error(data.get('conversation'), 'Open the conversation first')
+        elif action == 'history_before':
+            await self.send_history(conversation, before=data.get('before'))
+        elif action == 'send':
+            error = self.limiter.check_message(data.get('message'))
+            if error:
+                await self.outbound.send(json.dumps({**error, 'conversation': conversation.id}))
+                return
+            msg = await self.save_message(conversation, data['message'])
+            #Encoded once, to both participants' groups
+            await direct.send(self.channel_layer, msg)
+        else:
+            await self.send_error(conversation.id, f'Unknown action {action!r}')
+
+    async def open(self, other_user_id, since=None):
+        try:
+            other_user_id = int(other_user_id)
+        except (TypeError, ValueError):
+            await self.send_error(None, 'user_id must be a user id')
+            return
+        #Both ends of the conversation, which also checks the other user exists
+        users, conversation = await self.get_conversation(other_user_id)
+        if conversation is None:
+            await self.send_error(None, 'No such user')
+            return
+        self.conversations[conversation.id] = conversation
 
-            await self.send(text_data=json.dumps({
-                'sender': msg.sender.username,
-                'message': msg.content,
-                'timestamp': msg.timestamp.strftime('%H:%M'),
-                'profile_pic' : profile_pic,
-            }))
+        await self.outbound.send(json.dumps({
+            'type': 'users',
+            'conversation': conversation.id,
+            'users': directory.absolute(users, self.media_prefix),
+        }))
+        #Newest page (or only what a reconnecting client missed) as one frame
+        await self.send_history(conversation, since=since if isinstance(since, int) else None)
+
+    async def send_history(self, conversation, before=None, since=None):
+        messages, has_more, since = await self.get_previous_messages(conversation, before, since)
+        await self.outbound.send(json.dumps({
+            'type': 'history',
+            'conversation': conversation.id,
+            'before': before,
+            'since': since,
+            'messages': [direct.serialize(msg) for msg in messages],
+            'has_more': has_more,
+        }))
 
-    async def disconnect(self,close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+    async def send_error(self, conversation_id, detail):
+        await self.outbound.send(json.dumps({'type': 'error', 'conversation': conversation_id, 'detail': detail}))
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        message = data['message']
-        receiver_id = self.other_user_id
-        sender = self.user
-
-        await self.save_message(sender.id, receiver_id,message)
-
-        timestamp = datetime.datetime.now().strftime('%H:%M')
-        profile_pic = self.get_full_profile_pic_url(sender)
-
-
-
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type':'chat_message',
-                'message':message,
-                'sender': self.user.username,
-                'timestamp': timestamp,
-                'profile_pic' : profile_pic
-            }
-        )
-
-    async def chat_message(self, event):
-        await self.send(text_data = json.dumps({
-            'message': event['message'],
-            'sender': event['sender'],
-            'timestamp': event['timestamp'],
-            'profile_pic' : event['profile_pic']
-        }))
+    async def dm_message(self, event):
+        await self.outbound.broadcast(event['text'])
 
-    
     @database_sync_to_async
-    def save_message(self,sender_id, receiver_id, content):
-        sender = CustomUser.objects.get(id=sender_id)
-        receiver = CustomUser.objects.get(id=receiver_id)
-        
-        ids=sorted([str(sender_id), str(receiver_id)])
-        room_name = f'private_chat_{ids[0]}_{ids[1]}'
-        
-        PrivateMessage.objects.create(
-            sender=sender,receiver = receiver,
-            content = content,
-            room_name = room_name)
-        # Create notification for receiver
-        if sender != receiver:
-            ChatNotification.objects.create(
-                recipient=receiver,
-                sender=sender,
-                message=content
-            )
-    
+    def get_conversation(self, other_user_id):
+        ids = {self.user.id, other_user_id}
+        users = directory.users(ids)
+        if len(users) != len(ids):
+            return users, None
+        return users, Conversation.between(self.user.id, other_user_id)
+
     @database_sync_to_async
-    def get_previous_messages(self, user1_id, user2_id):
-        ids = sorted([str(user1_id), str(user2_id)])
-        room_name = f'private_chat_{ids[0]}_{ids[1]}'
-        return list(
-            PrivateMessage.objects
-            .filter(room_name=room_name)
-            #preload sender object
-            .select_related('sender')
-            .order_by('timestamp')[:50]
-        )
-    
-    #Fetch a fresh version of the image instead of a stale/cache image for WebSocket
-    def get_full_profile_pic_url(self, user):
-        if user.profile_picture:
-            scheme = self.scope.get("scheme", "http")
-            host_header = dict(self.scope["headers"]).get(b"host", b"localhost:8000").decode()
-            return f"{scheme}://{host_header}{user.profile_picture.url}?v={int(datetime.datetime.utcnow().timestamp())}"
-        return "/static/default-avatar.png"
+    def save_message(self, conversation, content):
+        #The thread was looked up when it was opened, so no lookups here.
+        #The receiver's unread count is the thread's watermark (Conversation), so
+        #there is no notification row to write
+        return PrivateMessage.objects.create(
+            sender=self.user, receiver_id=conversation.other_user_id(self.user.id),
+            conversation=conversation, content=content)
 
-    
-    
\ No newline at end of file
+    @database_sync_to_async
+    def get_previous_messages(self, conversation, before=None, since=None):
+        #Frames only need sender_id, so no join
+        queryset = PrivateMessage.objects.filter(conversation_id=conversation.id)
+        if since is not None:
+            messages = history.missed(queryset, since)
+            if messages is not None:
+                return messages, False, since
+
+        cursor = None
+        if before is not None:
+            try:
+                cursor = queryset.filter(id=int(before)).values_list('timestamp', 'id').first()
+            except (TypeError, ValueError):
+                cursor = None
+            if cursor is None:
+                return [], False, None
+        return (*history.page(queryset, self.HISTORY_PAGE_SIZE, cursor), None)
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """Per-user stream of new notifications and badge counts for base.html."""
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.group_name = notification_group(self.user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+        #Start from the current badge count
+        await self.send(text_data=json.dumps({
+            'type': 'unread',
+            'unread': await self.get_unread_total(),
+        }))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def notification_push(self, event):
+        await self.send(text_data=json.dumps(event['payload']))
+
+    @database_sync_to_async
+    def get_unread_total(self):
+        return counters.unread_total(self.user)
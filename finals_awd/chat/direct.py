@@ -0,0 +1,58 @@
+import json
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+# Direct messages over one socket per user.
+# Every user's DirectMessageConsumer joins dm_group(user_id); a DM is delivered
+# by sending the same pre-encoded frame to the receiver's and the sender's
+# groups (the sender may have other tabs open), tagged with the conversation
+# id so clients can route it.
+
+def dm_group(user_id):
+    return f'dm_{user_id}'
+
+
+def serialize(message):
+    return {
+        'id': message.id,
+        'seq': message.seq,
+        'user_id': message.sender_id,
+        'message': message.content,
+        'timestamp': message.timestamp.strftime('%H:%M'),
+    }
+
+
+def frame_text(message):
+    return json.dumps({'type': 'message', 'conversation': message.conversation_id, **serialize(message)})
+
+
+def groups(message):
+    return {dm_group(message.sender_id), dm_group(message.receiver_id)}
+
+
+async def _group_send_all(channel_layer, names, event):
+    for name in names:
+        await channel_layer.group_send(name, event)
+
+
+async def send(channel_layer, message):
+    """Deliver a saved message to both participants' sockets; encoded once."""
+    await _group_send_all(channel_layer, groups(message), {'type': 'dm.message', 'text': frame_text(message)})
+
+
+def deliver(message):
+    """send() for synchronous callers (e.g. the REST API), once the transaction commits."""
+    def push():
+        try:
+            channel_layer = get_channel_layer()
+            if channel_layer is not None:
+                async_to_sync(send)(channel_layer, message)
+        except Exception:
+            logger.warning("DM delivery of message %s failed", message.id, exc_info=True)
+    transaction.on_commit(push)
@@ -0,0 +1,53 @@
+from django.db.models import Q
+
+from accounts.models import CustomUser
+
+
+# Who's who in a chat.
+# Message frames carry only the sender's user_id; sockets get a
+# {type: 'users', users: [{id, username, profile_pic}]} frame on connect (and
+# when someone joins the course), and clients look up any other id they meet,
+# e.g. the author of an old message who has since left, with
+# GET /chat/api/users/?ids=1,2,3 (chat.api.chat_users_api).
+
+DEFAULT_AVATAR = "/static/default-avatar.png"
+
+#Most ids one lookup resolves
+MAX_LOOKUP = 100
+
+FIELDS = ('id', 'username', 'profile_picture', 'avatar_version')
+
+
+def entry(user):
+    """Directory entry of a user; relative avatar URLs are made absolute by absolute()."""
+    #Versioned by upload (CustomUser.avatar_version), so clients can keep it cached
+    return {'id': user.id, 'username': user.username, 'profile_pic': user.avatar_url or DEFAULT_AVATAR}
+
+
+def absolute(entries, prefix):
+    #Absolute storage URLs (e.g. Cloudinary) are left alone
+    return [
+        {**e, 'profile_pic': prefix + e['profile_pic']} if e['profile_pic'].startswith('/') else e
+        for e in entries
+    ]
+
+
+def users(ids):
+    return [entry(user) for user in CustomUser.objects.filter(id__in=ids).only(*FIELDS).order_by('id')]
+
+
+def course_users(course_id):
+    """The teacher and enrolled students of a course, in one query."""
+    members = CustomUser.objects.filter(
+        Q(courses_taught__id=course_id) | Q(enrollments__course_id=course_id)
+    ).distinct().only(*FIELDS).order_by('id')
+    return [entry(user) for user in members]
+
+
+def media_prefix(scope):
+    """http(s)://host of the page that opened the socket, for absolute avatar URLs."""
+    scheme = 'https' if scope.get('scheme') in ('https', 'wss') else 'http'
+    for name, value in scope.get('headers', ()):
+        if name == b'host':
+            return f"{scheme}://{value.decode()}"
+    return f"{scheme}://localhost:8000"
@@ -0,0 +1,48 @@
+from urllib.parse import parse_qs
+
+from django.db.models import Q
+
+
+# Chat history pages.
+# Rows are ordered by (timestamp, id) and older pages start strictly below the
+# (timestamp, id) of the oldest message the client already has, so every page
+# is one index range scan on (room, timestamp, id) however deep it is.
+#
+# Every message also has a per-room sequence number (RoomSequence), so a
+# client that reconnects with ?since=<last seq it saw> is sent only what it
+# missed.
+
+#Beyond this many missed messages a reconnecting client just gets the newest page
+RESUME_LIMIT = 200
+
+def older_than(queryset, timestamp, pk):
+    # Same as (timestamp, id) < (timestamp, pk); the leading timestamp__lte is
+    # what lets the database seek the index instead of filtering the whole room
+    return queryset.filter(Q(timestamp__lte=timestamp), Q(timestamp__lt=timestamp) | Q(id__lt=pk))
+
+
+def page(queryset, limit, cursor=None):
+    """The newest `limit` rows before `cursor` (a (timestamp, id) pair), oldest first.
+
+    Returns (rows, has_more).
+    """
+    if cursor is not None:
+        queryset = older_than(queryset, *cursor)
+    rows = list(queryset.order_by('-timestamp', '-id')[:limit + 1])
+    return rows[:limit][::-1], len(rows) > limit
+
+
+def since(scope):
+    """The ?since=<seq> a socket connected with, or None."""
+    values = parse_qs(scope.get('query_string', b'').decode()).get('since')
+    try:
+        return int(values[0])
+    except (TypeError, ValueError):
+        return None
+
+
+def missed(queryset, since, limit=None):
+    """Rows with seq > `since` in order, or None if there are more than `limit`."""
+    limit = limit or RESUME_LIMIT
+    rows = list(queryset.filter(seq__gt=since).order_by('seq')[:limit + 1])
+    return None if len(rows) > limit else rows
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0005_chatnotification_message"),
+        ("courses", "0006_unique_enrollment"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chatnotification",
+            index=models.Index(
+                fields=["recipient", "timestamp", "id"],
+                name="chatnotif_recipient_time_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="chatnotification",
+            index=models.Index(
+                condition=models.Q(("is_read", False)),
+                fields=["recipient", "sender"],
+                name="chatnotif_unread_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["course", "timestamp"], name="message_course_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="privatemessage",
+            index=models.Index(
+                fields=["room_name", "timestamp"], name="privmsg_room_time_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:12
+
+import uuid
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def gen_public_ids(apps, schema_editor):
+    Message = apps.get_model("chat", "Message")
+    for message in Message.objects.filter(public_id__isnull=True).only("id").iterator():
+        message.public_id = uuid.uuid4()
+        message.save(update_fields=["public_id"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0006_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        # Existing rows need distinct values before the unique constraint goes on
+        migrations.AddField(
+            model_name="message",
+            name="public_id",
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(gen_public_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="message",
+            name="public_id",
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
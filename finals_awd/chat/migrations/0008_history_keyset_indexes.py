@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0007_message_public_id"),
+        ("courses", "0006_unique_enrollment"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="message",
+            name="message_course_time_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="privatemessage",
+            name="privmsg_room_time_idx",
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["course", "timestamp", "id"], name="message_course_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="privatemessage",
+            index=models.Index(
+                fields=["room_name", "timestamp", "id"], name="privmsg_room_time_idx"
+            ),
+        ),
+    ]
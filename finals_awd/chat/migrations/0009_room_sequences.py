@@ -0,0 +1,82 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+def number_existing_messages(apps, schema_editor):
+    # Number every room's messages in history order and remember where each room stopped
+    Message = apps.get_model("chat", "Message")
+    PrivateMessage = apps.get_model("chat", "PrivateMessage")
+    RoomSequence = apps.get_model("chat", "RoomSequence")
+
+    last_seq = {}
+    for model, room_of in (
+        (Message, lambda message: f"chat_{message.course_id}"),
+        (PrivateMessage, lambda message: message.room_name),
+    ):
+        batch = []
+        for message in model.objects.order_by("timestamp", "id").iterator():
+            room = room_of(message)
+            last_seq[room] = message.seq = last_seq.get(room, 0) + 1
+            batch.append(message)
+            if len(batch) >= 1000:
+                model.objects.bulk_update(batch, ["seq"])
+                batch = []
+        model.objects.bulk_update(batch, ["seq"])
+
+    RoomSequence.objects.bulk_create(
+        RoomSequence(room=room, last_seq=seq) for room, seq in last_seq.items()
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0008_history_keyset_indexes"),
+        ("courses", "0006_unique_enrollment"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RoomSequence",
+            fields=[
+                (
+                    "room",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("last_seq", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="seq",
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="privatemessage",
+            name="seq",
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(number_existing_messages, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="message",
+            name="seq",
+            field=models.BigIntegerField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name="privatemessage",
+            name="seq",
+            field=models.BigIntegerField(editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name="message",
+            constraint=models.UniqueConstraint(
+                fields=("course", "seq"), name="message_course_seq_uniq"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="privatemessage",
+            constraint=models.UniqueConstraint(
+                fields=("room_name", "seq"), name="privmsg_room_seq_uniq"
+            ),
+        ),
+    ]
@@ -0,0 +1,177 @@
+# Generated by Django 5.2.1 on 2026-10-18 12:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_conversations(apps, schema_editor):
+    # One Conversation per pair of users. room_name was sent by API clients as
+    # they liked, so it is rebuilt from the pair and seq renumbered per thread
+    Conversation = apps.get_model("chat", "Conversation")
+    PrivateMessage = apps.get_model("chat", "PrivateMessage")
+    RoomSequence = apps.get_model("chat", "RoomSequence")
+    ChatNotification = apps.get_model("chat", "ChatNotification")
+
+    def room_of(low, high):
+        ids = sorted([str(low), str(high)])
+        return f"private_chat_{ids[0]}_{ids[1]}"
+
+    conversations = {}
+    last_seq = {}
+    batch = []
+    for message in PrivateMessage.objects.order_by("timestamp", "id").iterator():
+        pair = tuple(sorted([message.sender_id, message.receiver_id]))
+        conversation = conversations.get(pair)
+        if conversation is None:
+            conversation = conversations[pair] = Conversation.objects.create(
+                user_low_id=pair[0], user_high_id=pair[1]
+            )
+        message.conversation_id = conversation.id
+        message.room_name = room_of(*pair)
+        last_seq[pair] = message.seq = last_seq.get(pair, 0) + 1
+        conversation.last_message_id = message.id
+        conversation.last_activity = message.timestamp
+        batch.append(message)
+        if len(batch) >= 1000:
+            PrivateMessage.objects.bulk_update(batch, ["conversation", "room_name", "seq"])
+            batch = []
+    PrivateMessage.objects.bulk_update(batch, ["conversation", "room_name", "seq"])
+
+    # Unread counts start from the unread chat notifications of each pair
+    for note in ChatNotification.objects.filter(is_read=False).values("recipient_id", "sender_id"):
+        conversation = conversations.get(tuple(sorted([note["recipient_id"], note["sender_id"]])))
+        if conversation is None or note["recipient_id"] == note["sender_id"]:
+            continue
+        if note["recipient_id"] == conversation.user_low_id:
+            conversation.unread_low += 1
+        else:
+            conversation.unread_high += 1
+
+    Conversation.objects.bulk_update(
+        conversations.values(), ["last_message", "last_activity", "unread_low", "unread_high"],
+        batch_size=1000,
+    )
+    for pair, seq in last_seq.items():
+        RoomSequence.objects.update_or_create(room=room_of(*pair), defaults={"last_seq": seq})
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0009_room_sequences"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Conversation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("last_activity", models.DateTimeField(blank=True, null=True)),
+                ("unread_low", models.PositiveIntegerField(default=0)),
+                ("unread_high", models.PositiveIntegerField(default=0)),
+                (
+                    "last_message",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="chat.privatemessage",
+                    ),
+                ),
+                (
+                    "user_high",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "user_low",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user_low", "-last_activity"],
+                        name="conversation_low_recent_idx",
+                    ),
+                    models.Index(
+                        fields=["user_high", "-last_activity"],
+                        name="conversation_high_recent_idx",
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user_low", "user_high"), name="conversation_pair_uniq"
+                    ),
+                    models.CheckConstraint(
+                        condition=models.Q(("user_low__lte", models.F("user_high"))),
+                        name="conversation_pair_ordered",
+                    ),
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="privatemessage",
+            name="conversation",
+            field=models.ForeignKey(
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="messages",
+                to="chat.conversation",
+            ),
+        ),
+        migrations.RemoveConstraint(
+            model_name="privatemessage",
+            name="privmsg_room_seq_uniq",
+        ),
+        migrations.RunPython(build_conversations, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="privatemessage",
+            name="conversation",
+            field=models.ForeignKey(
+                editable=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="messages",
+                to="chat.conversation",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="privatemessage",
+            name="room_name",
+            field=models.CharField(editable=False, max_length=100),
+        ),
+        migrations.RemoveIndex(
+            model_name="privatemessage",
+            name="privmsg_room_time_idx",
+        ),
+        migrations.AddIndex(
+            model_name="privatemessage",
+            index=models.Index(
+                fields=["conversation", "timestamp", "id"], name="privmsg_conv_time_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="privatemessage",
+            constraint=models.UniqueConstraint(
+                fields=("conversation", "seq"), name="privmsg_conv_seq_uniq"
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+def unread_counts_to_watermarks(apps, schema_editor):
+    # Each side's watermark sits its unread count below the thread's last seq
+    Conversation = apps.get_model("chat", "Conversation")
+    batch = []
+    for conversation in Conversation.objects.select_related("last_message").iterator():
+        last_seq = conversation.last_message.seq if conversation.last_message else 0
+        conversation.last_seq = last_seq
+        conversation.last_read_low = max(last_seq - conversation.unread_low, 0)
+        conversation.last_read_high = max(last_seq - conversation.unread_high, 0)
+        batch.append(conversation)
+        if len(batch) >= 1000:
+            Conversation.objects.bulk_update(batch, ["last_seq", "last_read_low", "last_read_high"])
+            batch = []
+    Conversation.objects.bulk_update(batch, ["last_seq", "last_read_low", "last_read_high"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0010_conversation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="last_read_high",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="last_read_low",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="last_seq",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(unread_counts_to_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="conversation",
+            name="unread_high",
+        ),
+        migrations.RemoveField(
+            model_name="conversation",
+            name="unread_low",
+        ),
+        # Unread DMs are now the messages above a participant's watermark
+        migrations.DeleteModel(
+            name="ChatNotification",
+        ),
+    ]
@@ -1,43 +1,272 @@
-from django.db import models
+import uuid
+
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.dispatch import Signal
+from django.utils import timezone
 from accounts.models import CustomUser
 from courses.models import Course
 # Create your models here.
 
 
+def course_room(course_id):
+    """Sequence/group name of a course chat room (same as ChatConsumer's group)."""
+    return f'chat_{course_id}'
+
+
+def private_room(user_a_id, user_b_id):
+    """Group/sequence name of a DM thread.
+
+    The ids are sorted as strings (private_chat_12_7), which is how the name
+    has always been built; existing rows and RoomSequence keys use it.
+    """
+    ids = sorted([str(user_a_id), str(user_b_id)])
+    return f'private_chat_{ids[0]}_{ids[1]}'
+
+
+class RoomSequence(models.Model):
+    """Last sequence number handed out in one chat room."""
+    room = models.CharField(max_length=100, primary_key=True)
+    last_seq = models.BigIntegerField(default=0)
+
+    @classmethod
+    def allocate(cls, room, count=1):
+        """Reserve `count` consecutive numbers for `room` and return the first.
+
+        The UPDATE holds the row lock until the surrounding transaction ends, so
+        rooms get gap-free numbers in commit order when this runs in the same
+        transaction as the INSERT.
+        """
+        with transaction.atomic(savepoint=False):
+            last_seq = cls._bump(room, count)
+            if last_seq is None:
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(room=room, last_seq=count)
+                    return 1
+                except IntegrityError:
+                    # Another writer created the row first
+                    last_seq = cls._bump(room, count)
+        return last_seq - count + 1
+
+    @classmethod
+    def advance(cls, room, seq):
+        """Raise the room's counter to at least `seq`, for numbers handed out elsewhere (chat.writebehind)."""
+        cls.objects.bulk_create([cls(room=room)], ignore_conflicts=True)
+        cls.objects.filter(room=room).update(last_seq=Greatest(F('last_seq'), Value(seq)))
+
+    @classmethod
+    def _bump(cls, room, count):
+        # One round trip instead of UPDATE + SELECT; this runs for every chat message
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET last_seq = last_seq + %s WHERE room = %s RETURNING last_seq",
+                [count, room],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+
 class Message(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE,
                                related_name='messages')
     sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add = True)
+    #Set when the message is received, which can be before the row is written
+    #(see chat.writebehind), so it is a default rather than auto_now_add
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    #Server-assigned id sent to clients; known before the INSERT happens
+    public_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    #Position in the room; clients resume from the last one they saw
+    seq = models.BigIntegerField(editable=False)
+
+    class Meta:
+        indexes = [
+            #Course chat history: pages of a room in (timestamp, id) order, see chat.history
+            models.Index(fields=['course', 'timestamp', 'id'], name='message_course_time_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'seq'], name='message_course_seq_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username}: {self.content[:30]}"
+
+    def save(self, *args, **kwargs):
+        if self.seq is None:
+            with transaction.atomic(savepoint=False):
+                self.seq = RoomSequence.allocate(course_room(self.course_id))
+                return super().save(*args, **kwargs)
+        return super().save(*args, **kwargs)
     
     
+class Conversation(models.Model):
+    """A DM thread between two users, stored once as the ordered pair (low, high)."""
+    user_low = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    user_high = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey('PrivateMessage', on_delete=models.SET_NULL, null=True,
+                                     blank=True, related_name='+')
+    last_activity = models.DateTimeField(null=True, blank=True)
+    #seq of the last message, and of the last one each participant has read.
+    #Everything above a participant's watermark is unread; sending a message
+    #moves the sender's watermark, so only the other side's messages count.
+    last_seq = models.BigIntegerField(default=0)
+    last_read_low = models.BigIntegerField(default=0)
+    last_read_high = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='conversation_pair_uniq'),
+            models.CheckConstraint(condition=Q(user_low__lte=F('user_high')), name='conversation_pair_ordered'),
+        ]
+        indexes = [
+            #A user's threads, most recent first; the unique pair index covers user_low's side
+            models.Index(fields=['user_low', '-last_activity'], name='conversation_low_recent_idx'),
+            models.Index(fields=['user_high', '-last_activity'], name='conversation_high_recent_idx'),
+        ]
+
+    def __str__(self):
+        return self.room_name
+
+    @classmethod
+    def find(cls, user_a_id, user_b_id):
+        """The thread between two users, or None if they never wrote to each other."""
+        low, high = sorted([int(user_a_id), int(user_b_id)])
+        return cls.objects.filter(user_low_id=low, user_high_id=high).first()
+
+    @classmethod
+    def between(cls, user_a_id, user_b_id):
+        """The thread between two users, created on first use."""
+        conversation = cls.find(user_a_id, user_b_id)
+        if conversation is None:
+            low, high = sorted([int(user_a_id), int(user_b_id)])
+            try:
+                with transaction.atomic():
+                    conversation = cls.objects.create(user_low_id=low, user_high_id=high)
+            except IntegrityError:
+                # Both users opened the thread at once
+                conversation = cls.objects.get(user_low_id=low, user_high_id=high)
+        return conversation
+
+    @classmethod
+    def for_user(cls, user_id):
+        """A user's threads, most recent first."""
+        return cls.objects.filter(Q(user_low_id=user_id) | Q(user_high_id=user_id)).order_by(
+            F('last_activity').desc(nulls_last=True), '-id')
+
+    @staticmethod
+    def unread_expression(user_id):
+        """Unread count of `user_id` in each row, for annotate()/aggregate()."""
+        return Case(
+            When(user_low_id=user_id, then=F('last_seq') - F('last_read_low')),
+            default=F('last_seq') - F('last_read_high'),
+        )
+
+    @classmethod
+    def unread_total(cls, user_id):
+        """Unread messages over all of a user's threads."""
+        total = cls.objects.filter(Q(user_low_id=user_id) | Q(user_high_id=user_id)).aggregate(
+            unread=Sum(cls.unread_expression(user_id)))['unread']
+        return total or 0
+
+    @classmethod
+    def mark_all_read(cls, user_id):
+        """Move all of a user's watermarks to the end; returns how many messages were unread."""
+        with transaction.atomic():
+            unread = cls.unread_total(user_id)
+            cls.objects.filter(user_low_id=user_id).update(last_read_low=F('last_seq'))
+            cls.objects.filter(user_high_id=user_id).update(last_read_high=F('last_seq'))
+        return unread
+
+    @property
+    def room_name(self):
+        return private_room(self.user_low_id, self.user_high_id)
+
+    def other_user_id(self, user_id):
+        return self.user_high_id if user_id == self.user_low_id else self.user_low_id
+
+    def _watermark_field(self, user_id):
+        return 'last_read_low' if user_id == self.user_low_id else 'last_read_high'
+
+    def unread_for(self, user_id):
+        return self.last_seq - getattr(self, self._watermark_field(user_id))
+
+    def record(self, message):
+        """Move the thread to a newly saved message; returns how many of the sender's unread that cleared.
+
+        The row is locked first, so concurrent sends each clear what they saw.
+        """
+        #The sender has read everything up to their own message
+        watermark = self._watermark_field(message.sender_id)
+        self.last_seq, read = Conversation.objects.select_for_update().filter(pk=self.pk).values_list(
+            'last_seq', watermark).get()
+        setattr(self, watermark, read)
+        cleared = max(self.unread_for(message.sender_id), 0)
+        Conversation.objects.filter(pk=self.pk).update(
+            last_message=message, last_activity=message.timestamp, last_seq=message.seq,
+            **{watermark: Greatest(F(watermark), Value(message.seq))})
+        self.last_message, self.last_activity, self.last_seq = message, message.timestamp, message.seq
+        setattr(self, watermark, max(read, message.seq))
+        return cleared
+
+    def mark_read(self, user_id):
+        """Mark what this row has seen as read by `user_id`; returns how many messages that was.
+
+        One single-row UPDATE. Messages that arrived after this row was loaded
+        stay unread, so the count matches exactly what was cleared.
+        """
+        unread = self.unread_for(user_id)
+        if unread > 0:
+            watermark = self._watermark_field(user_id)
+            Conversation.objects.filter(pk=self.pk).update(
+                **{watermark: Greatest(F(watermark), Value(self.last_seq))})
+            setattr(self, watermark, self.last_seq)
+        return max(unread, 0)
+
+
+#Sent inside the transaction once a new PrivateMessage has moved its thread;
+#`cleared` is how many of the sender's unread messages their reply marked read
+private_message_recorded = Signal()
+
+
 class PrivateMessage(models.Model):
     sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE
                                ,related_name='sent_private_message')
     receiver = models.ForeignKey(CustomUser, on_delete=models.CASCADE,
                                  related_name='received_private_message')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages',
+                                     editable=False)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add = True)
-    #For future retrieval or caching
-    room_name = models.CharField(max_length = 100)
+    #Group name of the thread (see private_room), set from the conversation
+    room_name = models.CharField(max_length = 100, editable=False)
+    #Position in the room; clients resume from the last one they saw
+    seq = models.BigIntegerField(editable=False)
 
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            #Conversation history, paged on (timestamp, id)
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='privmsg_conv_time_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'seq'], name='privmsg_conv_seq_uniq'),
+        ]
 
-    
-class ChatNotification(models.Model):
-    recipient = models.ForeignKey(CustomUser, on_delete=models.CASCADE,
-                                  related_name='chat_notifications')
-    sender = models.ForeignKey(CustomUser,on_delete=models.CASCADE)
-    is_read = models.BooleanField(default=False)
-    timestamp = models.DateTimeField(auto_now_add = True)
-    message = models.TextField(blank = True)
-
-
-    class Meta:
-        ordering = ['-timestamp']
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            #A new message: number it and move its thread along, all or nothing
+            with transaction.atomic(savepoint=False):
+                if self.conversation_id is None:
+                    self.conversation = Conversation.between(self.sender_id, self.receiver_id)
+                self.room_name = self.conversation.room_name
+                if self.seq is None:
+                    self.seq = RoomSequence.allocate(self.room_name)
+                super().save(*args, **kwargs)
+                cleared = self.conversation.record(self)
+                private_message_recorded.send(sender=PrivateMessage, message=self, cleared=cleared)
+            return
+        return super().save(*args, **kwargs)
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import time
+from collections import Counter
+
+from django.conf import settings
+
+
+# Outbound accounting for chat sockets (settings.CHAT_OUTBOUND).
+# The ASGI server buffers whatever a socket sends until the client reads it,
+# with no limit, and doesn't tell the application how much is waiting. So each
+# socket counts what it sent, and a heartbeat tells it what was read: every
+# HEARTBEAT_INTERVAL seconds it sends {type: 'ping', id} and the client answers
+# {action: 'pong', id} once it got there, so everything sent before that ping
+# has been read.
+#
+# A socket more than HIGH_WATER_BYTES behind stops getting broadcasts, so a
+# stalled reader holds at most that much of the server's memory. With ON_STALL
+# 'resync' the messages it missed are dropped, and once it has caught up to
+# within LOW_WATER_BYTES it gets a single {type: 'resync', dropped} frame;
+# clients reconnect with ?since=<last seq> (or re-open with since) to fetch
+# them from history. With 'close' the socket is closed with STALLED instead.
+#
+# A socket that hasn't sent anything, pongs included, for IDLE_TIMEOUT seconds
+# is closed with IDLE.
+#
+# Course chat sockets can also coalesce broadcasts: with COALESCE_MS set, the
+# frames arriving within that many milliseconds of the first one go out as a
+# single {type: 'batch', frames: [...]} frame (or as they are, if only one
+# came), MAX_BATCH at most. The frames are joined as already-encoded text.
+
+DEFAULTS = {
+    'HIGH_WATER_BYTES': 1024 * 1024,
+    'LOW_WATER_BYTES': 256 * 1024,
+    'ON_STALL': 'resync',
+    'HEARTBEAT_INTERVAL': 20,
+    'IDLE_TIMEOUT': 60,
+    'COALESCE_MS': 0,
+}
+
+MAX_BATCH = 100
+
+#Close codes (4000-4999 are the application's)
+IDLE = 4000
+STALLED = 4008
+
+#Counts of stalls, resyncs, dropped frames, batches and reaped sockets in this process
+stats = Counter()
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_OUTBOUND', {})}
+
+
+class Outbound:
+    """What one socket has sent and what its client has read; see the module comment."""
+
+    def __init__(self, consumer, coalesce=False, on_beat=None):
+        conf = config()
+        self.consumer = consumer
+        #Called every heartbeat, e.g. to renew the socket's presence (chat.presence)
+        self.on_beat = on_beat
+        self.window = conf['COALESCE_MS'] / 1000 if coalesce else 0
+        self.high_water = conf['HIGH_WATER_BYTES']
+        self.low_water = conf['LOW_WATER_BYTES']
+        self.on_stall = conf['ON_STALL']
+        self.interval = conf['HEARTBEAT_INTERVAL']
+        self.idle_timeout = conf['IDLE_TIMEOUT']
+
+        #Frames are json.dumps output, which is ASCII, so characters are bytes
+        self.sent = 0
+        self.acked = 0
+        self.pings = {}  # ping id -> self.sent once it went out
+        self.last_ping = 0
+        self.stalled = False
+        self.dropped = 0
+        self.last_seen = time.monotonic()
+        self._heartbeat = None
+        self._batch = []
+        self._flush_later = None
+
+    @property
+    def pending(self):
+        return self.sent - self.acked
+
+    def start(self):
+        self._heartbeat = asyncio.ensure_future(self._beat())
+
+    def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        if self._flush_later is not None:
+            self._flush_later.cancel()
+
+    async def send(self, text):
+        """A frame the client asked for (history, users, errors); sent even when stalled."""
+        #After any broadcasts waiting to be coalesced, so frames keep their order
+        if self._batch:
+            await self.flush()
+        await self._write(text)
+
+    async def _write(self, text):
+        await self.consumer.send(text_data=text)
+        self.sent += len(text)
+        if not self.stalled and self.pending > self.high_water:
+            self.stalled = True
+            stats['stalled'] += 1
+            if self.on_stall == 'close':
+                await self.consumer.close(code=STALLED)
+
+    async def broadcast(self, text):
+        """A frame from the room; dropped while the client is too far behind."""
+        if self.stalled:
+            self.dropped += 1
+            stats['dropped_frames'] += 1
+            return
+        if not self.window:
+            await self._write(text)
+            return
+        self._batch.append(text)
+        if len(self._batch) >= MAX_BATCH:
+            await self.flush()
+        elif self._flush_later is None:
+            self._flush_later = asyncio.ensure_future(self._flush_after_window())
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window)
+        self._flush_later = None
+        await self.flush()
+
+    async def flush(self):
+        """Send the broadcasts waiting to be coalesced."""
+        if self._flush_later is not None:
+            self._flush_later.cancel()
+            self._flush_later = None
+        batch, self._batch = self._batch, []
+        if len(batch) == 1:
+            await self._write(batch[0])
+        elif batch:
+            stats['batches'] += 1
+            await self._write('{"type": "batch", "frames": [' + ', '.join(batch) + ']}')
+
+    async def ping(self):
+        self.last_ping += 1
+        await self.send(json.dumps({'type': 'ping', 'id': self.last_ping}))
+        self.pings[self.last_ping] = self.sent
+
+    async def received(self, data):
+        """Note a frame from the client; True if it was a pong, which needs nothing else."""
+        self.last_seen = time.monotonic()
+        if data.get('action') != 'pong':
+            return False
+        sent = self.pings.pop(data.get('id'), None)
+        if sent is None:
+            return True
+        #Frames are read in order, so earlier pings were passed too
+        self.pings = {ping: offset for ping, offset in self.pings.items() if ping > data['id']}
+        self.acked = max(self.acked, sent)
+        if self.stalled and self.on_stall == 'resync' and self.pending <= self.low_water:
+            self.stalled = False
+            stats['resyncs'] += 1
+            dropped, self.dropped = self.dropped, 0
+            await self.send(json.dumps({'type': 'resync', 'dropped': dropped}))
+        return True
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if time.monotonic() - self.last_seen > self.idle_timeout:
+                stats['reaped'] += 1
+                await self.consumer.close(code=IDLE)
+                return
+            await self.ping()
+            if self.on_beat is not None:
+                await self.on_beat()
+
+
+def metrics():
+    return dict(stats)
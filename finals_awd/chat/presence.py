@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+
+# Who is online, and typing, in each course chat room.
+# Nothing is written to the database: every open ChatConsumer is an entry
+# (room, user_id, channel) with an expiry TTL seconds away, renewed by the
+# socket's heartbeat (chat.outbound), so a user is online while any of their
+# tabs is. Sockets that vanish without disconnecting (a crashed process) just
+# expire; heartbeats sweep expired entries out of the room.
+#
+# Two backends (settings.CHAT_PRESENCE['BACKEND']), as in chat.recent:
+#   'local'  process memory; only sockets of this process are seen, which is
+#            enough with a single server process.
+#   'redis'  a sorted set per room (member "user_id:channel", score = expiry)
+#            in the channel layer's Redis, shared by every server process.
+#
+# Changes reach the room as diffs, not lists: each process gathers them for
+# DEBOUNCE_MS and then sends one {type: 'presence', online, offline, typing}
+# frame. Sockets get the whole roster ({type: 'presence', roster}) once, on
+# connect, and GET /chat/api/courses/<id>/online/ reads it from here, in time
+# proportional to the tabs open in the room.
+#
+# Typing is not stored: {action: 'typing'} from a client is passed on at most
+# once per TYPING_TTL / 2, and clients stop showing it TYPING_TTL seconds
+# after the last one (or when that user's message arrives).
+
+DEFAULTS = {
+    'BACKEND': 'local',
+    'TTL': 60,
+    'DEBOUNCE_MS': 500,
+    'TYPING_TTL': 6,
+    'REDIS_URL': None,  # defaults to the channel layer's first host
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_PRESENCE', {})}
+
+
+class LocalPresence:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}  # room -> {(user_id, channel): expires}
+
+    def touch(self, room, user_id, channel, expires):
+        with self._lock:
+            self._rooms.setdefault(room, {})[(user_id, channel)] = expires
+
+    def leave(self, room, user_id, channel):
+        with self._lock:
+            entries = self._rooms.get(room, {})
+            entries.pop((user_id, channel), None)
+            if not entries:
+                self._rooms.pop(room, None)
+
+    def live(self, room, now):
+        with self._lock:
+            return {user_id for (user_id, _), expires in self._rooms.get(room, {}).items() if expires > now}
+
+    def sweep(self, room, now):
+        """(user ids online, user ids whose last entry just expired)."""
+        with self._lock:
+            entries = self._rooms.get(room, {})
+            expired = [key for key, expires in entries.items() if expires <= now]
+            for key in expired:
+                del entries[key]
+            if not entries:
+                self._rooms.pop(room, None)
+            online = {user_id for user_id, _ in entries}
+            return online, {user_id for user_id, _ in expired} - online
+
+
+class RedisPresence:
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def _key(self, room):
+        return f'chat:presence:{room}'
+
+    def touch(self, room, user_id, channel, expires):
+        key = self._key(room)
+        pipe = self.client.pipeline()
+        pipe.zadd(key, {f'{user_id}:{channel}': expires})
+        pipe.expireat(key, int(expires) + 1)
+        pipe.execute()
+
+    def leave(self, room, user_id, channel):
+        self.client.zrem(self._key(room), f'{user_id}:{channel}')
+
+    def live(self, room, now):
+        members = self.client.zrangebyscore(self._key(room), f'({now}', '+inf')
+        return {int(member.split(b':', 1)[0]) for member in members}
+
+    def sweep(self, room, now):
+        key = self._key(room)
+        pipe = self.client.pipeline()
+        pipe.zrangebyscore(key, '-inf', now)
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zrangebyscore(key, f'({now}', '+inf')
+        expired, _, live = pipe.execute()
+        online = {int(member.split(b':', 1)[0]) for member in live}
+        return online, {int(member.split(b':', 1)[0]) for member in expired} - online
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            conf = config()
+            if conf['BACKEND'] == 'local':
+                _backend = LocalPresence()
+            elif conf['BACKEND'] == 'redis':
+                url = conf['REDIS_URL'] or settings.CHANNEL_LAYERS['default']['CONFIG']['hosts'][0]
+                _backend = RedisPresence(url)
+            else:
+                raise ValueError(f"Unknown CHAT_PRESENCE backend {conf['BACKEND']!r}")
+        return _backend
+
+
+def _safely(default, func, *args):
+    # Presence is decoration; a broken store must never break the chat
+    try:
+        return func(*args)
+    except Exception:
+        logger.warning("presence registry %s failed", func.__name__, exc_info=True)
+        return default
+
+
+def join(room, user_id, channel):
+    _safely(None, backend().touch, room, user_id, channel, time.time() + config()['TTL'])
+
+
+def refresh(room, user_id, channel):
+    """Renew a socket from its heartbeat; returns the user ids that just expired."""
+    join(room, user_id, channel)
+    return _safely((set(), set()), backend().sweep, room, time.time())[1]
+
+
+def leave(room, user_id, channel):
+    """Drop a socket; returns the user ids now offline (the user, unless another tab is open)."""
+    _safely(None, backend().leave, room, user_id, channel)
+    still_online, gone = _safely((set(), set()), backend().sweep, room, time.time())
+    if user_id not in still_online:
+        gone.add(user_id)
+        _typing_sent.pop((room, user_id), None)
+    return gone
+
+
+def online(room):
+    """User ids with a live socket in the room; no database, no writes."""
+    return _safely(set(), backend().live, room, time.time())
+
+
+# Debounced diffs, per process: room -> {'online': set, 'offline': set, 'typing': set}
+_diffs = {}
+_flushes = {}
+_typing_sent = {}
+
+
+def changed(room, online=(), offline=(), typing=()):
+    """Queue presence changes for the room's next diff frame."""
+    diff = _diffs.setdefault(room, {'online': set(), 'offline': set(), 'typing': set()})
+    for user_id in online:
+        diff['offline'].discard(user_id)
+        diff['online'].add(user_id)
+    for user_id in offline:
+        diff['online'].discard(user_id)
+        diff['typing'].discard(user_id)
+        diff['offline'].add(user_id)
+    diff['typing'].update(typing)
+    pending = _flushes.get(room)
+    #A flush left behind by an event loop that has since closed will never run
+    if pending is None or pending.get_loop() is not asyncio.get_running_loop():
+        _flushes[room] = asyncio.ensure_future(_flush_later(room))
+
+
+def typing(room, user_id):
+    """Note that a user is typing; passed on at most once per TYPING_TTL / 2."""
+    now = time.monotonic()
+    key = (room, user_id)
+    if now - _typing_sent.get(key, -float('inf')) < config()['TYPING_TTL'] / 2:
+        return
+    _typing_sent[key] = now
+    changed(room, typing=[user_id])
+
+
+async def _flush_later(room):
+    await asyncio.sleep(config()['DEBOUNCE_MS'] / 1000)
+    _flushes.pop(room, None)
+    diff = _diffs.pop(room, None)
+    if diff:
+        await _send_diff(room, diff)
+
+
+async def _send_diff(room, diff):
+    text = json.dumps({
+        'type': 'presence',
+        'online': sorted(diff['online']),
+        'offline': sorted(diff['offline']),
+        'typing': sorted(diff['typing']),
+    })
+    try:
+        await get_channel_layer().group_send(room, {'type': 'chat.presence', 'text': text})
+    except Exception:
+        logger.warning("presence diff for %s failed", room, exc_info=True)
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'CHAT_PRESENCE':
+        _backend = None
+        _diffs.clear()
+        _flushes.clear()
+        _typing_sent.clear()
@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+# Inbound limits for chat sockets (settings.CHAT_RATE_LIMITS).
+# Every frame must fit in MAX_FRAME_BYTES and every message in
+# MAX_MESSAGE_LENGTH characters. Sending a message also takes a token from two
+# buckets: one for the socket (SOCKET_RATE per second, up to SOCKET_BURST at
+# once) and one for the user in that room, shared by all their tabs
+# (USER_RATE / USER_BURST). Other requests (history pages, presence, typing,
+# opening a DM thread) take a token from the socket's bucket only. Anything
+# over a limit, and any frame that isn't a JSON object, is dropped before it
+# reaches the database or the channel layer, and the client gets
+# {type: 'error', code, detail, retry_after?} instead.
+#
+# COURSES overrides any of these for one course chat room
+# ({course_id: {'USER_RATE': 5, ...}}); private messages use the defaults.
+# User buckets live in the memory of each server process, like the
+# write-behind buffer, so a user spread over several processes gets each
+# process's allowance.
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_FRAME_BYTES': 16 * 1024,
+    'MAX_MESSAGE_LENGTH': 2000,
+    'SOCKET_RATE': 1.0,
+    'SOCKET_BURST': 5,
+    'USER_RATE': 2.0,
+    'USER_BURST': 10,
+    'COURSES': {},
+}
+
+#User buckets kept before idle (full) ones are swept
+SWEEP_AT = 10_000
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_RATE_LIMITS', {})}
+
+
+def limits(course_id=None):
+    """Limits of a course chat room, or of private messages when course_id is None."""
+    conf = config()
+    courses = {int(course): overrides for course, overrides in conf.pop('COURSES').items()}
+    if course_id is not None:
+        conf.update(courses.get(int(course_id), {}))
+    return conf
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now=None):
+        """0 if a token was taken, else the seconds until one is available."""
+        self.refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+#(user_id, course_id) -> TokenBucket; course_id is None for private messages
+_user_buckets = {}
+_lock = threading.Lock()
+
+#What was turned away, by reason, and what got through; see metrics()
+stats = Counter()
+
+
+def _user_bucket(key, rate, burst, now):
+    with _lock:
+        if len(_user_buckets) >= SWEEP_AT:
+            # A full bucket is the same as no bucket
+            for stale in [k for k, bucket in _user_buckets.items() if bucket.is_full(now)]:
+                del _user_buckets[stale]
+        bucket = _user_buckets.get(key)
+        if bucket is None:
+            bucket = _user_buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+
+def _error(reason, detail, retry_after=None):
+    stats[reason] += 1
+    frame = {'type': 'error', 'code': reason, 'detail': detail}
+    if retry_after is not None:
+        frame['retry_after'] = round(retry_after, 2)
+    return frame
+
+
+class Limiter:
+    """The limits of one socket; check_*() return None or the error frame to send back."""
+
+    def __init__(self, user_id, course_id=None):
+        self.conf = limits(course_id)
+        self.user_key = (user_id, course_id)
+        self.socket_bucket = TokenBucket(self.conf['SOCKET_RATE'], self.conf['SOCKET_BURST'])
+
+    def check_frame(self, text_data):
+        if not self.conf['ENABLED']:
+            return None
+        #Characters are at most 4 bytes, so only long frames need encoding
+        if len(text_data) * 4 > self.conf['MAX_FRAME_BYTES'] and \
+                len(text_data.encode()) > self.conf['MAX_FRAME_BYTES']:
+            return _error('frame_too_large', f"Frames are limited to {self.conf['MAX_FRAME_BYTES']} bytes")
+        return None
+
+    def read_frame(self, text_data):
+        """(the frame as a dict, None), or (None, the error frame to send back)."""
+        error = self.check_frame(text_data)
+        if error:
+            return None, error
+        try:
+            data = json.loads(text_data)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return None, _error('invalid_frame', 'Frames must be JSON objects')
+        return data, None
+
+    def check_action(self):
+        """Charge a request other than a message to the socket's bucket."""
+        if not self.conf['ENABLED']:
+            return None
+        wait = self.socket_bucket.take()
+        if wait:
+            return _error('socket_rate', 'Too many requests, slow down', wait)
+        return None
+
+    def check_message(self, message):
+        if not isinstance(message, str):
+            return _error('invalid_message', 'message must be text')
+        if not self.conf['ENABLED']:
+            return None
+        if len(message) > self.conf['MAX_MESSAGE_LENGTH']:
+            return _error('message_too_long',
+                          f"Messages are limited to {self.conf['MAX_MESSAGE_LENGTH']} characters")
+
+        now = time.monotonic()
+        wait = self.socket_bucket.take(now)
+        if wait:
+            return _error('socket_rate', 'Too many messages, slow down', wait)
+        user_bucket = _user_bucket(self.user_key, self.conf['USER_RATE'], self.conf['USER_BURST'], now)
+        with _lock:
+            wait = user_bucket.take(now)
+        if wait:
+            #Not sent, so the socket keeps its token
+            self.socket_bucket.tokens += 1
+            return _error('user_rate', 'Too many messages from your account, slow down', wait)
+        stats['accepted'] += 1
+        return None
+
+
+def metrics():
+    return {**stats, 'user_buckets': len(_user_buckets)}
+
+
+@receiver(setting_changed)
+def _reset(setting, **kwargs):
+    if setting == 'CHAT_RATE_LIMITS':
+        with _lock:
+            _user_buckets.clear()
@@ -0,0 +1,207 @@
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+
+# Recent messages of each course chat room, already serialized.
+# ChatConsumer serves the connect-time history (and short resumes) from here
+# instead of the Message table; the database is only read when a room is cold.
+#
+# Two backends (settings.CHAT_RECENT_MESSAGES['BACKEND']):
+#   'local'  process memory. A room is kept only while a socket of this
+#            process is in it, because that socket's group subscription is
+#            what keeps the buffer current; the last one to leave drops it.
+#   'redis'  a sorted set per room (score = seq) in the channel layer's
+#            Redis, shared by every server process and updated by the sender.
+# An empty BACKEND turns the buffer off.
+#
+# Entries are the dicts ChatConsumer.serialize_message() returns, keyed by seq,
+# so late or repeated updates for a message can't reorder or duplicate it.
+
+DEFAULTS = {
+    'BACKEND': 'local',
+    'SIZE': 50,
+    'REDIS_URL': None,  # defaults to the channel layer's first host
+    'TIMEOUT': 24 * 60 * 60,
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_RECENT_MESSAGES', {})}
+
+
+class LocalRecentMessages:
+    updated_by_sender = False
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._rooms = {}
+        self._sockets = {}
+
+    def attach(self, room):
+        with self._lock:
+            self._sockets[room] = self._sockets.get(room, 0) + 1
+
+    def detach(self, room):
+        with self._lock:
+            count = self._sockets.get(room, 0) - 1
+            if count > 0:
+                self._sockets[room] = count
+            else:
+                self._sockets.pop(room, None)
+                self._rooms.pop(room, None)
+
+    def get(self, room):
+        with self._lock:
+            entries = self._rooms.get(room)
+            return [entries[seq] for seq in sorted(entries)] if entries else None
+
+    def add(self, room, entries):
+        with self._lock:
+            if room not in self._sockets:
+                return  # nobody here to keep it current
+            buffered = self._rooms.setdefault(room, {})
+            for entry in entries:
+                buffered[entry['seq']] = entry
+            for seq in sorted(buffered)[:-self.size]:
+                del buffered[seq]
+
+    def invalidate(self, room):
+        with self._lock:
+            self._rooms.pop(room, None)
+
+
+class RedisRecentMessages:
+    updated_by_sender = True
+
+    def __init__(self, size, url, timeout):
+        import redis
+
+        self.size = size
+        self.timeout = timeout
+        self.client = redis.Redis.from_url(url)
+
+    def _key(self, room):
+        # v2: entries carry user_id instead of username and profile_pic
+        return f'chat:recent:v2:{room}'
+
+    def attach(self, room):
+        pass
+
+    def detach(self, room):
+        pass
+
+    def get(self, room):
+        members = self.client.zrange(self._key(room), 0, -1)
+        return [json.loads(member) for member in members] or None
+
+    def add(self, room, entries):
+        key = self._key(room)
+        pipe = self.client.pipeline()
+        pipe.zadd(key, {json.dumps(entry, sort_keys=True): entry['seq'] for entry in entries})
+        pipe.zremrangebyrank(key, 0, -self.size - 1)
+        pipe.expire(key, self.timeout)
+        pipe.execute()
+
+    def invalidate(self, room):
+        self.client.delete(self._key(room))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    """The configured buffer, or None when it is turned off."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            conf = config()
+            if conf['BACKEND'] == 'local':
+                _backend = LocalRecentMessages(conf['SIZE'])
+            elif conf['BACKEND'] == 'redis':
+                url = conf['REDIS_URL'] or settings.CHANNEL_LAYERS['default']['CONFIG']['hosts'][0]
+                _backend = RedisRecentMessages(conf['SIZE'], url, conf['TIMEOUT'])
+            elif conf['BACKEND']:
+                raise ValueError(f"Unknown CHAT_RECENT_MESSAGES backend {conf['BACKEND']!r}")
+            else:
+                _backend = False
+        return _backend or None
+
+
+def _safely(default, func, *args):
+    # A broken buffer only costs a database query, never a chat message
+    try:
+        return func(*args)
+    except Exception:
+        logger.warning("recent message buffer %s failed", func.__name__, exc_info=True)
+        return default
+
+
+def attach(room):
+    if backend():
+        _safely(None, backend().attach, room)
+
+
+def detach(room):
+    if backend():
+        _safely(None, backend().detach, room)
+
+
+def latest(room, limit):
+    """(newest `limit` entries, has_more), or None if the room isn't buffered."""
+    entries = backend() and _safely(None, backend().get, room)
+    if not entries or (len(entries) < limit and entries[0]['seq'] > 1):
+        return None  # cold, or holding less than a page of a longer room
+    entries = entries[-limit:]
+    return entries, entries[0]['seq'] > 1
+
+
+def since(room, seq):
+    """Entries after `seq`, or None unless the buffer reaches back that far."""
+    entries = backend() and _safely(None, backend().get, room)
+    if not entries or entries[0]['seq'] > seq + 1:
+        return None
+    return [entry for entry in entries if entry['seq'] > seq]
+
+
+def fill(room, entries):
+    """Seed a cold room from rows just read from the database."""
+    if backend() and entries:
+        _safely(None, backend().add, room, entries)
+
+
+def sent(room, entry):
+    """Called once by the sender, for backends shared between processes."""
+    if backend() and backend().updated_by_sender:
+        _safely(None, backend().add, room, [entry])
+
+
+def wants_broadcasts():
+    """True when receiving sockets keep the buffer current (see received())."""
+    return bool(backend()) and not backend().updated_by_sender
+
+
+def received(room, entry):
+    """Called by every socket that gets the broadcast, for per-process backends."""
+    if backend() and not backend().updated_by_sender:
+        _safely(None, backend().add, room, [entry])
+
+
+def invalidate(room):
+    if backend():
+        _safely(None, backend().invalidate, room)
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'CHAT_RECENT_MESSAGES':
+        _backend = None
@@ -5,8 +5,11 @@ from . import consumers
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<course_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
 
-    #private chat
-    re_path(r'^ws/private/(?P<user_id>\d+)/$', consumers.PrivateChatConsumer.as_asgi()),
+    #all of a user's private conversations
+    re_path(r'^ws/dm/$', consumers.DirectMessageConsumer.as_asgi()),
+
+    #live notification dropdown/badge
+    re_path(r'^ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
 ]
 
 print("WebSocket routes loaded:", websocket_urlpatterns)
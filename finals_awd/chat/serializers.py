@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import PrivateMessage, ChatNotification
+from .models import Conversation, PrivateMessage
+from . import directory
 from accounts.models import CustomUser
 
 
@@ -19,17 +20,48 @@ class PrivateMessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'sender', 'receiver', 'content', 'timestamp', 'room_name']
 
 
-#To test notification
-class ChatNotificationSerializer(serializers.ModelSerializer):
+#Chat notifications: threads from chat.threads.as_notification(), id is the conversation's
+class ChatNotificationSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
     sender = UserMiniSerializer()
-
-    class Meta:
-        model = ChatNotification
-        fields = ['id', 'sender', 'message', 'timestamp', 'is_read']
+    message = serializers.CharField()
+    timestamp = serializers.DateTimeField()
+    is_read = serializers.BooleanField()
+    unread = serializers.IntegerField()
 
 
 #To test api to send message
 class PrivateMessageCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = PrivateMessage
-        fields = ['receiver', 'content', 'room_name']  # sender is set in the view
\ No newline at end of file
+        fields = ['receiver', 'content', 'room_name']  # sender is set in the view
+
+
+#Inbox rows from chat.threads.page(); needs the request in the context
+class ConversationSerializer(serializers.ModelSerializer):
+    other_user = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    unread = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Conversation
+        fields = ['id', 'other_user', 'last_message', 'unread', 'last_activity']
+
+    def _user_id(self):
+        return self.context['request'].user.id
+
+    def get_other_user(self, obj):
+        other = obj.user_high if obj.user_low_id == self._user_id() else obj.user_low
+        prefix = self.context['request'].build_absolute_uri('/')[:-1]
+        return directory.absolute([directory.entry(other)], prefix)[0]
+
+    def get_last_message(self, obj):
+        return {
+            'id': obj.last_message_id,
+            'user_id': obj.last_message.sender_id,
+            'preview': obj.preview,
+            'timestamp': serializers.DateTimeField().to_representation(obj.last_message.timestamp),
+        }
+
+    def get_unread(self, obj):
+        return obj.unread_for(self._user_id())
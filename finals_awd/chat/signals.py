@@ -0,0 +1,61 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from chat import directory, recent
+from chat.models import Message, course_room
+from courses.models import Course, Enrollment
+
+logger = logging.getLogger(__name__)
+
+
+# A deleted message must not be replayed from the recent-message buffer (chat.recent)
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: forget_recent(course_room(instance.course_id)))
+
+
+def _group_send(room, event):
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(channel_layer.group_send)(room, event)
+
+
+def forget_recent(room):
+    """Drop a room's recent-message buffer here and in every other server process."""
+    recent.invalidate(room)
+    try:
+        # Sockets in the room drop their process's copy (ChatConsumer.recent_invalidate)
+        _group_send(room, {'type': 'recent.invalidate'})
+    except Exception:
+        logger.warning("recent message invalidation for %s failed", room, exc_info=True)
+
+
+# Someone who joins a course while its chat is open is added to every open
+# socket's user directory (ChatConsumer.chat_users)
+
+@receiver(post_save, sender=Enrollment)
+def student_enrolled(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: introduce(instance.course_id, instance.student_id))
+
+
+@receiver(post_save, sender=Course)
+def teacher_changed(sender, instance, created, **kwargs):
+    # courses.signals remembers the teacher before the save
+    previous = getattr(instance, '_previous_teacher_id', None)
+    if not created and previous != instance.teacher_id:
+        transaction.on_commit(lambda: introduce(instance.id, instance.teacher_id))
+
+
+def introduce(course_id, user_id):
+    room = course_room(course_id)
+    try:
+        _group_send(room, {'type': 'chat.users', 'users': directory.users([user_id])})
+    except Exception:
+        logger.warning("user directory update for %s failed", room, exc_info=True)
@@ -1,8 +1,25 @@
-from django.test import TestCase
+import asyncio
+import json
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.contrib.auth.models import AnonymousUser
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
 from rest_framework.test import APITestCase
 from django.urls import reverse
+from django.utils import timezone
 from accounts.models import CustomUser
-from chat.models import PrivateMessage
+from chat.models import Message, PrivateMessage, Conversation, RoomSequence, course_room
+from chat.consumers import NotificationConsumer
+from chat import history, outbound, presence, ratelimit, writebehind
+from chat.routing import websocket_urlpatterns
+from courses.models import Course, Enrollment
+from dashboard import counters, fanout
 
 # Create your tests here.
 
@@ -31,4 +48,847 @@ class PrivateMessageApiTest(APITestCase):
             'room_name': 'room_1'
         }
         response = self.client.post(self.url, data)
-        self.assertEqual(response.status_code, 403)
\ No newline at end of file
+        self.assertEqual(response.status_code, 403)
+
+class ChatUsersApiTest(APITestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user(username='alice', password='testpass')
+        self.bob = CustomUser.objects.create_user(username='bob', password='testpass')
+        self.url = reverse('chat_users_api')
+
+    def test_batch_lookup(self):
+        self.client.login(username='alice', password='testpass')
+        response = self.client.get(self.url, {'ids': f'{self.bob.id},{self.alice.id},999999'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([u['username'] for u in response.data['users']], ['alice', 'bob'])
+        self.assertEqual(response.data['users'][0]['profile_pic'], 'http://testserver/static/default-avatar.png')
+
+    def test_rejects_bad_and_oversized_lookups(self):
+        self.client.login(username='alice', password='testpass')
+        self.assertEqual(self.client.get(self.url, {'ids': 'alice'}).status_code, 400)
+        too_many = ','.join(str(i) for i in range(1, 102))
+        self.assertEqual(self.client.get(self.url, {'ids': too_many}).status_code, 400)
+
+
+class ConversationsApiTest(APITestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user(username='alice', password='testpass')
+        self.others = [CustomUser.objects.create_user(username=f'friend{i}', password='testpass') for i in range(3)]
+        for i, other in enumerate(self.others):
+            for n in range(i + 1):
+                PrivateMessage.objects.create(sender=other, receiver=self.alice, content=f'{other.username} {n} ' + 'x' * 200)
+        PrivateMessage.objects.create(sender=self.alice, receiver=self.others[0], content='reply')
+        self.url = reverse('conversations_api')
+        self.client.login(username='alice', password='testpass')
+
+    def test_threads_newest_first_with_preview_and_unread(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        rows = response.data['results']
+        self.assertEqual([r['other_user']['username'] for r in rows], ['friend0', 'friend2', 'friend1'])
+        #Alice answered friend0, which read that thread
+        self.assertEqual([r['unread'] for r in rows], [0, 3, 2])
+        self.assertEqual(rows[0]['last_message']['preview'], 'reply')
+        self.assertEqual(rows[0]['last_message']['user_id'], self.alice.id)
+        self.assertEqual(len(rows[1]['last_message']['preview']), 100)
+        self.assertIsNone(response.data['next'])
+
+    def test_pages_in_constant_queries(self):
+        with CaptureQueriesContext(connection) as one_row:
+            first = self.client.get(self.url, {'limit': 1})
+        with CaptureQueriesContext(connection) as all_rows:
+            self.client.get(self.url, {'limit': 3})
+        self.assertEqual(len(one_row), len(all_rows))
+
+        second = self.client.get(self.url, {'limit': 1, 'before': first.data['next']})
+        third = self.client.get(self.url, {'limit': 1, 'before': second.data['next']})
+        self.assertEqual([r.data['results'][0]['other_user']['username'] for r in (first, second, third)],
+                         ['friend0', 'friend2', 'friend1'])
+        self.assertIsNone(third.data['next'])
+
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class NotificationConsumerTest(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='testpass')
+        self.sender = CustomUser.objects.create_user(username='writer', password='testpass')
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        return connected, communicator
+
+    async def test_rejects_anonymous_users(self):
+        connected, _ = await self.connect(AnonymousUser())
+        self.assertFalse(connected)
+
+    async def test_pushes_new_items_with_unread_count(self):
+        connected, communicator = await self.connect(self.user)
+        self.assertTrue(connected)
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'unread', 'unread': 0})
+
+        await database_sync_to_async(fanout.notify)([self.user.id], 'New file uploaded')
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['type'], 'notification')
+        self.assertEqual(frame['item']['message'], 'New file uploaded')
+        self.assertEqual(frame['unread'], 1)
+
+        await database_sync_to_async(PrivateMessage.objects.create)(
+            sender=self.sender, receiver=self.user, content='hi')
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['item']['sender'], 'writer')
+        self.assertEqual(frame['unread'], 2)
+
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatConsumerTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = CustomUser.objects.create_user(username='teacher', password='testpass', is_teacher=True)
+        self.student = CustomUser.objects.create_user(username='student', password='testpass', is_student=True)
+        self.course = Course.objects.create(title='Chat Course', teacher=self.teacher)
+        Enrollment.objects.create(course=self.course, student=self.student)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        if connected:
+            await communicator.receive_json_from()  # users
+        return connected, communicator
+
+    async def test_history_is_sent_as_one_frame(self):
+        for i in range(3):
+            await database_sync_to_async(Message.objects.create)(
+                course=self.course, sender=self.student, content=f'message {i}')
+
+        connected, communicator = await self.connect(self.teacher)
+        self.assertTrue(connected)
+
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['type'], 'history')
+        self.assertEqual([m['message'] for m in frame['messages']], ['message 0', 'message 1', 'message 2'])
+        self.assertEqual(frame['messages'][0]['user_id'], self.student.id)
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.disconnect()
+
+    async def test_sent_message_is_saved_once_and_broadcast_with_id(self):
+        connected, communicator = await self.connect(self.student)
+        await communicator.receive_json_from()  # history
+
+        await communicator.send_json_to({'message': 'hello class'})
+        frame = await communicator.receive_json_from()
+
+        saved = await database_sync_to_async(Message.objects.get)(content='hello class')
+        self.assertEqual(frame['type'], 'message')
+        self.assertEqual(frame['id'], str(saved.public_id))
+        self.assertEqual(frame['timestamp'], saved.timestamp.strftime('%H:%M'))
+        self.assertEqual(frame['user_id'], self.student.id)
+
+        await communicator.disconnect()
+
+    async def test_user_directory_on_connect_and_user_id_in_messages(self):
+        self.student.profile_picture = 'profiles/student.png'
+        self.student.avatar_version = 1700000000
+        await database_sync_to_async(self.student.save)()
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.id}/',
+                                             headers=[(b'host', b'testserver')])
+        communicator.scope['user'] = self.student
+        await communicator.connect()
+
+        users = await communicator.receive_json_from()
+        self.assertEqual(users['type'], 'users')
+        self.assertEqual(users['users'], [
+            {'id': self.teacher.id, 'username': 'teacher', 'profile_pic': 'http://testserver/static/default-avatar.png'},
+            {'id': self.student.id, 'username': 'student',
+             'profile_pic': 'http://testserver/media/profiles/student.png?v=1700000000'},
+        ])
+        await communicator.receive_json_from()  # history
+
+        await communicator.send_json_to({'message': 'one'})
+        frame = await communicator.receive_json_from()
+        self.assertEqual(set(frame), {'type', 'id', 'seq', 'user_id', 'message', 'timestamp'})
+
+        await communicator.disconnect()
+
+    async def test_new_member_is_added_to_open_directories(self):
+        connected, communicator = await self.connect(self.teacher)
+        await communicator.receive_json_from()  # history
+
+        newcomer = await database_sync_to_async(CustomUser.objects.create_user)(username='newcomer', password='testpass')
+        await database_sync_to_async(Enrollment.objects.create)(course=self.course, student=newcomer)
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['type'], 'users')
+        self.assertEqual([(u['id'], u['username']) for u in frame['users']], [(newcomer.id, 'newcomer')])
+
+        await communicator.disconnect()
+
+    async def test_broadcast_is_encoded_once_and_forwarded_as_is(self):
+        connected, sender = await self.connect(self.student)
+        connected, reader = await self.connect(self.teacher)
+        await sender.receive_json_from()  # history
+        await reader.receive_json_from()
+
+        with mock.patch('chat.consumers.json.dumps', wraps=json.dumps) as dumps:
+            await sender.send_to(text_data='{"message": "hello class"}')
+            sent_text = await sender.receive_from()
+            read_text = await reader.receive_from()
+        self.assertEqual(dumps.call_count, 1)
+        self.assertEqual(sent_text, read_text)
+        self.assertEqual(json.loads(read_text)['message'], 'hello class')
+
+        await reader.disconnect()
+        await sender.disconnect()
+
+    async def test_history_before_returns_older_pages(self):
+        #Same timestamp for every row, so the pages are told apart by id alone
+        now = timezone.now()
+        await database_sync_to_async(Message.objects.bulk_create)([
+            Message(course=self.course, sender=self.student, content=f'message {i}', timestamp=now, seq=i + 1)
+            for i in range(45)
+        ])
+        connected, communicator = await self.connect(self.student)
+        newest = await communicator.receive_json_from()
+        self.assertEqual(newest['messages'][0]['message'], 'message 25')
+        self.assertTrue(newest['has_more'])
+
+        await communicator.send_json_to({'action': 'history_before', 'before': newest['messages'][0]['id']})
+        older = await communicator.receive_json_from()
+        self.assertEqual([m['message'] for m in older['messages']], [f'message {i}' for i in range(5, 25)])
+        self.assertTrue(older['has_more'])
+
+        await communicator.send_json_to({'action': 'history_before', 'before': older['messages'][0]['id']})
+        oldest = await communicator.receive_json_from()
+        self.assertEqual([m['message'] for m in oldest['messages']], [f'message {i}' for i in range(5)])
+        self.assertFalse(oldest['has_more'])
+
+        await communicator.send_json_to({'action': 'history_before', 'before': 'not-a-message'})
+        self.assertEqual((await communicator.receive_json_from())['messages'], [])
+
+        await communicator.disconnect()
+
+
+    async def test_reconnect_with_since_gets_only_missed_messages(self):
+        for i in range(5):
+            await database_sync_to_async(Message.objects.create)(
+                course=self.course, sender=self.student, content=f'message {i}')
+
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.id}/?since=3')
+        communicator.scope['user'] = self.teacher
+        await communicator.connect()
+        await communicator.receive_json_from()  # users
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['since'], 3)
+        self.assertEqual([m['seq'] for m in frame['messages']], [4, 5])
+
+        await communicator.send_json_to({'message': 'back again'})
+        self.assertEqual((await communicator.receive_json_from())['seq'], 6)
+        await communicator.disconnect()
+
+    async def test_reconnect_after_missing_too_much_starts_over(self):
+        for i in range(3):
+            await database_sync_to_async(Message.objects.create)(
+                course=self.course, sender=self.student, content=f'message {i}')
+
+        with mock.patch.object(history, 'RESUME_LIMIT', 1):
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.id}/?since=1')
+            communicator.scope['user'] = self.teacher
+            await communicator.connect()
+            await communicator.receive_json_from()  # users
+            frame = await communicator.receive_json_from()
+        self.assertIsNone(frame['since'])
+        self.assertEqual([m['seq'] for m in frame['messages']], [1, 2, 3])
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_RECENT_MESSAGES={'BACKEND': 'local', 'SIZE': 50})
+class ChatRecentMessagesTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = CustomUser.objects.create_user(username='teacher', password='testpass', is_teacher=True)
+        self.student = CustomUser.objects.create_user(username='student', password='testpass', is_student=True)
+        self.course = Course.objects.create(title='Chat Course', teacher=self.teacher)
+        Enrollment.objects.create(course=self.course, student=self.student)
+        for i in range(3):
+            Message.objects.create(course=self.course, sender=self.student, content=f'message {i}')
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.id}/')
+        communicator.scope['user'] = user
+        await communicator.connect()
+        await communicator.receive_json_from()  # users
+        return communicator, await communicator.receive_json_from()
+
+    async def test_history_is_served_from_the_buffer_while_the_room_is_warm(self):
+        first, cold = await self.connect(self.student)
+        await first.send_json_to({'message': 'live'})
+        await first.receive_json_from()
+
+        with mock.patch.object(history, 'page', side_effect=AssertionError('database read')):
+            second, warm = await self.connect(self.teacher)
+        self.assertEqual([m['message'] for m in warm['messages']],
+                         [m['message'] for m in cold['messages']] + ['live'])
+        self.assertEqual(warm['messages'][-1]['seq'], 4)
+
+        await second.disconnect()
+        await first.disconnect()
+
+    async def test_deleting_a_message_drops_the_buffer(self):
+        first, _ = await self.connect(self.student)
+
+        await database_sync_to_async(Message.objects.filter(content='message 1').delete)()
+        self.assertTrue(await first.receive_nothing())  # let the socket handle the invalidation
+
+        second, history_frame = await self.connect(self.teacher)
+        self.assertEqual([m['message'] for m in history_frame['messages']], ['message 0', 'message 2'])
+
+        await second.disconnect()
+        await first.disconnect()
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    CHAT_RATE_LIMITS={'SOCKET_RATE': 0.001, 'SOCKET_BURST': 2, 'USER_RATE': 0.001, 'USER_BURST': 3,
+                      'MAX_MESSAGE_LENGTH': 10, 'MAX_FRAME_BYTES': 200},
+)
+class ChatRateLimitTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        ratelimit._user_buckets.clear()
+        self.teacher = CustomUser.objects.create_user(username='teacher', password='testpass', is_teacher=True)
+        self.course = Course.objects.create(title='Chat Course', teacher=self.teacher)
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.id}/')
+        communicator.scope['user'] = self.teacher
+        await communicator.connect()
+        await communicator.receive_json_from()  # users
+        await communicator.receive_json_from()  # history
+        return communicator
+
+    async def test_socket_burst_then_error_frame(self):
+        communicator = await self.connect()
+        throttled = ratelimit.stats['socket_rate']
+        for i in range(3):
+            await communicator.send_json_to({'message': f'm{i}'})
+        frames = [await communicator.receive_json_from() for _ in range(3)]
+
+        self.assertEqual([f['type'] for f in frames], ['message', 'message', 'error'])
+        self.assertEqual(frames[2]['code'], 'socket_rate')
+        self.assertGreater(frames[2]['retry_after'], 0)
+        self.assertEqual(ratelimit.stats['socket_rate'], throttled + 1)
+        self.assertEqual(await database_sync_to_async(Message.objects.count)(), 2)
+        await communicator.disconnect()
+
+    async def test_user_bucket_is_shared_by_tabs(self):
+        first, second = await self.connect(), await self.connect()
+        for socket in (first, first, second):
+            await socket.send_json_to({'message': 'hi'})
+            await first.receive_json_from()
+            await second.receive_json_from()
+
+        await second.send_json_to({'message': 'hi'})
+        error = await second.receive_json_from()
+        self.assertEqual(error['code'], 'user_rate')
+        self.assertTrue(await first.receive_nothing())
+        await first.disconnect()
+        await second.disconnect()
+
+    async def test_long_messages_and_frames_are_refused(self):
+        communicator = await self.connect()
+        await communicator.send_json_to({'message': 'x' * 11})
+        self.assertEqual((await communicator.receive_json_from())['code'], 'message_too_long')
+        await communicator.send_json_to({'message': 'hi', 'padding': 'x' * 200})
+        self.assertEqual((await communicator.receive_json_from())['code'], 'frame_too_large')
+
+        self.assertEqual(await database_sync_to_async(Message.objects.count)(), 0)
+        await communicator.disconnect()
+
+    async def test_malformed_frames_get_an_error_frame(self):
+        communicator = await self.connect()
+        for text in ('{bad', '[1, 2]', '"hi"'):
+            await communicator.send_to(text_data=text)
+            self.assertEqual((await communicator.receive_json_from())['code'], 'invalid_frame')
+        #The socket is still open
+        await communicator.send_json_to({'message': 'hi'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'message')
+        await communicator.disconnect()
+
+    async def test_history_and_presence_requests_take_socket_tokens(self):
+        communicator = await self.connect()
+        await communicator.send_json_to({'action': 'history_before', 'before': None})
+        await communicator.receive_json_from()  # history
+        await communicator.send_json_to({'action': 'typing'})
+        await communicator.send_json_to({'action': 'presence'})
+        self.assertEqual((await communicator.receive_json_from())['code'], 'socket_rate')
+        await communicator.send_json_to({'message': 'hi'})
+        self.assertEqual((await communicator.receive_json_from())['code'], 'socket_rate')
+        await communicator.disconnect()
+
+    async def test_limits_can_be_raised_per_course(self):
+        with override_settings(CHAT_RATE_LIMITS={'MAX_MESSAGE_LENGTH': 10,
+                                                 'COURSES': {str(self.course.id): {'MAX_MESSAGE_LENGTH': 50}}}):
+            communicator = await self.connect()
+            await communicator.send_json_to({'message': 'x' * 11})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'message')
+            await communicator.disconnect()
+
+    def test_bucket_refills_at_its_rate(self):
+        bucket = ratelimit.TokenBucket(rate=2, burst=1)
+        self.assertEqual(bucket.take(now=bucket.updated), 0)
+        self.assertAlmostEqual(bucket.take(now=bucket.updated), 0.5)
+        self.assertEqual(bucket.take(now=bucket.updated + 0.5), 0)
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = []
+        self.closed = None
+
+    async def send(self, text_data):
+        self.frames.append(json.loads(text_data))
+
+    async def close(self, code=None):
+        self.closed = code
+
+
+@override_settings(CHAT_OUTBOUND={'HIGH_WATER_BYTES': 1000, 'LOW_WATER_BYTES': 0})
+class OutboundTest(TestCase):
+    frame = json.dumps({'type': 'message', 'message': 'x' * 80})
+
+    async def test_backlog_past_high_water_collapses_into_resync(self):
+        socket = FakeSocket()
+        queue = outbound.Outbound(socket)
+        for _ in range(20):
+            await queue.broadcast(self.frame)
+        delivered = len(socket.frames)
+        self.assertTrue(queue.stalled)
+        self.assertLess(delivered, 20)
+        self.assertLessEqual(queue.pending, 1000 + len(self.frame))
+
+        #Replies still go out; the client catching up lifts the stall
+        await queue.ping()
+        ping = socket.frames[-1]
+        self.assertTrue(await queue.received({'action': 'pong', 'id': ping['id']}))
+        self.assertEqual(socket.frames[-1], {'type': 'resync', 'dropped': 20 - delivered})
+        self.assertFalse(queue.stalled)
+
+        await queue.broadcast(self.frame)
+        self.assertEqual(socket.frames[-1]['type'], 'message')
+
+    async def test_stalled_socket_can_be_closed_instead(self):
+        socket = FakeSocket()
+        with override_settings(CHAT_OUTBOUND={'HIGH_WATER_BYTES': 1000, 'ON_STALL': 'close'}):
+            queue = outbound.Outbound(socket)
+        for _ in range(20):
+            await queue.broadcast(self.frame)
+        self.assertEqual(socket.closed, outbound.STALLED)
+
+    async def test_pong_acknowledges_earlier_pings(self):
+        socket = FakeSocket()
+        queue = outbound.Outbound(socket)
+        await queue.ping()
+        await queue.broadcast(self.frame)
+        await queue.ping()
+        await queue.received({'action': 'pong', 'id': 2})
+        self.assertEqual((queue.pending, queue.pings), (0, {}))
+        self.assertFalse(await queue.received({'message': 'hi'}))
+
+    async def test_broadcasts_in_a_window_go_out_as_one_batch(self):
+        socket = FakeSocket()
+        with override_settings(CHAT_OUTBOUND={'COALESCE_MS': 10}):
+            queue = outbound.Outbound(socket, coalesce=True)
+        for i in range(3):
+            await queue.broadcast(json.dumps({'type': 'message', 'seq': i}))
+        self.assertEqual(socket.frames, [])
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(socket.frames, [{'type': 'batch', 'frames': [
+            {'type': 'message', 'seq': 0}, {'type': 'message', 'seq': 1}, {'type': 'message', 'seq': 2}]}])
+
+        #A lone broadcast goes out as it is, and replies never overtake one
+        await queue.broadcast(json.dumps({'type': 'message', 'seq': 3}))
+        await queue.send(json.dumps({'type': 'error'}))
+        self.assertEqual(socket.frames[1:], [{'type': 'message', 'seq': 3}, {'type': 'error'}])
+        queue.stop()
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    CHAT_OUTBOUND={'HEARTBEAT_INTERVAL': 0.05, 'IDLE_TIMEOUT': 0.2},
+)
+class HeartbeatTest(TransactionTestCase):
+    async def test_silent_socket_is_pinged_then_reaped(self):
+        user = await database_sync_to_async(CustomUser.objects.create_user)(username='alice', password='testpass')
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/dm/')
+        communicator.scope['user'] = user
+        await communicator.connect()
+
+        frames = []
+        while not frames or frames[-1]['type'] != 'websocket.close':
+            frames.append(await communicator.receive_output(timeout=2))
+        self.assertEqual(frames[-1]['code'], outbound.IDLE)
+        self.assertTrue(any('"ping"' in frame.get('text', '') for frame in frames))
+
+    async def test_answering_pings_keeps_a_socket_open(self):
+        user = await database_sync_to_async(CustomUser.objects.create_user)(username='alice', password='testpass')
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/dm/')
+        communicator.scope['user'] = user
+        await communicator.connect()
+
+        for _ in range(8):
+            ping = await communicator.receive_json_from(timeout=2)
+            await communicator.send_json_to({'action': 'pong', 'id': ping['id']})
+        await communicator.disconnect()
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    CHAT_PRESENCE={'BACKEND': 'local', 'TTL': 60, 'DEBOUNCE_MS': 20},
+)
+class PresenceTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = CustomUser.objects.create_user(username='teacher', password='testpass', is_teacher=True)
+        self.student = CustomUser.objects.create_user(username='student', password='testpass', is_student=True)
+        self.course = Course.objects.create(title='Chat Course', teacher=self.teacher)
+        Enrollment.objects.create(course=self.course, student=self.student)
+        self.room = course_room(self.course.id)
+        presence._reset_backend(setting='CHAT_PRESENCE')
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.id}/')
+        communicator.scope['user'] = user
+        await communicator.connect()
+        await communicator.receive_json_from()  # users
+        await communicator.receive_json_from()  # history
+        return communicator
+
+    async def next_diff(self, communicator):
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame['type'] == 'presence' and 'roster' not in frame:
+                return frame
+
+    async def test_roster_then_debounced_diffs(self):
+        teacher = await self.connect(self.teacher)
+        await teacher.send_json_to({'action': 'presence'})
+        self.assertEqual((await teacher.receive_json_from())['roster'], [self.teacher.id])
+        await asyncio.sleep(0.05)  # the teacher's own arrival
+
+        student = await self.connect(self.student)
+        while (diff := await self.next_diff(teacher))['online'] != [self.student.id]:
+            pass
+
+        #Typing is passed on once, however often the client repeats it
+        await student.send_json_to({'action': 'typing'})
+        await student.send_json_to({'action': 'typing'})
+        diff = await self.next_diff(teacher)
+        self.assertEqual((diff['online'], diff['typing']), ([], [self.student.id]))
+        self.assertTrue(await teacher.receive_nothing(0.1))
+        #Sockets that never asked for presence get none of it
+        self.assertTrue(await student.receive_nothing(0.1))
+
+        await student.disconnect()
+        diff = await self.next_diff(teacher)
+        self.assertEqual(diff['offline'], [self.student.id])
+        await teacher.disconnect()
+
+    async def test_online_until_the_last_tab_closes(self):
+        first, second = await self.connect(self.student), await self.connect(self.student)
+        self.assertEqual(presence.online(self.room), {self.student.id})
+        await first.disconnect()
+        self.assertEqual(presence.online(self.room), {self.student.id})
+        await second.disconnect()
+        self.assertEqual(presence.online(self.room), set())
+
+    def test_expired_sockets_are_reported_once(self):
+        #A socket whose process died: never renewed, long expired
+        presence.backend().touch(self.room, self.student.id, 'gone-channel', 0)
+        self.assertEqual(presence.online(self.room), set())
+        self.assertEqual(presence.refresh(self.room, self.teacher.id, 'live-channel'), {self.student.id})
+        self.assertEqual(presence.refresh(self.room, self.teacher.id, 'live-channel'), set())
+        self.assertEqual(presence.online(self.room), {self.teacher.id})
+
+    def test_roster_api_reads_the_registry(self):
+        presence.join(self.room, self.student.id, 'some-channel')
+        self.client.login(username='teacher', password='testpass')
+        url = reverse('course_presence_api', args=[self.course.id])
+        self.client.get(url)  # warms the session and membership caches
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.data, {'online': [self.student.id]})
+        self.assertFalse([q for q in queries.captured_queries if 'chat_' in q['sql'] or 'courses_' in q['sql']])
+
+        outsider = CustomUser.objects.create_user(username='outsider', password='testpass')
+        self.client.force_login(outsider)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class RoomSequenceTest(TestCase):
+    def test_sequences_are_per_room_and_gap_free(self):
+        teacher = CustomUser.objects.create_user(username='teacher', password='testpass', is_teacher=True)
+        first = Course.objects.create(title='First', teacher=teacher)
+        second = Course.objects.create(title='Second', teacher=teacher)
+
+        seqs = [Message.objects.create(course=course, sender=teacher, content='hi').seq
+                for course in (first, second, first, first)]
+        self.assertEqual(seqs, [1, 1, 2, 3])
+        self.assertEqual(RoomSequence.allocate(course_room(first.id), count=10), 4)
+        self.assertEqual(RoomSequence.objects.get(room=course_room(first.id)).last_seq, 13)
+
+
+class ConversationTest(TestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user(username='alice', password='testpass')
+        self.bob = CustomUser.objects.create_user(username='bob', password='testpass')
+
+    def test_sends_keep_the_thread_current(self):
+        first = PrivateMessage.objects.create(sender=self.bob, receiver=self.alice, content='hi')
+        last = PrivateMessage.objects.create(sender=self.bob, receiver=self.alice, content='there?')
+
+        conversation = Conversation.objects.get()
+        self.assertEqual((conversation.user_low, conversation.user_high), (self.alice, self.bob))
+        self.assertEqual(first.conversation_id, conversation.id)
+        self.assertEqual(last.room_name, conversation.room_name)
+        self.assertEqual(conversation.last_message.content, 'there?')
+        self.assertEqual(conversation.unread_for(self.alice.id), 2)
+        self.assertEqual(conversation.unread_for(self.bob.id), 0)
+        self.assertEqual(Conversation.find(self.bob.id, self.alice.id), conversation)
+
+        #Replying moves the sender's watermark: Alice has read what she answered
+        PrivateMessage.objects.create(sender=self.alice, receiver=self.bob, content='yes')
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.unread_for(self.alice.id), conversation.unread_for(self.bob.id)), (0, 1))
+
+    def test_replying_clears_the_senders_badge(self):
+        for text in ('one', 'two', 'three'):
+            PrivateMessage.objects.create(sender=self.bob, receiver=self.alice, content=text)
+        self.assertEqual(counters.unread_total(self.alice), 3)
+
+        PrivateMessage.objects.create(sender=self.alice, receiver=self.bob, content='hi bob')
+        self.assertEqual(counters.unread_total(self.alice), 0)
+        self.assertEqual(counters.unread_total(self.alice), sum(counters.count_from_source(self.alice.id).values()))
+        self.assertEqual(counters.unread_total(self.bob), sum(counters.count_from_source(self.bob.id).values()))
+
+    def test_opening_a_thread_is_one_watermark_write(self):
+        for text in ('hi', 'there?'):
+            PrivateMessage.objects.create(sender=self.bob, receiver=self.alice, content=text)
+        self.assertEqual(counters.unread_total(self.alice), 2)
+
+        conversation = Conversation.find(self.alice.id, self.bob.id)
+        with CaptureQueriesContext(connection) as queries:
+            cleared = conversation.mark_read(self.alice.id)
+        self.assertEqual((cleared, len(queries)), (2, 1))
+        self.assertEqual(conversation.mark_read(self.alice.id), 0)
+        counters.mark_read(self.alice.id, chat=cleared)
+
+        PrivateMessage.objects.create(sender=self.bob, receiver=self.alice, content='hello?')
+        self.client.login(username='alice', password='testpass')
+        self.client.get(reverse('private_chat', args=[self.bob.id]))
+        self.assertEqual(counters.unread_total(self.alice), 0)
+        self.assertEqual(counters.count_from_source(self.alice.id)['unread_chat'], 0)
+
+    def test_threads_of_a_user_most_recent_first(self):
+        carol = CustomUser.objects.create_user(username='carol', password='testpass')
+        PrivateMessage.objects.create(sender=self.alice, receiver=self.bob, content='old')
+        PrivateMessage.objects.create(sender=carol, receiver=self.alice, content='new')
+        self.assertEqual([c.other_user_id(self.alice.id) for c in Conversation.for_user(self.alice.id)],
+                         [carol.id, self.bob.id])
+        self.assertEqual(Conversation.for_user(carol.id).count(), 1)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class DirectMessageConsumerTest(TransactionTestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user(username='alice', password='testpass')
+        self.bob = CustomUser.objects.create_user(username='bob', password='testpass')
+        self.conversation = Conversation.between(self.alice.id, self.bob.id)
+        PrivateMessage.objects.bulk_create([
+            PrivateMessage(sender=self.alice, receiver=self.bob, content=f'dm {i}', conversation=self.conversation,
+                           room_name=self.conversation.room_name, seq=i + 1)
+            for i in range(60)
+        ])
+        RoomSequence.objects.create(room=self.conversation.room_name, last_seq=60)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/dm/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_newest_page_first_then_older(self):
+        communicator = await self.connect(self.alice)
+        await communicator.send_json_to({'action': 'open', 'user_id': self.bob.id})
+        users = await communicator.receive_json_from()
+        self.assertEqual(users['conversation'], self.conversation.id)
+
+        newest = await communicator.receive_json_from()
+        self.assertEqual(newest['type'], 'history')
+        self.assertEqual(newest['conversation'], self.conversation.id)
+        self.assertEqual([m['message'] for m in newest['messages']], [f'dm {i}' for i in range(10, 60)])
+        self.assertTrue(newest['has_more'])
+
+        await communicator.send_json_to({'action': 'history_before', 'conversation': self.conversation.id,
+                                         'before': newest['messages'][0]['id']})
+        older = await communicator.receive_json_from()
+        self.assertEqual([m['message'] for m in older['messages']], [f'dm {i}' for i in range(10)])
+        self.assertFalse(older['has_more'])
+
+        await communicator.disconnect()
+
+    async def test_reopen_with_since_gets_only_missed_messages(self):
+        communicator = await self.connect(self.alice)
+        await communicator.send_json_to({'action': 'open', 'user_id': self.bob.id, 'since': 57})
+        await communicator.receive_json_from()  # users
+
+        frame = await communicator.receive_json_from()
+        self.assertEqual([m['message'] for m in frame['messages']], ['dm 57', 'dm 58', 'dm 59'])
+        await communicator.disconnect()
+
+    async def test_directory_has_both_users_and_unknown_users_are_refused(self):
+        communicator = await self.connect(self.alice)
+        await communicator.send_json_to({'action': 'open', 'user_id': self.bob.id})
+        users = await communicator.receive_json_from()
+        self.assertEqual([u['username'] for u in users['users']], ['alice', 'bob'])
+        await communicator.receive_json_from()  # history
+
+        await communicator.send_json_to({'action': 'open', 'user_id': 999999})
+        error = await communicator.receive_json_from()
+        self.assertEqual(error['type'], 'error')
+        await communicator.disconnect()
+
+    async def test_conversations_must_be_opened_before_sending(self):
+        communicator = await self.connect(self.alice)
+        await communicator.send_json_to({'action': 'send', 'conversation': self.conversation.id, 'message': 'hi'})
+        error = await communicator.receive_json_from()
+        self.assertEqual(error['type'], 'error')
+        self.assertEqual(await database_sync_to_async(PrivateMessage.objects.count)(), 60)
+        await communicator.disconnect()
+
+    async def test_one_socket_gets_every_conversation(self):
+        carol = await database_sync_to_async(CustomUser.objects.create_user)(username='carol', password='testpass')
+        alice = await self.connect(self.alice)
+        bob = await self.connect(self.bob)
+        carol_socket = await self.connect(carol)
+
+        #Bob and Carol each write to Alice; she never opened either thread
+        for socket, text in ((bob, 'from bob'), (carol_socket, 'from carol')):
+            await socket.send_json_to({'action': 'open', 'user_id': self.alice.id})
+            users = await socket.receive_json_from()
+            await socket.receive_json_from()  # history
+            await socket.send_json_to({'action': 'send', 'conversation': users['conversation'], 'message': text})
+
+        received = [await alice.receive_json_from() for _ in range(2)]
+        self.assertEqual([m['message'] for m in received], ['from bob', 'from carol'])
+        self.assertEqual(len({m['conversation'] for m in received}), 2)
+        self.assertEqual(received[0]['conversation'], self.conversation.id)
+        #The senders' own sockets get their message back too
+        self.assertEqual((await bob.receive_json_from())['message'], 'from bob')
+
+        for socket in (alice, bob, carol_socket):
+            await socket.disconnect()
+
+    async def test_malformed_frames_get_an_error_frame(self):
+        communicator = await self.connect(self.alice)
+        for text in ('{bad', '[1, 2]'):
+            await communicator.send_to(text_data=text)
+            self.assertEqual((await communicator.receive_json_from())['code'], 'invalid_frame')
+        await communicator.disconnect()
+
+    async def test_anonymous_users_are_refused(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/dm/')
+        communicator.scope['user'] = AnonymousUser()
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    CHAT_WRITE_BEHIND={'ENABLED': True, 'FLUSH_INTERVAL_MS': 60_000, 'BATCH_SIZE': 50, 'MAX_PENDING': 5},
+)
+class ChatWriteBehindTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = CustomUser.objects.create_user(username='teacher', password='testpass', is_teacher=True)
+        self.student = CustomUser.objects.create_user(username='student', password='testpass', is_student=True)
+        self.course = Course.objects.create(title='Chat Course', teacher=self.teacher)
+        Enrollment.objects.create(course=self.course, student=self.student)
+
+    def message(self, text):
+        return Message(course=self.course, sender=self.student, content=text,
+                       seq=RoomSequence.allocate(course_room(self.course.id)))
+
+    async def test_broadcast_before_insert_and_flush_on_disconnect(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.id}/')
+        communicator.scope['user'] = self.student
+        await communicator.connect()
+        await communicator.receive_json_from()  # users
+        await communicator.receive_json_from()  # history
+
+        await communicator.send_json_to({'message': 'hello class'})
+        frame = await communicator.receive_json_from()
+        self.assertFalse(await database_sync_to_async(Message.objects.exists)())
+
+        #A second socket joining now still sees the unsaved message in its history
+        other = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.id}/')
+        other.scope['user'] = self.teacher
+        await other.connect()
+        await other.receive_json_from()  # users
+        history = await other.receive_json_from()
+        self.assertEqual([m['id'] for m in history['messages']], [frame['id']])
+        await other.disconnect()
+
+        saved = await database_sync_to_async(Message.objects.get)()
+        self.assertEqual(str(saved.public_id), frame['id'])
+        self.assertEqual(saved.timestamp.strftime('%H:%M'), frame['timestamp'])
+        await communicator.disconnect()
+
+    def test_local_sequences_number_without_the_database_and_flush_saves_them(self):
+        room = course_room(self.course.id)
+        RoomSequence.objects.create(room=room, last_seq=7)
+        with override_settings(CHAT_WRITE_BEHIND={'ENABLED': True, 'SEQUENCES': 'local'}):
+            self.assertEqual(writebehind.next_seq(self.course.id), 8)  # started from RoomSequence
+            with CaptureQueriesContext(connection) as queries:
+                seqs = [writebehind.next_seq(self.course.id) for _ in range(3)]
+            self.assertEqual((seqs, len(queries)), ([9, 10, 11], 0))
+
+            buffer = writebehind.get_buffer()
+            buffer._pending = [Message(course=self.course, sender=self.student, content=f'm{seq}', seq=seq)
+                               for seq in [8, *seqs]]
+            self.assertEqual(buffer.flush_sync(), 4)
+        #Rooms without write-behind carry on after the flushed numbers
+        self.assertEqual(RoomSequence.objects.get(room=room).last_seq, 11)
+        self.assertEqual(Message.objects.create(course=self.course, sender=self.student, content='db').seq, 12)
+
+    async def test_full_batch_is_written_with_one_insert(self):
+        buffer = writebehind.WriteBehindBuffer(flush_interval_ms=60_000, batch_size=3, max_pending=10)
+        for i in range(3):
+            await buffer.add(await database_sync_to_async(self.message)(f'm{i}'))
+        await asyncio.gather(*buffer._tasks)
+
+        self.assertEqual(await database_sync_to_async(Message.objects.count)(), 3)
+        metrics = buffer.metrics()
+        self.assertEqual((metrics['flushes'], metrics['written'], metrics['pending']), (1, 3, 0))
+
+    async def test_crash_loses_at_most_max_pending_messages(self):
+        buffer = writebehind.get_buffer()
+        for i in range(12):
+            await buffer.add(await database_sync_to_async(self.message)(f'm{i}'))
+
+        #Simulated crash: the process dies with the buffer as it is, nothing flushed
+        saved = await database_sync_to_async(Message.objects.count)()
+        lost = buffer.unsaved
+        self.assertEqual(saved + lost, 12)
+        self.assertLessEqual(lost, buffer.max_pending)
+        self.assertGreater(buffer.metrics()['backpressure_waits'], 0)
+        self.assertEqual(buffer.metrics()['max_unsaved'], buffer.max_pending)
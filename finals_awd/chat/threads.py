@@ -0,0 +1,89 @@
+from collections import namedtuple
+
+from django.db.models import Q
+from django.db.models.functions import Substr
+from django.utils.dateparse import parse_datetime
+
+from chat.models import Conversation
+
+
+# A user's DM threads, most recent first.
+# Everything a list row shows (the other user, a preview of the last message,
+# the unread count) is kept on Conversation itself, so a page is one query with
+# the users and last message joined however many rows it has. Older pages are
+# reached with a (last_activity, id) keyset cursor.
+#
+# Threads whose last message came from the other user also stand in for the
+# old one-row-per-message chat notifications (see as_notification).
+
+ThreadPage = namedtuple('ThreadPage', ['items', 'next_cursor'])
+
+#Characters of the last message shown in the list
+PREVIEW_LENGTH = 100
+
+USER_FIELDS = ('id', 'username', 'profile_picture', 'avatar_version')
+
+
+def encode_cursor(last_activity, pk):
+    return f"{last_activity.isoformat()}|{pk}"
+
+
+def decode_cursor(cursor):
+    """Return (last_activity, pk) or None for a missing/garbled cursor."""
+    try:
+        raw_time, raw_pk = cursor.split('|')
+        last_activity = parse_datetime(raw_time)
+        pk = int(raw_pk)
+    except (AttributeError, ValueError):
+        return None
+    if last_activity is None:
+        return None
+    return last_activity, pk
+
+
+def page(user, limit, cursor=None):
+    """One page of the user's threads, starting after `cursor` (from a previous page)."""
+    queryset = (
+        Conversation.for_user(user.id)
+        .filter(last_message__isnull=False)  # opened but never written to
+        .select_related('user_low', 'user_high', 'last_message')
+        .annotate(preview=Substr('last_message__content', 1, PREVIEW_LENGTH))
+        .only(
+            'last_activity', 'last_seq', 'last_read_low', 'last_read_high',
+            *(f'user_low__{f}' for f in USER_FIELDS), *(f'user_high__{f}' for f in USER_FIELDS),
+            'last_message__sender_id', 'last_message__timestamp',
+        )
+    )
+    decoded = decode_cursor(cursor) if cursor else None
+    if decoded:
+        last_activity, pk = decoded
+        queryset = queryset.filter(
+            Q(last_activity__lt=last_activity) | Q(last_activity=last_activity, id__lt=pk))
+
+    items = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1].last_activity, items[-1].pk)
+    return ThreadPage(items, next_cursor)
+
+
+def received(user):
+    """The user's threads whose last message was sent to them, as chat notifications."""
+    return (
+        Conversation.for_user(user.id)
+        .filter(last_message__isnull=False)
+        .exclude(last_message__sender_id=user.id)
+    )
+
+
+def as_notification(conversation, user_id):
+    """Give a thread the attributes chat notifications had in templates and the inbox."""
+    conversation.notification_type = 'chat'
+    conversation.sender = (conversation.user_high if conversation.user_low_id == user_id
+                           else conversation.user_low)
+    conversation.message = conversation.last_message.content
+    conversation.timestamp = conversation.last_activity
+    conversation.unread = conversation.unread_for(user_id)
+    conversation.is_read = conversation.unread <= 0
+    return conversation
@@ -2,7 +2,10 @@ from django.urls import path, include
 
 from .views import course_chat_view, chat_notifications_view
 from . import views
-from .api import private_chat_messages_api,chat_notifications_api, send_private_message
+from .api import (
+    private_chat_messages_api,chat_notifications_api, send_private_message, chat_users_api, conversations_api,
+    course_presence_api,
+)
 
 
 urlpatterns = [
@@ -15,9 +18,18 @@ urlpatterns = [
     #API for chat messages
     path('api/private_messages/', private_chat_messages_api, name='private_chat_messages_api'),
 
+    #API for the DM inbox, one row per conversation
+    path('api/conversations/', conversations_api, name='conversations_api'),
+
     #API for chat notifications
     path('api/chat_notifications/', chat_notifications_api, name='chat_notifications_api'),
 
+    #API for resolving chat user ids
+    path('api/users/', chat_users_api, name='chat_users_api'),
+
+    #API for who is online in a course chat
+    path('api/courses/<int:course_id>/online/', course_presence_api, name='course_presence_api'),
+
     #API for sending messages
     path('api/private-messages/send/', send_private_message, name='send_private_message'),
 
@@ -1,14 +1,15 @@
 from django.shortcuts import render, get_object_or_404
-from chat.models import ChatNotification
 from courses.models import Course
 from django.contrib.auth.decorators import login_required
 from accounts.models import CustomUser
-from .models import ChatNotification
+from .models import Conversation
+from . import threads
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from .models import Message
+from dashboard import counters
 
 # Create your views here.
 @login_required
@@ -26,8 +27,10 @@ def private_chat(request, user_id):
         return render(request,'chat/private_chat_invalid.html')
     
 
-    #Mark notifications as read
-    ChatNotification.objects.filter(sender = other_user, recipient = request.user, is_read = False).update(is_read = True)
+    #Mark the conversation as read: one watermark write
+    conversation = Conversation.find(request.user.id, other_user.id)
+    if conversation is not None:
+        counters.mark_read(request.user.id, chat=conversation.mark_read(request.user.id))
 
 
     return render(request,'chat/private_chat.html',{
@@ -37,8 +40,11 @@ def private_chat(request, user_id):
 
 @login_required
 def chat_notifications_view(request):
-    notifications = request.user.chat_notifications.order_by('-timestamp')
-    request.user.chat_notifications.filter(is_read = False).update(is_read = True)
+    notifications = [
+        threads.as_notification(note, request.user.id)
+        for note in threads.received(request.user).select_related('user_low', 'user_high', 'last_message')
+    ]
+    counters.mark_read(request.user.id, chat=Conversation.mark_all_read(request.user.id))
 
     return render(request, 'chat/chat_notifications.html',{
         'notifications':notifications
@@ -0,0 +1,322 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, IntegrityError, transaction
+from django.dispatch import receiver
+
+from .models import Message, RoomSequence, course_room
+
+logger = logging.getLogger(__name__)
+
+
+# Write-behind persistence for course chat.
+# In rooms where it is enabled (settings.CHAT_WRITE_BEHIND) ChatConsumer
+# broadcasts a message as soon as it arrives and leaves the INSERT to this
+# buffer, which writes pending messages with one bulk_create every
+# FLUSH_INTERVAL_MS, or as soon as BATCH_SIZE of them are waiting. Messages
+# carry their own public_id and timestamp, so nothing sent to clients waits
+# for the row.
+#
+# The buffer lives in the memory of each server process. A hard crash loses
+# the messages that were not written yet, and that is never more than
+# MAX_PENDING: once that many are unsaved, add() waits for a flush before
+# accepting another one. Sockets flush on disconnect and the process flushes
+# again at exit.
+#
+# Messages are numbered (seq) when they arrive, by SEQUENCES:
+#   'database'  RoomSequence.allocate, one UPDATE on the room's counter row
+#               per message, so the broadcast waits for a database round trip.
+#   'redis'     INCR on a per-room counter in the channel layer's Redis, shared
+#               by every server process; no database on the message path.
+#   'local'     a counter in process memory; only right with a single server
+#               process.
+# The last two start a room from RoomSequence (and this process's unsaved
+# messages), and every flush raises RoomSequence to the highest seq it wrote,
+# so rooms without write-behind carry on from there. A Redis counter expires
+# after SEQUENCE_TIMEOUT seconds without messages; turning write-behind off
+# for a room and on again sooner than that needs its chat:seq key deleted.
+
+DEFAULTS = {
+    'ENABLED': False,
+    'COURSES': [],
+    'FLUSH_INTERVAL_MS': 250,
+    'BATCH_SIZE': 200,
+    'MAX_PENDING': 2000,
+    'SEQUENCES': 'database',
+    'SEQUENCE_TIMEOUT': 24 * 60 * 60,
+    'REDIS_URL': None,  # defaults to the channel layer's first host
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_WRITE_BEHIND', {})}
+
+
+def enabled_for(course_id):
+    conf = config()
+    return conf['ENABLED'] or int(course_id) in conf['COURSES']
+
+
+class WriteBehindBuffer:
+    def __init__(self, flush_interval_ms=250, batch_size=200, max_pending=2000):
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        #Guards the lists below; flush_sync() can run outside the event loop
+        self._lock = threading.Lock()
+        self._pending = []
+        self._in_flight = []  # batches handed to the database, not committed yet
+        self._timer = None
+        self._timer_loop = None
+        self._tasks = set()
+
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+            'backpressure_waits': 0,
+            'max_unsaved': 0,
+            'last_flush_ms': 0.0,
+        }
+
+    @property
+    def unsaved(self):
+        """Messages accepted but not yet committed (what a crash right now would lose)."""
+        with self._lock:
+            return len(self._pending) + sum(len(batch) for batch in self._in_flight)
+
+    def metrics(self):
+        with self._lock:
+            pending = len(self._pending)
+            in_flight = sum(len(batch) for batch in self._in_flight)
+        return {**self.stats, 'pending': pending, 'in_flight': in_flight}
+
+    async def add(self, message):
+        """Queue an unsaved Message for the next flush."""
+        while self.unsaved >= self.max_pending:
+            # Full: the sender waits for the database instead of the buffer growing
+            self.stats['backpressure_waits'] += 1
+            if not await self.flush():
+                await asyncio.sleep(self.flush_interval)
+
+        with self._lock:
+            self._pending.append(message)
+            pending = len(self._pending)
+            unsaved = pending + sum(len(batch) for batch in self._in_flight)
+        self.stats['enqueued'] += 1
+        self.stats['max_unsaved'] = max(self.stats['max_unsaved'], unsaved)
+
+        if pending >= self.batch_size:
+            self._start_flush()
+        else:
+            self._schedule_flush()
+
+    def pending_for(self, course_id):
+        """Unsaved messages of one room, for history replay."""
+        with self._lock:
+            batches = self._in_flight + [self._pending]
+            return [m for batch in batches for m in batch if m.course_id == course_id]
+
+    async def flush(self):
+        """Write everything pending now. Returns the number of rows written."""
+        batch = self._take()
+        if not batch:
+            return 0
+        return await database_sync_to_async(self._write)(batch)
+
+    def flush_sync(self):
+        return self._write(self._take())
+
+    def _schedule_flush(self):
+        loop = asyncio.get_running_loop()
+        if self._timer is not None and self._timer_loop is loop:
+            return
+        self._timer_loop = loop
+        self._timer = loop.call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        #Hold a reference until it finishes so the task isn't garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _take(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+            if batch:
+                self._in_flight.append(batch)
+        return batch
+
+    def _write(self, batch):
+        if not batch:
+            return 0
+        start = time.perf_counter()
+        written = 0
+        try:
+            #The rows and their rooms' counters, all or nothing
+            with transaction.atomic():
+                try:
+                    with transaction.atomic():
+                        Message.objects.bulk_create(batch)
+                    count = len(batch)
+                except IntegrityError:
+                    # e.g. the course was deleted meanwhile: keep every row that still fits
+                    count = self._write_one_by_one(batch)
+                self._advance_sequences(batch)
+            written = count
+        except DatabaseError:
+            self.stats['failed_flushes'] += 1
+            logger.exception("chat write-behind flush of %d message(s) failed, will retry", len(batch))
+            with self._lock:
+                self._pending[:0] = batch
+        finally:
+            with self._lock:
+                self._in_flight = [b for b in self._in_flight if b is not batch]
+
+        self.stats['flushes'] += 1
+        self.stats['written'] += written
+        self.stats['last_flush_ms'] = (time.perf_counter() - start) * 1000
+        logger.debug("chat write-behind flushed %d message(s) in %.1fms",
+                     written, self.stats['last_flush_ms'])
+        return written
+
+    def _advance_sequences(self, batch):
+        last = {}
+        for message in batch:
+            last[message.course_id] = max(last.get(message.course_id, 0), message.seq)
+        for course_id, seq in last.items():
+            RoomSequence.advance(course_room(course_id), seq)
+
+    def _write_one_by_one(self, batch):
+        written = 0
+        for message in batch:
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+                written += 1
+            except IntegrityError:
+                self.stats['dropped'] += 1
+                logger.warning("chat write-behind dropped message %s", message.public_id)
+        return written
+
+
+class LocalSequences:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}
+
+    def next(self, room, start):
+        with self._lock:
+            if room not in self._rooms:
+                self._rooms[room] = start()
+            self._rooms[room] += 1
+            return self._rooms[room]
+
+
+class RedisSequences:
+    #INCR only a counter that exists, so a new one can be started from the database first
+    INCR_EXISTING = """
+        if redis.call('exists', KEYS[1]) == 1 then
+            local seq = redis.call('incr', KEYS[1])
+            redis.call('expire', KEYS[1], ARGV[1])
+            return seq
+        end
+        return false
+    """
+
+    def __init__(self, url, timeout):
+        import redis
+
+        self.timeout = timeout
+        self.client = redis.Redis.from_url(url)
+        self._incr = self.client.register_script(self.INCR_EXISTING)
+
+    def _key(self, room):
+        return f'chat:seq:{room}'
+
+    def next(self, room, start):
+        key = self._key(room)
+        seq = self._incr(keys=[key], args=[self.timeout])
+        if seq is None:
+            self.client.set(key, start(), nx=True, ex=self.timeout)
+            seq = self._incr(keys=[key], args=[self.timeout])
+        return int(seq)
+
+
+_buffer = None
+_sequences = None
+_sequences_lock = threading.Lock()
+
+
+def sequences():
+    """The configured counters, or None for 'database'."""
+    global _sequences
+    with _sequences_lock:
+        if _sequences is None:
+            conf = config()
+            if conf['SEQUENCES'] == 'local':
+                _sequences = LocalSequences()
+            elif conf['SEQUENCES'] == 'redis':
+                url = conf['REDIS_URL'] or settings.CHANNEL_LAYERS['default']['CONFIG']['hosts'][0]
+                _sequences = RedisSequences(url, conf['SEQUENCE_TIMEOUT'])
+            elif conf['SEQUENCES'] == 'database':
+                _sequences = False
+            else:
+                raise ValueError(f"Unknown CHAT_WRITE_BEHIND sequences {conf['SEQUENCES']!r}")
+        return _sequences or None
+
+
+def next_seq(course_id):
+    """Number a write-behind message of a course chat room (see SEQUENCES above)."""
+    room = course_room(course_id)
+    if sequences() is None:
+        return RoomSequence.allocate(room)
+
+    def start():
+        # Where the room's counter left off, past anything this process hasn't written yet
+        last = RoomSequence.objects.filter(room=room).values_list('last_seq', flat=True).first() or 0
+        return max([last, *(message.seq for message in get_buffer().pending_for(course_id))])
+
+    return sequences().next(room, start)
+
+
+def get_buffer():
+    """The process-wide buffer, built from settings on first use."""
+    global _buffer
+    if _buffer is None:
+        conf = config()
+        _buffer = WriteBehindBuffer(
+            flush_interval_ms=conf['FLUSH_INTERVAL_MS'],
+            batch_size=conf['BATCH_SIZE'],
+            max_pending=conf['MAX_PENDING'],
+        )
+    return _buffer
+
+
+@atexit.register
+def _flush_at_exit():
+    if _buffer is not None:
+        try:
+            _buffer.flush_sync()
+        except Exception:
+            logger.exception("chat write-behind flush at exit failed")
+
+
+@receiver(setting_changed)
+def _reset_buffer(setting, **kwargs):
+    global _buffer, _sequences
+    if setting == 'CHAT_WRITE_BEHIND':
+        _buffer = None
+        _sequences = None
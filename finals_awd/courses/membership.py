@@ -0,0 +1,59 @@
+from collections import namedtuple
+
+from django.core.cache import cache
+
+from courses.models import Course, Enrollment
+
+
+# "Is this user the teacher of, or enrolled in, course X?"
+# Each user's course ids are loaded once and cached; courses.signals drops the
+# entry when an enrolment or a course's teacher changes, so checks on the hot
+# path are set lookups.
+#
+# The entry is dropped from the cache the writing process uses, so these
+# checks are only right if every process shares it: settings configure the
+# default cache on REDIS_URL, which multi-process deploys must set. A
+# per-process cache would let a removed student in, and keep a new one out,
+# for up to CACHE_TIMEOUT.
+
+Memberships = namedtuple('Memberships', ['taught', 'enrolled'])
+
+CACHE_TIMEOUT = 60 * 60
+
+
+def _cache_key(user_id):
+    return f'course_membership:{user_id}'
+
+
+def memberships(user_id):
+    """Course ids the user teaches and is enrolled in, as frozensets."""
+    key = _cache_key(user_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return Memberships(*cached)
+
+    result = Memberships(
+        taught=frozenset(Course.objects.filter(teacher_id=user_id).values_list('id', flat=True)),
+        enrolled=frozenset(Enrollment.objects.filter(student_id=user_id).values_list('course_id', flat=True)),
+    )
+    cache.set(key, tuple(result), CACHE_TIMEOUT)
+    return result
+
+
+def is_enrolled(user, course_id):
+    if not user.is_authenticated:
+        return False
+    return int(course_id) in memberships(user.id).enrolled
+
+
+def is_member(user, course_id):
+    """True for the course's teacher and its enrolled students."""
+    if not user.is_authenticated:
+        return False
+    taught, enrolled = memberships(user.id)
+    course_id = int(course_id)
+    return course_id in taught or course_id in enrolled
+
+
+def invalidate(*user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids if user_id is not None])
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:41
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_enrollments(apps, schema_editor):
+    # Keep the earliest enrolment of each (student, course) pair
+    Enrollment = apps.get_model("courses", "Enrollment")
+    keep = (
+        Enrollment.objects.values("student", "course")
+        .annotate(first_id=Min("id"))
+        .values_list("first_id", flat=True)
+    )
+    Enrollment.objects.exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("courses", "0005_course_image"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_enrollments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="enrollment",
+            constraint=models.UniqueConstraint(
+                fields=("student", "course"), name="unique_enrollment"
+            ),
+        ),
+    ]
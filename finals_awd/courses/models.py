@@ -21,6 +21,12 @@ class Enrollment(models.Model):
                                related_name='enrollments')
     enrolled_on = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            #One enrolment per student per course; also the (student, course) lookup index
+            models.UniqueConstraint(fields=['student', 'course'], name='unique_enrollment'),
+        ]
+
 class CourseMaterial(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE,
                                related_name='materials')
@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from courses import membership
+from courses.models import Course, Enrollment
+
+
+# Drop cached course memberships whenever they may have changed, once the
+# change is committed: a check that runs before that re-reads the old rows,
+# and would cache them again if the entry were dropped any earlier.
+
+def invalidate_on_commit(*user_ids):
+    transaction.on_commit(lambda: membership.invalidate(*user_ids))
+
+
+@receiver(post_save, sender=Enrollment)
+@receiver(post_delete, sender=Enrollment)
+def enrollment_changed(sender, instance, **kwargs):
+    invalidate_on_commit(instance.student_id)
+
+
+@receiver(pre_save, sender=Course)
+def remember_previous_teacher(sender, instance, **kwargs):
+    instance._previous_teacher_id = (
+        Course.objects.filter(pk=instance.pk).values_list('teacher_id', flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Course)
+def course_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_teacher_id', None)
+    if previous != instance.teacher_id:
+        invalidate_on_commit(previous, instance.teacher_id)
+
+
+@receiver(post_delete, sender=Course)
+def course_deleted(sender, instance, **kwargs):
+    invalidate_on_commit(instance.teacher_id)
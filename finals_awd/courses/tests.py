@@ -1,10 +1,14 @@
 from django.test import TestCase
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from accounts.models import CustomUser
 from django.contrib.auth import get_user_model
 from courses.models import Course, Enrollment
 from dashboard.models import Notification, StatusUpdate
+from dashboard import outbox
+from courses import membership
 # Create your tests here.
 
 
@@ -27,6 +31,8 @@ class EnrollmentTestCase(TestCase):
     def test_student_enrolled_and_teacher_notified(self):
         self.client.login(username='student1',password='pass')
         response = self.client.get(reverse('enroll_course', args=[self.course.id]))
+        #Notifications are delivered by the outbox worker
+        outbox.drain()
 
         self.assertEqual(response.status_code,302)
         self.assertTrue(Enrollment.objects.filter(course=self.course, student=self.student).exists())
@@ -55,6 +61,7 @@ class MaterialUploadTestCase(TestCase):
 
 
             })
+        outbox.drain()
             
         self.assertEqual(response.status_code,302)
         self.assertTrue(CourseMaterial.objects.filter(course=self.course, title='Lecture 1').exists())
@@ -83,6 +90,7 @@ class StatusUpdateTestCase(TestCase):
 
 class CourseParticipantsApiTest(APITestCase):
     def setUp(self):
+        cache.clear()
         self.teacher = CustomUser.objects.create_user(username='teacher', password='pass', is_teacher=True)
         self.student = CustomUser.objects.create_user(username='student', password='pass', is_student=True)
         self.course = Course.objects.create(title='Test Course', teacher=self.teacher)
@@ -106,4 +114,58 @@ class CourseParticipantsApiTest(APITestCase):
         self.client.login(username='outsider', password='pass')
         url = reverse('course_participants', args=[self.course.id])
         response = self.client.get(url)
-        self.assertEqual(response.status_code, 403)
\ No newline at end of file
+        self.assertEqual(response.status_code, 403)
+
+class EnrollmentConstraintTest(TestCase):
+    def test_student_cannot_enrol_twice(self):
+        teacher = User.objects.create_user(username='teacher1', password='pass', is_teacher=True)
+        student = User.objects.create_user(username='student1', password='pass', is_student=True)
+        course = Course.objects.create(title='Test Course', teacher=teacher)
+        Enrollment.objects.create(course=course, student=student)
+
+        with self.assertRaises(IntegrityError):
+            Enrollment.objects.create(course=course, student=student)
+
+
+class MembershipCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher1', password='pass', is_teacher=True)
+        self.student = User.objects.create_user(username='student1', password='pass', is_student=True)
+        self.course = Course.objects.create(title='Test Course', teacher=self.teacher)
+
+    def test_enrol_and_drop_update_cached_membership(self):
+        self.assertFalse(membership.is_member(self.student, self.course.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            enrollment = Enrollment.objects.create(course=self.course, student=self.student)
+        with self.assertNumQueries(2):
+            self.assertTrue(membership.is_enrolled(self.student, self.course.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(membership.is_member(self.student, self.course.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            enrollment.delete()
+        self.assertFalse(membership.is_member(self.student, self.course.id))
+
+    def test_membership_read_before_the_commit_is_dropped_after_it(self):
+        enrollment = Enrollment.objects.create(course=self.course, student=self.student)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                enrollment.delete()
+                # A request outside this transaction still sees the enrolment and caches it
+                cache.set(membership._cache_key(self.student.id), (frozenset(), frozenset([self.course.id])))
+                self.assertTrue(membership.is_member(self.student, self.course.id))
+        self.assertFalse(membership.is_member(self.student, self.course.id))
+
+    def test_teacher_change_updates_cached_membership(self):
+        other = User.objects.create_user(username='teacher2', password='pass', is_teacher=True)
+        self.assertTrue(membership.is_member(self.teacher, self.course.id))
+        self.assertFalse(membership.is_member(other, self.course.id))
+
+        self.course.teacher = other
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.save()
+
+        self.assertFalse(membership.is_member(self.teacher, self.course.id))
+        self.assertTrue(membership.is_member(other, self.course.id))
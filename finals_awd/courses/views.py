@@ -5,7 +5,9 @@ from .models import Course, CourseReview
 
 from .models import Enrollment,AssignmentSubmission
 
-from dashboard.models import Notification
+from django.db import transaction
+from dashboard import outbox
+from courses import membership
 from accounts.models import CustomUser
 
 #For search 
@@ -45,16 +47,18 @@ def enroll_in_course(request, course_id):
     course = Course.objects.get(id=course_id)
 
     if request.user.is_student:
-        enrollment, created = Enrollment.objects.get_or_create(student=request.user, course=course)
-
-        if created:
-            # Only notify if this is a new enrolment (not a duplicate)
-            Notification.objects.create(
-                recipient=course.teacher,
-                course=course,
-                message=f"{request.user.username} has enrolled in your course: {course.title}.",
-                notification_type='enrolment'
-            )
+        with transaction.atomic():
+            enrollment, created = Enrollment.objects.get_or_create(student=request.user, course=course)
+
+            if created:
+                # Only notify if this is a new enrolment (not a duplicate)
+                outbox.enqueue(
+                    'notify.users',
+                    recipient_ids=[course.teacher_id],
+                    course_id=course.id,
+                    message=f"{request.user.username} has enrolled in your course: {course.title}.",
+                    notification_type='enrolment'
+                )
 
     return redirect('course_detail', course_id=course.id)
 
@@ -69,13 +73,11 @@ def upload_material(request, course_id):
         if form.is_valid():
             material = form.save(commit=False)
             material.course = course
-            material.save()
-            students = CustomUser.objects.filter(enrollments__course = course,
-                                                 is_student = True).distinct()
-            for student in students:
-                Notification.objects.create(
-                    recipient = student,
-                    course = course,
+            with transaction.atomic():
+                material.save()
+                outbox.enqueue(
+                    'notify.course_students',
+                    course_id = course.id,
                     message = f"New file \"{material.title}\" uploaded to {course.title}",
                     notification_type='material_upload'
                 )
@@ -97,10 +99,10 @@ def course_detail(request, course_id):
 
 
 
-    #check if student is enrolled
-    enrolled = Enrollment.objects.filter(course=course, student=request.user).exists()
+    #check if student is enrolled (cached per user, see courses.membership)
+    enrolled = membership.is_enrolled(request.user, course.id)
 
-    is_enrolled_user = request.user == course.teacher or enrolled
+    is_enrolled_user = membership.is_member(request.user, course.id)
 
     #Load existing review if it exists
     existing_review = CourseReview.objects.filter(course=course,student = request.user).first()
@@ -166,14 +168,16 @@ def drop_course(request, course_id):
     course = get_object_or_404(Course, id=course_id)
 
     if request.user.is_student:
-        Enrollment.objects.filter(student= request.user,course_id=course_id).delete()
-
-        #Notify course teacher
-        Notification.objects.create(
-            recipient = course.teacher,
-            course=course,
-            message = f"{request.user.username} has dropped your course: {course.title}"
-        )
+        with transaction.atomic():
+            Enrollment.objects.filter(student= request.user,course_id=course_id).delete()
+
+            #Notify course teacher
+            outbox.enqueue(
+                'notify.users',
+                recipient_ids=[course.teacher_id],
+                course_id=course.id,
+                message = f"{request.user.username} has dropped your course: {course.title}"
+            )
    
     return redirect('course_list')
 
@@ -182,16 +186,16 @@ def suspend_student(request,course_id, student_id):
     course = get_object_or_404(Course, id=course_id)
 
     if request.user == course.teacher and request.method =="POST":
-        Enrollment.objects.filter(course=course, student_id = student_id).delete()
-
-
-        #Notify student
-        student = CustomUser.objects.get(id=student_id)
-        Notification.objects.create(
-            recipient= student,
-            course = course,
-            message = f"You have been suspended from {course.title}"
-        )
+        with transaction.atomic():
+            Enrollment.objects.filter(course=course, student_id = student_id).delete()
+
+            #Notify student
+            outbox.enqueue(
+                'notify.users',
+                recipient_ids=[student_id],
+                course_id = course.id,
+                message = f"You have been suspended from {course.title}"
+            )
 
     return redirect('course_detail', course_id=course.id)
 
@@ -207,14 +211,16 @@ def submit_assignment(request, course_id):
             submission = form.save(commit=False)
             submission.course = course
             submission.student = request.user
-            submission.save()
-
-            Notification.objects.create(
-                recipient = course.teacher,
-                course = course,
-                message = f"{request.user.username} submitted an assignment for {course.title}.",
-                notification_type = 'assignment_submission'
-            )
+            with transaction.atomic():
+                submission.save()
+
+                outbox.enqueue(
+                    'notify.users',
+                    recipient_ids=[course.teacher_id],
+                    course_id = course.id,
+                    message = f"{request.user.username} submitted an assignment for {course.title}.",
+                    notification_type = 'assignment_submission'
+                )
             
 
             return redirect('course_detail', course_id = course.id)
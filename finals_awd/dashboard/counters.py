@@ -0,0 +1,85 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from chat.models import Conversation
+from dashboard import realtime
+from dashboard.models import Notification, NotificationCounter
+
+
+# Per-user unread counters for the notification badge.
+# Writes adjust a single NotificationCounter row so reading the badge is one
+# primary-key lookup instead of COUNT(*) over the notification tables.
+
+COUNTER_FIELDS = ('unread_notifications', 'unread_chat')
+
+
+def count_from_source(user_id):
+    """Recount unread items straight from the notification table and DM watermarks."""
+    return {
+        'unread_notifications': Notification.objects.filter(
+            recipient_id=user_id, is_read=False).count(),
+        'unread_chat': Conversation.unread_total(user_id),
+    }
+
+
+def get_counter(user_id):
+    """Return the user's counter row, seeding it from the source tables on first use."""
+    counter = NotificationCounter.objects.filter(user_id=user_id).first()
+    if counter is not None:
+        return counter
+    try:
+        with transaction.atomic():
+            return NotificationCounter.objects.create(
+                user_id=user_id, **count_from_source(user_id))
+    except IntegrityError:
+        # Another request seeded it first
+        return NotificationCounter.objects.get(user_id=user_id)
+
+
+def unread_total(user):
+    return get_counter(user.id).total_unread
+
+
+def adjust(user_id, notifications=0, chat=0):
+    """Add (or subtract, with negative values) unread items for one user."""
+    adjust_many([user_id], notifications=notifications, chat=chat)
+
+
+def adjust_many(user_ids, notifications=0, chat=0):
+    """Same as adjust() for a batch of users, in one UPDATE."""
+    deltas = {'unread_notifications': notifications, 'unread_chat': chat}
+    changes = {
+        field: Greatest(F(field) + delta, Value(0))
+        for field, delta in deltas.items() if delta
+    }
+    if not changes:
+        return
+    changes['version'] = F('version') + 1
+    # A missing row is left alone: it is seeded from the source tables on first read,
+    # which already reflect this change.
+    NotificationCounter.objects.filter(user_id__in=user_ids).update(**changes)
+
+
+def bump_version(*user_ids):
+    """Invalidate cached dropdowns after a change that leaves the unread counts as they are."""
+    NotificationCounter.objects.filter(user_id__in=user_ids).update(version=F('version') + 1)
+
+
+def mark_read(user_id, notifications=0, chat=0):
+    """Record that `notifications` / `chat` unread rows were just marked as read."""
+    if notifications or chat:
+        adjust(user_id, notifications=-notifications, chat=-chat)
+        realtime.push_unread(user_id)
+
+
+def rebuild(user_id):
+    """Overwrite the stored counts with a fresh recount. Returns the counter row."""
+    counts = count_from_source(user_id)
+    counter, created = NotificationCounter.objects.get_or_create(
+        user_id=user_id, defaults=counts)
+    if not created:
+        NotificationCounter.objects.filter(user_id=user_id).update(
+            version=F('version') + 1, **counts)
+        counter.refresh_from_db()
+    return counter
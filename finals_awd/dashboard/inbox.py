@@ -0,0 +1,117 @@
+from collections import namedtuple
+
+from django.db.models import F, Q, Value
+from django.utils.dateparse import parse_datetime
+
+from chat import threads
+from chat.models import Conversation
+from dashboard.models import Notification
+
+
+# Unified notification inbox.
+# Notifications and DM threads (one item per conversation whose last message
+# came from the other user, see chat.threads) are merged with
+# UNION ALL ... ORDER BY ... LIMIT so the database only hands back one page, and
+# older pages are reached with a keyset cursor instead of OFFSET.
+
+InboxPage = namedtuple('InboxPage', ['items', 'next_cursor'])
+
+NOTIFICATION = 'notification'
+CHAT = 'chat'
+
+# (kind, model, timestamp field) for every source merged into the inbox
+SOURCES = (
+    (NOTIFICATION, Notification, 'created_at'),
+    (CHAT, Conversation, 'last_activity'),
+)
+
+
+def _owned(kind, user):
+    """The user's rows of one source."""
+    if kind == CHAT:
+        return threads.received(user)
+    return Notification.objects.filter(recipient=user)
+
+
+def encode_cursor(sort_time, kind, pk):
+    return f"{sort_time.isoformat()}|{kind}|{pk}"
+
+
+def decode_cursor(cursor):
+    """Return (sort_time, kind, pk) or None for a missing/garbled cursor."""
+    try:
+        raw_time, kind, raw_pk = cursor.split('|')
+        sort_time = parse_datetime(raw_time)
+        pk = int(raw_pk)
+    except (AttributeError, ValueError):
+        return None
+    if sort_time is None or kind not in {k for k, _, _ in SOURCES}:
+        return None
+    return sort_time, kind, pk
+
+
+def _older_than(kind, time_field, cursor):
+    """Filter for rows of `kind` that sort after the cursor in (-time, -kind, -id) order."""
+    sort_time, cursor_kind, pk = cursor
+    if kind < cursor_kind:
+        return Q(**{f'{time_field}__lte': sort_time})
+    if kind > cursor_kind:
+        return Q(**{f'{time_field}__lt': sort_time})
+    return Q(**{f'{time_field}__lt': sort_time}) | Q(**{time_field: sort_time, 'id__lt': pk})
+
+
+def _merged_keys(user, limit, cursor=None):
+    branches = []
+    for kind, _, time_field in SOURCES:
+        qs = _owned(kind, user)
+        if cursor:
+            qs = qs.filter(_older_than(kind, time_field, cursor))
+        branches.append(
+            qs.order_by()
+            .annotate(kind=Value(kind), sort_time=F(time_field))
+            .values_list('kind', 'id', 'sort_time')
+        )
+    merged = branches[0].union(*branches[1:], all=True)
+    return list(merged.order_by('-sort_time', '-kind', '-id')[:limit])
+
+
+def _hydrate(user, keys):
+    """Load the model rows for the merged keys, keeping the merged order."""
+    ids = {kind: [] for kind, _, _ in SOURCES}
+    for kind, pk, _ in keys:
+        ids[kind].append(pk)
+
+    rows = {
+        NOTIFICATION: Notification.objects.select_related('course').in_bulk(ids[NOTIFICATION]),
+        CHAT: Conversation.objects.select_related('user_low', 'user_high', 'last_message').in_bulk(ids[CHAT]),
+    }
+
+    items = []
+    for kind, pk, sort_time in keys:
+        item = rows[kind].get(pk)
+        if item is None:
+            continue  # deleted between the two queries
+        if kind == CHAT:
+            threads.as_notification(item, user.id)
+        item.sort_time = sort_time
+        items.append(item)
+    return items
+
+
+def latest(user, limit):
+    """Newest `limit` notifications of any kind for the user."""
+    return _hydrate(user, _merged_keys(user, limit))
+
+
+def page(user, limit, cursor=None):
+    """One page of the inbox, starting after `cursor` (from a previous page)."""
+    decoded = decode_cursor(cursor) if cursor else None
+    keys = _merged_keys(user, limit + 1, decoded)
+
+    next_cursor = None
+    if len(keys) > limit:
+        keys = keys[:limit]
+        kind, pk, sort_time = keys[-1]
+        next_cursor = encode_cursor(sort_time, kind, pk)
+
+    return InboxPage(_hydrate(user, keys), next_cursor)
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import CustomUser
+from dashboard import counters
+from dashboard.models import NotificationCounter
+
+
+class Command(BaseCommand):
+    help = "Rebuild or check the per-user unread notification counters against the source tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only report counters that disagree with the source tables.")
+        parser.add_argument('--user', type=int, dest='user_ids', action='append',
+                            help="Limit to this user id (can be repeated).")
+
+    def handle(self, *args, check=False, user_ids=None, **options):
+        users = CustomUser.objects.order_by('id').values_list('id', flat=True)
+        if user_ids:
+            users = users.filter(id__in=user_ids)
+
+        stored = {
+            c.user_id: c
+            for c in NotificationCounter.objects.filter(user_id__in=users)
+        }
+
+        mismatched = missing = 0
+        for user_id in users.iterator():
+            counter = stored.get(user_id)
+            if counter is None:
+                # Not out of sync: counters.get_counter seeds it from the source tables on first read
+                missing += 1
+                continue
+            expected = counters.count_from_source(user_id)
+            actual = {field: getattr(counter, field) for field in counters.COUNTER_FIELDS}
+
+            if actual == expected:
+                continue
+            mismatched += 1
+
+            if check:
+                self.stdout.write(f"user {user_id}: stored {actual}, expected {expected}")
+            else:
+                counters.rebuild(user_id)
+
+        if missing:
+            self.stdout.write(f"{missing} user(s) without a counter yet, seeded on first read")
+        if check and mismatched:
+            raise CommandError(f"{mismatched} counter(s) out of sync")
+        verb = "out of sync" if check else "rebuilt"
+        self.stdout.write(self.style.SUCCESS(f"{mismatched} counter(s) {verb}"))
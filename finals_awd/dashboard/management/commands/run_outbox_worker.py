@@ -0,0 +1,64 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from dashboard import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Drain the outbox: claim pending side-effects in batches and run their handlers, "
+        "retrying failures with exponential backoff. Run it next to the web process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="Events handled in parallel per batch. Keep at 1 on SQLite.")
+        parser.add_argument('--visibility-timeout', type=int, default=outbox.VISIBILITY_TIMEOUT,
+                            help="Seconds a claimed event stays hidden before another worker may retry it.")
+        parser.add_argument('--max-attempts', type=int, default=outbox.MAX_ATTEMPTS)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when there is nothing to do.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the outbox is empty instead of polling.")
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        concurrency = max(1, options['concurrency'])
+        handled = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while self.running:
+                events = outbox.claim_batch(options['batch_size'], options['visibility_timeout'])
+                if not events:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                if concurrency == 1:
+                    results = [outbox.process_event(e, options['max_attempts']) for e in events]
+                else:
+                    results = list(pool.map(
+                        lambda e: self.process_in_thread(e, options['max_attempts']), events))
+
+                handled += len(results)
+                failed = results.count(False)
+                self.stdout.write(f"processed {len(results)} event(s), {failed} failed")
+
+        self.stdout.write(self.style.SUCCESS(f"outbox worker stopped after {handled} event(s)"))
+
+    def process_in_thread(self, event, max_attempts):
+        try:
+            return outbox.process_event(event, max_attempts)
+        finally:
+            connections.close_all()
+
+    def stop(self, signum, frame):
+        self.running = False
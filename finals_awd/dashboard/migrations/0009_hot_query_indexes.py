@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("courses", "0006_unique_enrollment"),
+        ("dashboard", "0008_outboxevent"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["recipient", "created_at", "id"],
+                name="notif_recipient_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("is_read", False)),
+                fields=["recipient", "created_at"],
+                name="notif_unread_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="statusupdate",
+            index=models.Index(fields=["posted_on"], name="status_posted_on_idx"),
+        ),
+    ]
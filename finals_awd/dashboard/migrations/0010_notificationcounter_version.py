@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("dashboard", "0009_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationcounter",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
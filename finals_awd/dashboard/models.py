@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 from accounts.models import CustomUser
 from courses.models import Course
 
@@ -11,6 +13,12 @@ class StatusUpdate(models.Model):
     content = models.TextField()
     posted_on = models.DateTimeField(auto_now_add= True)
 
+    class Meta:
+        indexes = [
+            #Dashboard feed: newest first
+            models.Index(fields=['posted_on'], name='status_posted_on_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}: {self.content[:30]}"
 
@@ -36,6 +44,15 @@ class Notification(models.Model):
         null=True
     )
 
+    class Meta:
+        indexes = [
+            #Inbox: a user's notifications by (created_at, id), see dashboard.inbox
+            models.Index(fields=['recipient', 'created_at', 'id'], name='notif_recipient_created_idx'),
+            #Unread counts and mark-as-read only touch unread rows
+            models.Index(fields=['recipient', 'created_at'], condition=Q(is_read=False),
+                         name='notif_unread_idx'),
+        ]
+
     def __str__(self):
         return f"To {self.recipient.username} - {self.message}"
     
@@ -50,4 +67,56 @@ class Comment(models.Model):
 
     def __str__(self):
         return f"{self.author.username} on {self.status.id}: {self.content[:30]}"
-    
\ No newline at end of file
+
+
+#Denormalized unread badge counts, kept in sync by dashboard.counters
+class NotificationCounter(models.Model):
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='notification_counter')
+    unread_notifications = models.PositiveIntegerField(default=0)
+    unread_chat = models.PositiveIntegerField(default=0)
+    #Bumped on every change, used to key cached dropdown fragments
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def total_unread(self):
+        return self.unread_notifications + self.unread_chat
+
+    def __str__(self):
+        return f"{self.user_id}: {self.total_unread} unread"
+
+
+#Side-effects queued in the same transaction as the change that caused them,
+#delivered later by the run_outbox_worker command (see dashboard.outbox)
+class OutboxEvent(models.Model):
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    #Earliest time the event may be (re)tried
+    available_at = models.DateTimeField(default=timezone.now)
+    #Visibility timeout: while set in the future, a worker owns the event
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=64, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='outbox_status_available_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} #{self.id} ({self.status})"
@@ -0,0 +1,109 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from dashboard.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+# Transactional outbox.
+# Views call enqueue() inside the same transaction as their main write, so the
+# side-effect is recorded if and only if that write commits. The
+# run_outbox_worker command claims pending events in batches and runs the
+# handler registered for each topic. Claiming uses plain UPDATEs with a
+# visibility timeout, so it works the same on SQLite and Postgres.
+
+MAX_ATTEMPTS = 5
+VISIBILITY_TIMEOUT = 60  # seconds a claimed event stays hidden from other workers
+RETRY_BASE_DELAY = 5  # seconds, doubled on each failed attempt
+RETRY_MAX_DELAY = 15 * 60
+
+HANDLERS = {}
+
+
+def handler(topic):
+    """Register the function that performs the side-effect for `topic`."""
+    def register(func):
+        HANDLERS[topic] = func
+        return func
+    return register
+
+
+def enqueue(topic, **payload):
+    """Record a side-effect to run after the current transaction commits."""
+    if topic not in HANDLERS:
+        raise ValueError(f"No outbox handler registered for {topic!r}")
+    return OutboxEvent.objects.create(topic=topic, payload=payload)
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY))
+
+
+def claim_batch(batch_size, visibility_timeout=VISIBILITY_TIMEOUT):
+    """Lock up to `batch_size` due events for this worker and return them."""
+    now = timezone.now()
+    due = (
+        OutboxEvent.objects
+        .filter(status=OutboxEvent.PENDING, available_at__lte=now)
+        .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+    )
+    candidate_ids = list(due.order_by('id').values_list('id', flat=True)[:batch_size])
+    if not candidate_ids:
+        return []
+
+    # The conditional UPDATE is the claim: a concurrent worker that got there
+    # first has already moved locked_until past `now`, so its rows are skipped.
+    token = uuid.uuid4().hex
+    due.filter(id__in=candidate_ids).update(
+        locked_by=token,
+        locked_until=now + timedelta(seconds=visibility_timeout),
+        attempts=F('attempts') + 1,
+    )
+    return list(OutboxEvent.objects.filter(locked_by=token).order_by('id'))
+
+
+def process_event(event, max_attempts=MAX_ATTEMPTS):
+    """Run one claimed event and record the outcome. Returns True on success."""
+    try:
+        func = HANDLERS[event.topic]
+        with transaction.atomic():
+            func(**event.payload)
+    except Exception as exc:
+        logger.exception("outbox event %s (%s) failed", event.id, event.topic)
+        failed = event.attempts >= max_attempts or event.topic not in HANDLERS
+        OutboxEvent.objects.filter(id=event.id).update(
+            status=OutboxEvent.FAILED if failed else OutboxEvent.PENDING,
+            available_at=timezone.now() + retry_delay(event.attempts),
+            locked_until=None,
+            last_error=repr(exc),
+        )
+        return False
+
+    OutboxEvent.objects.filter(id=event.id).update(
+        status=OutboxEvent.DONE,
+        processed_at=timezone.now(),
+        locked_until=None,
+        last_error='',
+    )
+    return True
+
+
+def drain(batch_size=50, max_batches=None, max_attempts=MAX_ATTEMPTS):
+    """Process due events in this thread until none are left. Returns the number handled."""
+    handled = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        events = claim_batch(batch_size)
+        if not events:
+            break
+        for event in events:
+            process_event(event, max_attempts)
+        handled += len(events)
+        batches += 1
+    return handled
@@ -0,0 +1,91 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.urls import reverse
+
+from dashboard.models import NotificationCounter
+
+logger = logging.getLogger(__name__)
+
+
+# Push new notifications and badge counts to the user's open pages over the
+# NotificationConsumer WebSocket. Pushes are sent after the transaction commits
+# and never raise: a missing channel layer only means pages wait for a reload.
+
+def notification_group(user_id):
+    return f'notifications_{user_id}'
+
+
+def notification_item(notification):
+    return {
+        'kind': 'notification',
+        'message': notification.message,
+        'notification_type': notification.notification_type,
+        'sender': None,
+        'url': None,
+        'time': notification.created_at.isoformat(),
+    }
+
+
+def chat_key(conversation_id):
+    """Dropdown row of a DM thread; a new message replaces the thread's row (see base.html)."""
+    return f'chat-{conversation_id}'
+
+
+def chat_item(private_message):
+    return {
+        'kind': 'chat',
+        'key': chat_key(private_message.conversation_id),
+        'message': private_message.content,
+        'notification_type': 'chat',
+        'sender': private_message.sender.username,
+        'url': reverse('private_chat', args=[private_message.sender_id]),
+        'time': private_message.timestamp.isoformat(),
+    }
+
+
+def _unread_counts(user_ids):
+    return dict(
+        (c.user_id, c.total_unread)
+        for c in NotificationCounter.objects.filter(user_id__in=user_ids)
+    )
+
+
+async def _group_send_all(channel_layer, messages):
+    for user_id, message in messages:
+        await channel_layer.group_send(
+            notification_group(user_id),
+            {'type': 'notification.push', 'payload': message},
+        )
+
+
+def _send(user_ids, payload):
+    # Read counts at send time so they include everything committed so far
+    unread = _unread_counts(user_ids)
+    messages = []
+    for user_id in user_ids:
+        message = dict(payload)
+        if user_id in unread:
+            message['unread'] = unread[user_id]
+        messages.append((user_id, message))
+
+    try:
+        channel_layer = get_channel_layer()
+        if channel_layer is not None:
+            # One event-loop hop for the whole batch, not one per recipient
+            async_to_sync(_group_send_all)(channel_layer, messages)
+    except Exception:
+        logger.warning("notification push to %d user(s) failed", len(user_ids), exc_info=True)
+
+
+def push_item(user_ids, item):
+    """Send a new dropdown item (plus the fresh badge count) once the transaction commits."""
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: _send(user_ids, {'type': 'notification', 'item': item}))
+
+
+def push_unread(user_id):
+    """Send only the badge count, e.g. after notifications were marked read."""
+    transaction.on_commit(lambda: _send([user_id], {'type': 'unread'}))
@@ -0,0 +1,52 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from chat.models import PrivateMessage, private_message_recorded
+from dashboard import counters, realtime
+from dashboard.models import Notification
+
+
+# Keep the unread counters in step with single-row writes and push new items to open pages.
+# Bulk .update(is_read=True) calls and opening a DM thread call counters.mark_read directly.
+# Every change to what the dropdown shows bumps the counter version, which keys
+# its cached fragment and ETag (dashboard.views.notification_dropdown).
+
+@receiver(post_save, sender=Notification)
+def notification_created(sender, instance, created, **kwargs):
+    if created and not instance.is_read:
+        counters.adjust(instance.recipient_id, notifications=1)
+        realtime.push_item([instance.recipient_id], realtime.notification_item(instance))
+
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    if not instance.is_read:
+        counters.adjust(instance.recipient_id, notifications=-1)
+    else:
+        counters.bump_version(instance.recipient_id)
+
+
+@receiver(post_save, sender=PrivateMessage)
+def private_message_sent(sender, instance, created, **kwargs):
+    # A new DM is unread for its receiver until they move their watermark past it
+    if created and instance.sender_id != instance.receiver_id:
+        counters.adjust(instance.receiver_id, chat=1)
+        realtime.push_item([instance.receiver_id], realtime.chat_item(instance))
+    elif not created:
+        # An edited message may be what a thread's dropdown row shows
+        counters.bump_version(instance.sender_id, instance.receiver_id)
+
+
+@receiver(post_delete, sender=PrivateMessage)
+def private_message_deleted(sender, instance, **kwargs):
+    counters.bump_version(instance.sender_id, instance.receiver_id)
+
+
+@receiver(private_message_recorded)
+def private_message_recorded_for_sender(sender, message, cleared, **kwargs):
+    # Replying moved the sender's watermark past the other side's messages, and
+    # took the thread out of their dropdown (it only lists threads the other side spoke last in)
+    if cleared:
+        counters.mark_read(message.sender_id, chat=cleared)
+    else:
+        counters.bump_version(message.sender_id)
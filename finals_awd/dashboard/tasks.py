@@ -0,0 +1,24 @@
+from accounts.models import CustomUser
+from dashboard import fanout, outbox
+
+
+# Outbox handlers for notification side-effects (see dashboard.outbox)
+
+@outbox.handler('notify.users')
+def notify_users(recipient_ids, message, course_id=None, notification_type=None):
+    fanout.notify(recipient_ids, message, course=course_id, notification_type=notification_type)
+
+
+@outbox.handler('notify.course_students')
+def notify_course_students(course_id, message, notification_type=None):
+    students = CustomUser.objects.filter(enrollments__course_id=course_id,
+                                         is_student=True).distinct()
+    fanout.notify(students, message, course=course_id, notification_type=notification_type)
+
+
+@outbox.handler('notify.course_participants')
+def notify_course_participants(course_ids, exclude_user_id, message, notification_type=None):
+    participants = CustomUser.objects.filter(
+        enrollments__course_id__in=course_ids
+    ).exclude(id=exclude_user_id).distinct()
+    fanout.notify(participants, message, notification_type=notification_type)
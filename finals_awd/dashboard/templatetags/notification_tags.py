@@ -1,8 +1,10 @@
 from django import template
 
+from dashboard import counters
+
 register = template.Library()
 
 @register.simple_tag
 
 def unread_notifications_count(user):
-    return user.notifications.filter(is_read = False).count()
\ No newline at end of file
+    return counters.get_counter(user.id).unread_notifications
@@ -1,7 +1,16 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase
+from django.core.cache import cache
 from rest_framework.test import APITestCase
 from django.urls import reverse
 from accounts.models import CustomUser
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from chat.models import PrivateMessage
+from django.utils import timezone
+from dashboard import counters, fanout, inbox, outbox, realtime
+from dashboard.models import Notification, OutboxEvent
+from dashboard.context_processors import merged_notifications
 
 class CurrentUserApiTest(APITestCase):
     def setUp(self):
@@ -16,3 +25,210 @@ class CurrentUserApiTest(APITestCase):
     def test_user_api_unauthenticated(self):
         response = self.client.get(reverse('user_api'))
         self.assertEqual(response.status_code, 403)
+
+
+class NotificationCounterTest(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='password123')
+        self.sender = CustomUser.objects.create_user(username='writer', password='password123')
+
+    def test_counter_tracks_create_read_and_delete(self):
+        first = Notification.objects.create(recipient=self.user, message='one')
+        Notification.objects.create(recipient=self.user, message='two')
+        PrivateMessage.objects.create(sender=self.sender, receiver=self.user, content='hi')
+        self.assertEqual(counters.unread_total(self.user), 3)
+
+        first.delete()
+        self.assertEqual(counters.unread_total(self.user), 2)
+
+        self.client.login(username='reader', password='password123')
+        self.client.get(reverse('all_notifications'))
+        self.assertEqual(counters.unread_total(self.user), 0)
+
+    def test_check_and_rebuild_command(self):
+        Notification.objects.create(recipient=self.user, message='one')
+        counters.get_counter(self.user.id)
+        # Simulate drift from a write that bypassed signals
+        Notification.objects.bulk_create([Notification(recipient=self.user, message='two')])
+
+        with self.assertRaises(CommandError):
+            call_command('notification_counters', '--check', stdout=StringIO())
+
+        call_command('notification_counters', stdout=StringIO())
+        self.assertEqual(counters.get_counter(self.user.id).unread_notifications, 2)
+
+    def test_check_passes_for_users_without_a_counter_yet(self):
+        Notification.objects.create(recipient=self.user, message='one')
+        counters.get_counter(self.user.id)
+
+        out = StringIO()
+        call_command('notification_counters', '--check', stdout=out)
+        self.assertIn('1 user(s) without a counter yet', out.getvalue())
+        self.assertIn('0 counter(s) out of sync', out.getvalue())
+
+
+class NotificationInboxTest(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='password123')
+        self.sender = CustomUser.objects.create_user(username='writer', password='password123')
+        # One chat item per conversation, so each chat comes from someone else
+        for i in range(4):
+            sender = CustomUser.objects.create_user(username=f'writer{i}', password='password123')
+            Notification.objects.create(recipient=self.user, message=f'note {i}')
+            PrivateMessage.objects.create(sender=sender, receiver=self.user, content=f'chat {i}')
+
+    def test_latest_merges_both_kinds_newest_first(self):
+        items = inbox.latest(self.user, 3)
+        self.assertEqual([i.message for i in items], ['chat 3', 'note 3', 'chat 2'])
+        self.assertEqual(items[0].notification_type, 'chat')
+
+    def test_pages_cover_everything_once(self):
+        # Identical timestamps must still page deterministically
+        Notification.objects.update(created_at=timezone.now())
+        seen = []
+        cursor = None
+        while True:
+            page = inbox.page(self.user, 3, cursor)
+            seen.extend((i.notification_type, i.id) for i in page.items)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(len(set(seen)), 8)
+
+
+class NotificationFanoutTest(TestCase):
+    def setUp(self):
+        self.users = [
+            CustomUser.objects.create_user(username=f'student{i}', password='password123')
+            for i in range(5)
+        ]
+
+    def test_notify_writes_in_batches_and_bumps_counters(self):
+        counters.get_counter(self.users[0].id)
+
+        # recipient ids, 3 x (INSERT + counter UPDATE), SAVEPOINT/RELEASE
+        with self.assertNumQueries(1 + 3 * 2 + 2):
+            result = fanout.notify(CustomUser.objects.all(), message='hello', batch_size=2)
+
+        self.assertEqual(result.created, 5)
+        self.assertGreaterEqual(result.elapsed, 0)
+        self.assertEqual(Notification.objects.filter(message='hello').count(), 5)
+        self.assertEqual(counters.unread_total(self.users[0]), 1)
+
+
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='password123')
+
+    def test_drain_delivers_queued_notification(self):
+        event = outbox.enqueue('notify.users', recipient_ids=[self.user.id], message='queued')
+        self.assertFalse(Notification.objects.filter(message='queued').exists())
+
+        self.assertEqual(outbox.drain(), 1)
+
+        event.refresh_from_db()
+        self.assertEqual(event.status, OutboxEvent.DONE)
+        self.assertTrue(Notification.objects.filter(recipient=self.user, message='queued').exists())
+
+    def test_claimed_events_are_hidden_from_other_workers(self):
+        outbox.enqueue('notify.users', recipient_ids=[self.user.id], message='queued')
+        self.assertEqual(len(outbox.claim_batch(10)), 1)
+        self.assertEqual(outbox.claim_batch(10), [])
+
+    def test_failures_back_off_then_give_up(self):
+        def always_fails():
+            raise RuntimeError('boom')
+
+        outbox.handler('test.fail')(always_fails)
+        self.addCleanup(outbox.HANDLERS.pop, 'test.fail')
+        event = outbox.enqueue('test.fail')
+
+        with self.assertLogs('dashboard.outbox', 'ERROR'):
+            outbox.drain(max_attempts=2)
+        event.refresh_from_db()
+        self.assertEqual(event.status, OutboxEvent.PENDING)
+        self.assertEqual(event.attempts, 1)
+        self.assertGreater(event.available_at, timezone.now())
+        self.assertNotEqual(event.last_error, '')
+
+        OutboxEvent.objects.filter(id=event.id).update(available_at=timezone.now())
+        with self.assertLogs('dashboard.outbox', 'ERROR'):
+            outbox.drain(max_attempts=2)
+        event.refresh_from_db()
+        self.assertEqual(event.status, OutboxEvent.FAILED)
+
+    def test_worker_command_runs_once(self):
+        outbox.enqueue('notify.users', recipient_ids=[self.user.id], message='queued')
+        call_command('run_outbox_worker', '--once', stdout=StringIO())
+        self.assertTrue(Notification.objects.filter(message='queued').exists())
+
+
+class NotificationDropdownTest(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='password123')
+        self.client.login(username='reader', password='password123')
+        Notification.objects.create(recipient=self.user, message='first')
+        cache.clear()
+
+    def test_fragment_is_cached_until_a_write(self):
+        url = reverse('notification_dropdown')
+        response = self.client.get(url)
+        self.assertContains(response, 'first')
+
+        # Session, user and counter lookups only: the inbox query is skipped
+        with self.assertNumQueries(3):
+            cached = self.client.get(url)
+        self.assertEqual(cached.content, response.content)
+
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        Notification.objects.create(recipient=self.user, message='second')
+        fresh = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(fresh, 'second')
+
+    def test_etag_changes_with_a_threads_last_message(self):
+        url = reverse('notification_dropdown')
+        sender = CustomUser.objects.create_user(username='sender', password='password123')
+        PrivateMessage.objects.create(sender=sender, receiver=self.user, content='question?')
+        self.client.get(reverse('private_chat', args=[sender.id]))  # read it: no unread left to clear
+        before = self.client.get(url)
+        self.assertContains(before, 'question?')
+
+        # The reply clears nothing, but the thread leaves the reader's dropdown
+        PrivateMessage.objects.create(sender=self.user, receiver=sender, content='answer')
+        after = self.client.get(url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        self.assertNotContains(after, 'question?')
+
+    def test_deleting_a_read_notification_changes_the_etag(self):
+        url = reverse('notification_dropdown')
+        note = Notification.objects.get(message='first')
+        Notification.objects.filter(pk=note.pk).update(is_read=True)
+        before = self.client.get(url)
+        note.refresh_from_db()
+        note.delete()
+        after = self.client.get(url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertNotContains(after, 'first')
+
+    def test_live_chat_items_replace_their_threads_row(self):
+        sender = CustomUser.objects.create_user(username='sender', password='password123')
+        messages = [PrivateMessage.objects.create(sender=sender, receiver=self.user, content=f'dm {i}')
+                    for i in range(5)]
+        keys = {realtime.chat_item(message)['key'] for message in messages}
+        self.assertEqual(keys, {realtime.chat_key(messages[0].conversation_id)})
+
+        # The fetched fragment has the same key on the thread's single row
+        response = self.client.get(reverse('notification_dropdown'))
+        self.assertContains(response, f'data-key="{keys.pop()}"', count=1)
+        self.assertContains(response, 'first')
+
+    def test_context_processor_is_lazy(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            context = merged_notifications(request)
+        self.assertEqual(context['total_unread_notifications'], 1)
@@ -1,7 +1,7 @@
 from django.urls import path
 
 from dashboard import views
-from .views import dashboard_view, view_notifications, all_notifications_view
+from .views import dashboard_view, view_notifications, all_notifications_view, notification_dropdown
 
 from .api import current_user_api, user_notifications_api
 
@@ -11,6 +11,9 @@ urlpatterns=[
 
     path('notifications/all/', all_notifications_view, name='all_notifications'),
 
+    #Cached dropdown fragment loaded by base.html
+    path('notifications/dropdown/', notification_dropdown, name='notification_dropdown'),
+
     #Show more(partial) status updates
     path('status/load_more/', views.load_more_statuses, name='load_more_statuses'),
 
@@ -6,14 +6,21 @@ from .forms import StatusUpdateForm, CommentForm
 
 from .models import Notification
 
+from dashboard import counters, inbox, outbox
 from dashboard.models import Notification
-from chat.models import ChatNotification
+from chat.models import Conversation
 from accounts.models import CustomUser
-from itertools import chain
-from operator import attrgetter
 
-from django.http import JsonResponse
+from django.db import transaction
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
 from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+
+from .context_processors import DROPDOWN_SIZE
+
+NOTIFICATIONS_PAGE_SIZE = 30
+DROPDOWN_CACHE_TIMEOUT = 60 * 60
 
 @login_required
 def dashboard_view(request):
@@ -38,19 +45,16 @@ def dashboard_view(request):
             if form.is_valid():
                 status = form.save(commit=False)
                 status.user = user
-                status.save()
-
-                participants = CustomUser.objects.filter(
-                    enrollments__course__in=courses
-                ).distinct()
-
-                for participant in participants:
-                    if participant != user:
-                        Notification.objects.create(
-                            recipient=participant,
-                            message=f"{user.username} posted: \"{status.content[:50]}...\"",
-                            notification_type='status_post'
-                        )
+                with transaction.atomic():
+                    status.save()
+
+                    outbox.enqueue(
+                        'notify.course_participants',
+                        course_ids=[course.id for course in courses],
+                        exclude_user_id=user.id,
+                        message=f"{user.username} posted: \"{status.content[:50]}...\"",
+                        notification_type='status_post'
+                    )
 
                 return redirect('dashboard')
 
@@ -60,14 +64,16 @@ def dashboard_view(request):
                 comment = comment_form.save(commit=False)
                 comment.author = user
                 comment.status_id = request.POST.get('status_id')
-                comment.save()
-
-                if comment.status.user != user:
-                    Notification.objects.create(
-                        recipient=comment.status.user,
-                        message=f"{user.username} commented on your status: \"{comment.content[:50]}...\"",
-                        notification_type='status_comment'
-                    )
+                with transaction.atomic():
+                    comment.save()
+
+                    if comment.status.user != user:
+                        outbox.enqueue(
+                            'notify.users',
+                            recipient_ids=[comment.status.user_id],
+                            message=f"{user.username} commented on your status: \"{comment.content[:50]}...\"",
+                            notification_type='status_comment'
+                        )
 
                 return redirect('dashboard')
 
@@ -96,31 +102,45 @@ def load_more_statuses(request):
 @login_required
 def view_notifications(request):
     notifications = request.user.notifications.all().order_by('-created_at')
-    request.user.notifications.filter(is_read=False).update(is_read=True)
+    marked = request.user.notifications.filter(is_read=False).update(is_read=True)
+    counters.mark_read(request.user.id, notifications=marked)
     return render(request, 'dashboard/notifications.html', {'notifications': notifications})
 
 @login_required
 def all_notifications_view(request):
-    notif = Notification.objects.filter(recipient=request.user)
-    chat = ChatNotification.objects.filter(recipient=request.user)
-
-    for n in notif:
-        n.sort_time = n.created_at
-
-    for c in chat:
-        c.notification_type = 'chat'
-        c.sort_time = c.timestamp
-
-    merged = sorted(
-        chain(notif, chat),
-        key=attrgetter('sort_time'),
-        reverse=True
-    )
+    page = inbox.page(request.user, NOTIFICATIONS_PAGE_SIZE, request.GET.get('before'))
 
     # Mark all as read
-    notif.filter(is_read=False).update(is_read=True)
-    chat.filter(is_read=False).update(is_read=True)
+    counters.mark_read(
+        request.user.id,
+        notifications=Notification.objects.filter(recipient=request.user, is_read=False).update(is_read=True),
+        chat=Conversation.mark_all_read(request.user.id),
+    )
 
     return render(request, 'dashboard/all_notifications.html', {
-        'notifications': merged
-    })
\ No newline at end of file
+        'notifications': page.items,
+        'next_cursor': page.next_cursor,
+    })
+
+
+#Dropdown fragment for base.html, cached per user and notification version
+@login_required
+def notification_dropdown(request):
+    version = counters.get_counter(request.user.id).version
+    etag = f'"{request.user.id}-{version}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    # Any notification write bumps the version, so old entries are never read again
+    key = f'notification_dropdown:{request.user.id}:{version}'
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string('dashboard/partials/notification_dropdown.html', {
+            'notifications': inbox.latest(request.user, DROPDOWN_SIZE),
+        }, request=request)
+        cache.set(key, html, DROPDOWN_CACHE_TIMEOUT)
+
+    response = HttpResponse(html)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,19 @@
+from django.views.static import serve
+
+# Media view for development only: urls.py routes it through static(), which
+# adds no routes unless DEBUG is on. In production media comes from Cloudinary
+# (or whatever serves MEDIA_ROOT), and none of this runs.
+#
+# Only avatar URLs are versioned (CustomUser.avatar_url adds ?v=<avatar_version>,
+# which changes with every upload), so only they may be cached for good. Other
+# uploads can reappear under the same name once the old file is deleted, and
+# keep the default headers.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+VERSIONED_PREFIX = "profiles/"
+
+
+def serve_media(request, path, document_root=None):
+    response = serve(request, path, document_root=document_root)
+    if response.status_code == 200 and path.startswith(VERSIONED_PREFIX) and request.GET.get("v"):
+        response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import json
 import dj_database_url  # pip install dj-database-url
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -128,6 +129,10 @@ else:
     }
 
 # --- Media Files Configuration ---
+# Django serves media itself only with DEBUG on (elearning_platform/media.py,
+# which also sets the long-lived Cache-Control on versioned avatar URLs). In
+# production Cloudinary serves it with its own cache headers; avatar URLs
+# still carry ?v=<avatar_version>, so a new upload gets a new URL.
 MEDIA_URL = "/media/"
 if not USE_CLOUDINARY:
     MEDIA_ROOT = BASE_DIR / "media"
@@ -170,6 +175,81 @@ CHANNEL_LAYERS = {
     }
 }
 
+# --- Cache ---
+# Course membership checks (courses/membership.py) are authorization decisions
+# cached here and dropped on every enrolment or teacher change, so all server
+# processes (gunicorn and daphne alike) must share one cache: any deploy with
+# more than one process needs REDIS_URL. Without it the cache is this
+# process's memory, which is only right for a single process (runserver).
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+            "KEY_PREFIX": "elearning",
+        }
+    }
+
+# --- Course chat write-behind (see chat/writebehind.py) ---
+# Off by default. ENABLED turns it on for every room; COURSES lists course ids
+# to turn it on for individually (space separated in the env var).
+# SEQUENCES numbers messages with "redis" (the channel layer's Redis, no
+# database on the message path), "local" (one server process only) or
+# "database" (one UPDATE per message).
+CHAT_WRITE_BEHIND = {
+    "ENABLED": os.environ.get("CHAT_WRITE_BEHIND", "False").lower() == "true",
+    "COURSES": [int(c) for c in os.environ.get("CHAT_WRITE_BEHIND_COURSES", "").split()],
+    "FLUSH_INTERVAL_MS": int(os.environ.get("CHAT_WRITE_BEHIND_FLUSH_MS", "250")),
+    "BATCH_SIZE": int(os.environ.get("CHAT_WRITE_BEHIND_BATCH_SIZE", "200")),
+    "MAX_PENDING": int(os.environ.get("CHAT_WRITE_BEHIND_MAX_PENDING", "2000")),
+    "SEQUENCES": os.environ.get("CHAT_WRITE_BEHIND_SEQUENCES", "redis"),
+}
+
+# --- Course chat recent-message buffer (see chat/recent.py) ---
+# "local" keeps it in process memory, "redis" in the channel layer's Redis
+# (shared by every server process), "" turns it off.
+CHAT_RECENT_MESSAGES = {
+    "BACKEND": os.environ.get("CHAT_RECENT_BACKEND", "local"),
+    "SIZE": int(os.environ.get("CHAT_RECENT_SIZE", "50")),
+}
+
+# --- Chat inbound limits (see chat/ratelimit.py) ---
+# Rates are messages per second, bursts how many can be sent at once.
+# CHAT_RATE_LIMIT_COURSES overrides them per course as JSON, e.g.
+# {"12": {"USER_RATE": 5, "USER_BURST": 20}}.
+CHAT_RATE_LIMITS = {
+    "ENABLED": os.environ.get("CHAT_RATE_LIMITS", "True").lower() == "true",
+    "MAX_FRAME_BYTES": int(os.environ.get("CHAT_MAX_FRAME_BYTES", "16384")),
+    "MAX_MESSAGE_LENGTH": int(os.environ.get("CHAT_MAX_MESSAGE_LENGTH", "2000")),
+    "SOCKET_RATE": float(os.environ.get("CHAT_SOCKET_RATE", "1")),
+    "SOCKET_BURST": int(os.environ.get("CHAT_SOCKET_BURST", "5")),
+    "USER_RATE": float(os.environ.get("CHAT_USER_RATE", "2")),
+    "USER_BURST": int(os.environ.get("CHAT_USER_BURST", "10")),
+    "COURSES": json.loads(os.environ.get("CHAT_RATE_LIMIT_COURSES", "{}")),
+}
+
+# --- Chat outbound queues and heartbeat (see chat/outbound.py) ---
+# ON_STALL is "resync" (drop what a stalled client misses and tell it to
+# catch up from history) or "close". COALESCE_MS > 0 batches course chat
+# broadcasts arriving within that window into one frame.
+CHAT_OUTBOUND = {
+    "HIGH_WATER_BYTES": int(os.environ.get("CHAT_OUTBOUND_HIGH_WATER", str(1024 * 1024))),
+    "LOW_WATER_BYTES": int(os.environ.get("CHAT_OUTBOUND_LOW_WATER", str(256 * 1024))),
+    "ON_STALL": os.environ.get("CHAT_OUTBOUND_ON_STALL", "resync"),
+    "HEARTBEAT_INTERVAL": float(os.environ.get("CHAT_HEARTBEAT_INTERVAL", "20")),
+    "IDLE_TIMEOUT": float(os.environ.get("CHAT_IDLE_TIMEOUT", "60")),
+    "COALESCE_MS": float(os.environ.get("CHAT_COALESCE_MS", "0")),
+}
+
+# --- Course chat presence (see chat/presence.py) ---
+# "local" keeps it in process memory (one server process), "redis" in the
+# channel layer's Redis (shared by every server process).
+CHAT_PRESENCE = {
+    "BACKEND": os.environ.get("CHAT_PRESENCE_BACKEND", "local"),
+    "TTL": float(os.environ.get("CHAT_PRESENCE_TTL", "60")),
+    "DEBOUNCE_MS": float(os.environ.get("CHAT_PRESENCE_DEBOUNCE_MS", "500")),
+}
+
 # --- Email (dev) ---
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 DEFAULT_FROM_EMAIL = "noreply@example.com"
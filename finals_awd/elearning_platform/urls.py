@@ -6,6 +6,7 @@ from django.conf.urls.static import static
 from django.shortcuts import render
 
 from dashboard.api import current_user_api 
+from elearning_platform.media import serve_media
 
 
 #Swagger
@@ -39,4 +40,7 @@ path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name=
 path('courses/', include('courses.urls')),
 
 
-] + static(settings.MEDIA_URL, document_root = settings.MEDIA_ROOT)
+]
+
+#Media on local disk, in development only (static() adds nothing unless DEBUG is on)
+urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)